@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""Measure how fast yahoo.py archives each section of a synthetic group served by mockserver.py.
+
+Each section is archived into a fresh directory by its own process, so that the peak memory of one does not hide
+that of another, and reported with the requests and bytes served per second and the archiver's peak RSS.
+"""
+from __future__ import print_function, unicode_literals
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import mockserver
+
+SECTIONS = ('email', 'topics', 'files', 'photos', 'attachments', 'members', 'polls')
+ASYNC_SECTIONS = ('email', 'topics', 'attachments')
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None where it can't be found."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def archive_section(section, api_uri, group, workers=1, use_async=False):
+    """Archive section of group from the API at api_uri into the current directory."""
+    import yahoo
+    import yahoogroupsapi
+
+    # The topic crawl uses the module's client
+    yahoo.yga = yga = yahoogroupsapi.YahooGroupsAPI(group)
+    yga.BASE_URI = api_uri
+
+    with yahoo.Mkchdir(section):
+        if use_async:
+            import yahoo_async
+            from yahoogroupsapi_async import AsyncYahooGroupsAPI
+            ayga = AsyncYahooGroupsAPI(group)
+            ayga.BASE_URI = api_uri
+            if section == 'email':
+                yahoo_async.run(ayga, yahoo_async.archive_email(ayga))
+            elif section == 'topics':
+                yahoo_async.run(ayga, yahoo_async.archive_topics(ayga))
+            else:
+                yahoo_async.run(ayga, yahoo_async.archive_attachments(ayga))
+        elif section == 'email':
+            yahoo.archive_email(yga, workers=workers)
+        elif section == 'topics':
+            yahoo.archive_topics(yga, workers=workers)
+        elif section in ('photos', 'members'):
+            getattr(yahoo, 'archive_' + section)(yga, workers=workers)
+        else:
+            getattr(yahoo, 'archive_' + section)(yga)
+
+
+def run_child(conn, section, api_uri, group, workers, use_async, verbose):
+    import logging
+    logging.basicConfig(level=logging.INFO if verbose else logging.CRITICAL, stream=sys.stderr,
+                        format='%(asctime)s %(levelname)s %(name)s %(message)s')
+    error = None
+    start = time.time()
+    try:
+        archive_section(section, api_uri, group, workers, use_async)
+    except Exception as e:
+        error = '%s: %s' % (type(e).__name__, e)
+    conn.send({'seconds': time.time() - start, 'peak_rss': peak_rss(), 'error': error})
+    conn.close()
+
+
+def benchmark_section(server, section, workers=1, use_async=False, verbose=False):
+    """Archive section from server in a child process in a temporary directory. Returns the measurements."""
+    workdir = tempfile.mkdtemp(prefix='yga-benchmark-')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        before = server.stats()
+        parent, child = multiprocessing.Pipe()
+        p = multiprocessing.Process(target=run_child, args=(child, section, server.api_uri, server.group.name,
+                                                            workers, use_async, verbose))
+        p.start()
+        result = parent.recv()
+        p.join()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    after = server.stats()
+    requests = after['requests'] - before['requests']
+    size = after['bytes'] - before['bytes']
+    seconds = result['seconds']
+    return OrderedDict([('section', section), ('seconds', round(seconds, 3)), ('requests', requests),
+                        ('bytes', size), ('requests_per_second', round(requests / seconds, 1) if seconds else None),
+                        ('bytes_per_second', round(size / seconds) if seconds else None),
+                        ('peak_rss', result['peak_rss']), ('error', result['error'])])
+
+
+def run_benchmark(server, sections=SECTIONS, workers=1, use_async=False, verbose=False):
+    return [benchmark_section(server, s, workers, use_async and s in ASYNC_SECTIONS, verbose) for s in sections]
+
+
+def print_results(results):
+    print('%-12s %9s %9s %12s %10s %12s %10s' % (
+        'section', 'seconds', 'requests', 'bytes', 'req/s', 'bytes/s', 'peak MB'))
+    for r in results:
+        print('%-12s %9.2f %9d %12d %10s %12s %10s' % (
+            r['section'], r['seconds'], r['requests'], r['bytes'], r['requests_per_second'], r['bytes_per_second'],
+            '%.1f' % (r['peak_rss'] / 1048576.0) if r['peak_rss'] is not None else '-'))
+        if r['error']:
+            print('    failed: %s' % r['error'])
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description=__doc__)
+    p.add_argument('--sections', nargs='+', choices=SECTIONS, default=list(SECTIONS),
+                   help='Sections to benchmark (default all)')
+    p.add_argument('--workers', type=int, default=1,
+                   help='Number of messages, topics, photos or pages to fetch concurrently (default 1)')
+    p.add_argument('--async', dest='use_async', action='store_true',
+                   help='Use the asyncio client for the sections which support it')
+    p.add_argument('--json', type=str, help='Also save the results as JSON to this file')
+    p.add_argument('-v', '--verbose', action='store_true', help='Show the archiver\'s log output')
+    mockserver.add_group_arguments(p)
+    args = p.parse_args()
+
+    server = mockserver.server_from_args(args).start()
+    try:
+        results = run_benchmark(server, args.sections, args.workers, args.use_async, args.verbose)
+    finally:
+        server.stop()
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=4)
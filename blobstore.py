@@ -0,0 +1,84 @@
+from __future__ import unicode_literals
+import hashlib
+import io
+import os
+import shutil
+import threading
+
+
+class BlobStore(object):
+    """Content-addressed store for downloaded files.
+
+    Each distinct payload is kept once, as blobs/<first 2 hex digits>/<SHA-1>, and the files in the archive are
+    hard links to it (or symbolic links, or copies, where hard links aren't possible). The URL each blob was
+    downloaded from is recorded in urls.tsv, so that a URL is only ever fetched once. Safe to share between threads.
+    """
+    URLS_FILE = 'urls.tsv'
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.lock = threading.Lock()
+        self.urls = {}
+
+        if not os.path.isdir(self.path):
+            os.mkdir(self.path)
+
+        urls_name = os.path.join(self.path, self.URLS_FILE)
+        if os.path.exists(urls_name):
+            with io.open(urls_name, 'r', encoding='utf-8') as f:
+                for line in f:
+                    url, digest = line.rstrip('\n').rsplit('\t', 1)
+                    self.urls[url] = digest
+
+        self.urls_file = io.open(urls_name, 'a', encoding='utf-8')
+
+    def blob_path(self, digest):
+        return os.path.join(self.path, digest[:2], digest)
+
+    def lookup(self, url):
+        """Returns the digest of the blob downloaded from url, or None if it hasn't been downloaded (or has gone)."""
+        digest = self.urls.get(url)
+        if digest is not None and os.path.exists(self.blob_path(digest)):
+            return digest
+        return None
+
+    def add_file(self, fname, url=None):
+        """Move the downloaded file fname into the store, leaving a link in its place. Returns its digest."""
+        sha1 = hashlib.sha1()
+        with open(fname, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                sha1.update(chunk)
+        digest = sha1.hexdigest()
+        blob = self.blob_path(digest)
+
+        with self.lock:
+            if not os.path.isdir(os.path.dirname(blob)):
+                os.mkdir(os.path.dirname(blob))
+            if os.path.exists(blob):
+                os.remove(fname)
+            else:
+                os.rename(fname, blob)
+            if url is not None:
+                self.urls[url] = digest
+                self.urls_file.write('%s\t%s\n' % (url, digest))
+                self.urls_file.flush()
+
+        self.link(digest, fname)
+        return digest
+
+    def link(self, digest, fname):
+        """Make fname a link to the blob with the given digest."""
+        blob = self.blob_path(digest)
+        if os.path.lexists(fname):
+            os.remove(fname)
+        try:
+            os.link(blob, fname)
+        except (OSError, AttributeError):
+            try:
+                os.symlink(blob, fname)
+            except (OSError, AttributeError, NotImplementedError):
+                shutil.copyfile(blob, fname)
+
+    def close(self):
+        with self.lock:
+            self.urls_file.close()
@@ -0,0 +1,109 @@
+from __future__ import unicode_literals
+from contextlib import contextmanager
+import codecs
+import json
+import logging
+import os
+import signal
+import threading
+import time
+
+
+class TopicCheckpoint(object):
+    """Progress of archive_topics, saved to path so that an interrupted crawl can resume where it left off.
+
+    Holds the crawl's tracking sets, which the crawl works on directly, what it learnt from the message metadata
+    (including the position reached in it, only saved for the next incremental run once the crawl is complete), and
+    the previous and next topic IDs of each topic fully processed, so that a resumed crawl can follow them without
+    re-reading the saved topics. Saved as JSON at most every interval seconds as topics are done, and by save().
+    Safe to share between threads.
+    """
+    logger = logging.getLogger(name="TopicCheckpoint")
+
+    SETS = ('retrievedTopicIds', 'retrievedMessageIds', 'unretrievableTopicIds', 'unretrievableMessageIds',
+            'potentialMessageIds')
+
+    def __init__(self, path, interval=60):
+        self.path = os.path.abspath(path)
+        self.interval = interval
+        # Reentrant, as save() may be called from a signal handler while the main thread is saving
+        self.lock = threading.RLock()
+        self.saved = time.time()
+        self.incremental = False
+        self.metadata_state = None
+        self.expected_topics = 0
+        self.indexed_topic_ids = []
+        self.sets = dict((name, set()) for name in self.SETS)
+        self.links = {}
+
+    def load(self):
+        """Load the checkpoint left by an interrupted crawl. Returns False if there is none."""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'rb') as f:
+            state = json.load(codecs.getreader('utf-8')(f))
+        self.incremental = state['incremental']
+        self.metadata_state = state.get('metadataState')
+        self.expected_topics = state['expectedTopics']
+        self.indexed_topic_ids = state['indexedTopicIds']
+        for name in self.SETS:
+            self.sets[name] = set(state[name])
+        self.links = dict((int(topic_id), tuple(links)) for topic_id, links in state['topicLinks'].items())
+        # A topic retrieved but not done may not have had all its messages processed, so must be fetched again
+        self.sets['retrievedTopicIds'].intersection_update(self.links)
+        return True
+
+    def done(self, topic_id, prev_topic_id, next_topic_id):
+        """Record that topic_id and all its messages have been processed."""
+        with self.lock:
+            self.links[topic_id] = (prev_topic_id, next_topic_id)
+            if time.time() - self.saved >= self.interval:
+                self.save()
+
+    def save(self):
+        with self.lock:
+            state = {'incremental': self.incremental, 'metadataState': self.metadata_state,
+                     'expectedTopics': self.expected_topics,
+                     'indexedTopicIds': self.indexed_topic_ids,
+                     'topicLinks': dict((str(topic_id), links) for topic_id, links in list(self.links.items()))}
+            for name in self.SETS:
+                # Copied in one step, as other threads may be adding to them
+                state[name] = list(self.sets[name])
+            with open(self.path + '.tmp', 'wb') as f:
+                json.dump(state, codecs.getwriter('utf-8')(f))
+            os.rename(self.path + '.tmp', self.path)
+            self.saved = time.time()
+
+    def remove(self):
+        """Discard the checkpoint, once the crawl is complete."""
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    @contextmanager
+    def saved_on_signal(self):
+        """Save the checkpoint on SIGINT or SIGTERM, before the signal's usual handling, while in this context.
+           Has no effect outside the main thread, where signal handlers can't be installed."""
+        def handler(signum, frame):
+            self.logger.info("Saving checkpoint before exiting")
+            self.save()
+            previous = handlers[signum]
+            if callable(previous):
+                previous(signum, frame)
+            elif signum == signal.SIGINT:
+                raise KeyboardInterrupt()
+            else:
+                raise SystemExit(128 + signum)
+
+        handlers = {}
+        try:
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                handlers[signum] = signal.signal(signum, handler)
+        except ValueError:
+            pass
+        try:
+            yield
+        finally:
+            for signum, previous in handlers.items():
+                if previous is not None:
+                    signal.signal(signum, previous)
@@ -0,0 +1,6 @@
+import sys
+
+# The asyncio client is written for Python 3.6+, and is a syntax error on older versions
+collect_ignore = []
+if sys.version_info < (3, 6):
+    collect_ignore += ['test_yahoogroupsapi_async.py', 'yahoo_async.py', 'yahoogroupsapi_async.py']
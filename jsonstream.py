@@ -0,0 +1,196 @@
+from __future__ import unicode_literals
+import codecs
+import json
+import os
+
+
+class JSONStream(object):
+    """Incremental reader of a JSON document from a file object, for documents too large to parse at once.
+
+    Objects and arrays are walked with members() and elements(), which stop at each key or element for the caller to
+    read its value with value(), skip it with skip() or walk into it. Only one value is held in memory at a time.
+    """
+    CHUNK_SIZE = 64 * 1024
+    WHITESPACE = ' \t\n\r'
+
+    def __init__(self, f, chunk_size=None):
+        self.f = codecs.getreader('utf-8')(f)
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Read more of the document, dropping what has already been consumed. Returns False at the end of the file."""
+        if self.eof:
+            return False
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        # Read at least as much again as is buffered, so that a large value is not re-parsed once per chunk
+        data = self.f.read(max(self.chunk_size, len(self.buf)))
+        if not data:
+            self.eof = True
+            return False
+        self.buf += data
+        return True
+
+    def peek(self):
+        """The next character after any whitespace, or '' at the end of the document."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in self.WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or not self.fill():
+                return self.buf[self.pos:self.pos+1]
+
+    def expect(self, chars):
+        c = self.peek()
+        if not c or c not in chars:
+            raise ValueError("Expected one of '%s' but found '%s' at character %d" % (chars, c, self.pos))
+        self.pos += 1
+        return c
+
+    def value(self):
+        """Parse and return the next value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if not self.fill():
+                    raise
+                continue
+            # A number running to the end of the buffer may continue in the next chunk
+            if end == len(self.buf) and not self.eof and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def members(self):
+        """Walk the object starting here, yielding each key. Its value must be consumed before the next is yielded."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.expect(',}') == '}':
+                return
+
+    def elements(self):
+        """Walk the array starting here, yielding before each element, which must be consumed before the next."""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.expect(',]') == ']':
+                return
+
+    def skip(self):
+        """Pass over the next value, without holding all of it in memory at once."""
+        c = self.peek()
+        if c == '{':
+            for _ in self.members():
+                self.skip()
+        elif c == '[':
+            for _ in self.elements():
+                self.skip()
+        else:
+            self.value()
+
+    def find(self, path):
+        """Walk through the nested objects named by the keys in path. Raises KeyError if one is missing."""
+        for key in path:
+            for k in self.members():
+                if k == key:
+                    break
+                self.skip()
+            else:
+                raise KeyError(key)
+
+
+class StreamedJSON(object):
+    """A JSON document saved at path, typically an API response too large to parse at once.
+
+    root is the path of keys to the object of interest, such as ('ygData',). Its arrays can be read an element at a
+    time with items(), and its other members with fields(). Each call reads the file afresh. If temporary, the file
+    is removed by close().
+    """
+
+    def __init__(self, path, root=(), temporary=False):
+        self.path = path
+        self.root = tuple(root)
+        self.temporary = temporary
+
+    def open(self):
+        return open(self.path, 'rb')
+
+    def items(self, key):
+        """Yield each element of the array key of the root object, or nothing if there is no such array."""
+        with self.open() as f:
+            stream = JSONStream(f)
+            try:
+                stream.find(self.root + (key,))
+            except KeyError:
+                return
+            if stream.peek() != '[':
+                return
+            for _ in stream.elements():
+                yield stream.value()
+
+    def fields(self, *exclude):
+        """Return the root object, without the members named in exclude (which are skipped, not parsed)."""
+        with self.open() as f:
+            stream = JSONStream(f)
+            stream.find(self.root)
+            fields = {}
+            for key in stream.members():
+                if key in exclude:
+                    stream.skip()
+                else:
+                    fields[key] = stream.value()
+            return fields
+
+    def load(self):
+        """Return the whole root object."""
+        return self.fields()
+
+    def close(self):
+        if self.temporary and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def indent_json(value, level):
+    return json.dumps(value, ensure_ascii=False, indent=4).replace('\n', '\n' + '    ' * level)
+
+
+def dump_list(f, items, level=0):
+    """Write the elements of the iterable items to the text file f as a JSON array, formatted as json.dump does with
+    indent=4. level is the nesting level the array is at."""
+    first = True
+    for item in items:
+        f.write('[\n' if first else ',\n')
+        f.write('    ' * (level + 1) + indent_json(item, level + 1))
+        first = False
+    f.write('[]' if first else '\n' + '    ' * level + ']')
+
+
+def dump_object(f, fields, key, items):
+    """Write the dict fields with the array key holding the elements of the iterable items to the text file f, as one
+    JSON object formatted as json.dump does with indent=4."""
+    f.write('{\n')
+    for k, v in fields.items():
+        f.write('    %s: %s,\n' % (json.dumps(k, ensure_ascii=False), indent_json(v, 1)))
+    f.write('    %s: ' % (json.dumps(key, ensure_ascii=False),))
+    dump_list(f, items, 1)
+    f.write('\n}')
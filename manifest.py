@@ -0,0 +1,87 @@
+from __future__ import unicode_literals
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+class Manifest(object):
+    """Record of every item archived into a group directory, kept in an SQLite database.
+
+    Each item is keyed on its path relative to the group directory, and stores a status ('ok' for a complete
+    file, 'unavailable' for one Yahoo would not give us), its size, SHA-1 checksum, modification time and the time it
+    was recorded. Files found already on disk are recorded without a checksum, which checksum() works out when first
+    asked for it. Safe to share between threads.
+    """
+    OK = 'ok'
+    UNAVAILABLE = 'unavailable'
+
+    def __init__(self, path, root=None):
+        self.path = os.path.abspath(path)
+        self.root = os.path.abspath(root or os.path.dirname(os.path.abspath(path)))
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS items (path TEXT PRIMARY KEY, status TEXT NOT NULL, '
+                        'size INTEGER, checksum TEXT, updated REAL NOT NULL)')
+        # Added after the first release, so may be missing from an existing manifest
+        if 'mtime' not in [column[1] for column in self.db.execute('PRAGMA table_info(items)')]:
+            self.db.execute('ALTER TABLE items ADD COLUMN mtime REAL')
+        self.db.commit()
+
+    def key(self, fname):
+        return os.path.relpath(os.path.abspath(fname), self.root).replace(os.sep, '/')
+
+    def get(self, fname):
+        """Returns (status, size, checksum, updated) for fname, or None if it has not been recorded."""
+        with self.lock:
+            return self.db.execute('SELECT status, size, checksum, updated FROM items WHERE path = ?',
+                                   (self.key(fname),)).fetchone()
+
+    def has(self, fname):
+        return self.get(fname) is not None
+
+    def add(self, fname, status=OK, size=None, checksum=None, mtime=None):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO items (path, status, size, checksum, updated, mtime) '
+                            'VALUES (?, ?, ?, ?, ?, ?)', (self.key(fname), status, size, checksum, time.time(), mtime))
+            self.db.commit()
+
+    def add_file(self, fname, status=OK, checksum=True):
+        """Record fname as it now exists on disk, including its size and modification time, and its checksum unless
+           checksum is False."""
+        if not checksum:
+            st = os.stat(fname)
+            self.add(fname, status, st.st_size, None, st.st_mtime)
+            return
+        size, digest = self.hash_file(fname)
+        self.add(fname, status, size, digest, os.path.getmtime(fname))
+
+    def checksum(self, fname):
+        """Returns the SHA-1 checksum of fname, working it out and recording it if the manifest doesn't have it yet.
+           Returns None if fname has not been recorded."""
+        item = self.get(fname)
+        if item is None or item[2] is not None:
+            return item and item[2]
+        size, digest = self.hash_file(fname)
+        with self.lock:
+            self.db.execute('UPDATE items SET size = ?, checksum = ?, mtime = ? WHERE path = ?',
+                            (size, digest, os.path.getmtime(fname), self.key(fname)))
+            self.db.commit()
+        return digest
+
+    @staticmethod
+    def hash_file(fname):
+        sha1 = hashlib.sha1()
+        size = 0
+        with open(fname, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                sha1.update(chunk)
+                size += len(chunk)
+        return size, sha1.hexdigest()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,170 @@
+from __future__ import unicode_literals
+import codecs
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class Metrics(object):
+    """Counters and latency histograms for the requests made by a YahooGroupsAPI, kept per endpoint.
+
+    Endpoints are the API targets ('messages', 'topics', ...) plus 'download' for download_file. For each, counts
+    requests by HTTP status (or 'error' where no response was received), retries, BadSize responses, bytes received
+    and seconds spent in backoff, along with a histogram of request latency: the time to the full response for API
+    calls, and to the response headers for downloads. Safe to share between threads.
+
+    Snapshots can be saved as JSON and in the Prometheus text format, on demand with write() or periodically in the
+    background with export().
+    """
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.endpoints = OrderedDict()
+        self.rate_limit_wait = 0.0
+        self.exporter = None
+        self.stopping = threading.Event()
+
+    def endpoint(self, name):
+        # Must be called with self.lock held
+        if name not in self.endpoints:
+            self.endpoints[name] = {'requests': OrderedDict(), 'retries': 0, 'bad_size': 0, 'bytes': 0,
+                                    'backoff_seconds': 0.0, 'latency_buckets': [0] * len(self.BUCKETS),
+                                    'latency_sum': 0.0, 'latency_count': 0}
+        return self.endpoints[name]
+
+    def request(self, endpoint, status, seconds, size=0):
+        """Record a request to endpoint which got status (or 'error') after seconds, with a size byte body."""
+        with self.lock:
+            e = self.endpoint(endpoint)
+            status = str(status)
+            e['requests'][status] = e['requests'].get(status, 0) + 1
+            e['bytes'] += size
+            e['latency_sum'] += seconds
+            e['latency_count'] += 1
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    e['latency_buckets'][i] += 1
+
+    def received(self, endpoint, size):
+        with self.lock:
+            self.endpoint(endpoint)['bytes'] += size
+
+    def retry(self, endpoint, backoff=0):
+        with self.lock:
+            e = self.endpoint(endpoint)
+            e['retries'] += 1
+            e['backoff_seconds'] += backoff
+
+    def bad_size(self, endpoint):
+        with self.lock:
+            self.endpoint(endpoint)['bad_size'] += 1
+
+    def waited(self, seconds):
+        """Record time spent waiting on the rate limiter."""
+        with self.lock:
+            self.rate_limit_wait += seconds
+
+    def merge(self, snapshot):
+        """Add the counts from snapshot, e.g. of the metrics of another process, to these metrics."""
+        with self.lock:
+            self.rate_limit_wait += snapshot['rate_limit_wait_seconds']
+            for name, other in snapshot['endpoints'].items():
+                e = self.endpoint(name)
+                for status, n in other['requests'].items():
+                    e['requests'][status] = e['requests'].get(status, 0) + n
+                for key in ('retries', 'bad_size', 'bytes', 'backoff_seconds'):
+                    e[key] += other[key]
+                e['latency_sum'] += other['latency']['sum']
+                e['latency_count'] += other['latency']['count']
+                for i, n in enumerate(other['latency']['buckets'].values()):
+                    e['latency_buckets'][i] += n
+
+    def snapshot(self):
+        with self.lock:
+            endpoints = OrderedDict()
+            for name, e in self.endpoints.items():
+                endpoints[name] = OrderedDict([
+                    ('requests', OrderedDict(e['requests'])),
+                    ('retries', e['retries']),
+                    ('bad_size', e['bad_size']),
+                    ('bytes', e['bytes']),
+                    ('backoff_seconds', round(e['backoff_seconds'], 3)),
+                    ('latency', OrderedDict([
+                        ('count', e['latency_count']),
+                        ('sum', round(e['latency_sum'], 3)),
+                        ('buckets', OrderedDict(zip(map(str, self.BUCKETS), e['latency_buckets']))),
+                    ])),
+                ])
+            return OrderedDict([('started', self.started), ('updated', time.time()),
+                                ('rate_limit_wait_seconds', round(self.rate_limit_wait, 3)),
+                                ('endpoints', endpoints)])
+
+    def prometheus(self):
+        """The current metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+
+        def family(name, kind, doc):
+            lines.append('# HELP yga_%s %s' % (name, doc))
+            lines.append('# TYPE yga_%s %s' % (name, kind))
+
+        family('requests_total', 'counter', 'Requests made, by endpoint and HTTP status.')
+        for name, e in snapshot['endpoints'].items():
+            for status, n in e['requests'].items():
+                lines.append('yga_requests_total{endpoint="%s",status="%s"} %d' % (name, status, n))
+
+        for metric, key, kind, doc in (('retries_total', 'retries', 'counter', 'Requests retried.'),
+                                       ('bad_size_total', 'bad_size', 'counter', 'Responses of a suspicious size.'),
+                                       ('bytes_total', 'bytes', 'counter', 'Bytes received.'),
+                                       ('backoff_seconds_total', 'backoff_seconds', 'counter',
+                                        'Time spent in backoff before retrying.')):
+            family(metric, kind, doc)
+            for name, e in snapshot['endpoints'].items():
+                lines.append('yga_%s{endpoint="%s"} %s' % (metric, name, e[key]))
+
+        family('request_seconds', 'histogram', 'Request latency.')
+        for name, e in snapshot['endpoints'].items():
+            for bound, n in e['latency']['buckets'].items():
+                lines.append('yga_request_seconds_bucket{endpoint="%s",le="%s"} %d' % (name, bound, n))
+            lines.append('yga_request_seconds_bucket{endpoint="%s",le="+Inf"} %d' % (name, e['latency']['count']))
+            lines.append('yga_request_seconds_sum{endpoint="%s"} %s' % (name, e['latency']['sum']))
+            lines.append('yga_request_seconds_count{endpoint="%s"} %d' % (name, e['latency']['count']))
+
+        family('rate_limit_wait_seconds_total', 'counter', 'Time spent waiting for the rate limiter.')
+        lines.append('yga_rate_limit_wait_seconds_total %s' % snapshot['rate_limit_wait_seconds'])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, json_name=None, prom_name=None):
+        """Save the current metrics as JSON to json_name and in Prometheus text format to prom_name."""
+        if json_name:
+            with open(json_name + '.tmp', 'wb') as f:
+                json.dump(self.snapshot(), codecs.getwriter('utf-8')(f), indent=4)
+            os.rename(json_name + '.tmp', json_name)
+        if prom_name:
+            with open(prom_name + '.tmp', 'wb') as f:
+                f.write(self.prometheus().encode('utf-8'))
+            os.rename(prom_name + '.tmp', prom_name)
+
+    def export(self, json_name, prom_name, interval=60):
+        """Write the metrics every interval seconds in a background thread, until close()."""
+        json_name, prom_name = os.path.abspath(json_name), os.path.abspath(prom_name)
+
+        def run():
+            while not self.stopping.wait(interval):
+                self.write(json_name, prom_name)
+            self.write(json_name, prom_name)
+
+        self.exporter = threading.Thread(target=run, name="Metrics")
+        self.exporter.daemon = True
+        self.exporter.start()
+
+    def close(self):
+        """Stop any background export, after writing the final metrics."""
+        if self.exporter is not None:
+            self.stopping.set()
+            self.exporter.join()
+            self.exporter = None
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+"""Local stand-in for the Yahoo Groups API, serving a synthetic group.
+
+Serves the endpoints used by yahoo.py for messages, topics, files, photos, attachments, members and polls, plus
+the files they link to, with optional latency and injected faults (500s, 60-68 byte bodies, 307s and 404s). Point
+a YahooGroupsAPI at it by setting its BASE_URI to the server's api_uri.
+"""
+from __future__ import unicode_literals
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlsplit
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlsplit
+
+POST_DATE = 1000000000
+
+
+class SyntheticGroup(object):
+    """The content of a made-up group, generated on demand from its sizes so that large groups cost no memory.
+
+    Messages are numbered from 1, and grouped into topics of messages_per_topic consecutive messages, each topic
+    taking the ID of its first message. Every attachment_every'th message has an attachment. Photos are offered in
+    'or', 'sn' and 'tn' variants, and those listed in missing_variants can not be downloaded.
+    """
+
+    def __init__(self, name='mockgroup', messages=100, messages_per_topic=5, attachment_every=10, files=10,
+                 albums=2, photos_per_album=20, members=250, polls=5, file_size=10000, missing_variants=()):
+        self.name = name
+        self.messages = messages
+        self.messages_per_topic = messages_per_topic
+        self.attachment_every = attachment_every
+        self.files = files
+        self.albums = albums
+        self.photos_per_album = photos_per_album
+        self.members = members
+        self.polls = polls
+        self.file_size = file_size
+        self.missing_variants = missing_variants
+        self.base = ''
+
+    def topic_of(self, msg_id):
+        return msg_id - (msg_id - 1) % self.messages_per_topic
+
+    def topic_ids(self):
+        return range(1, self.messages + 1, self.messages_per_topic)
+
+    def blob_url(self, name, size=None):
+        return '%s/blob/%s?size=%d' % (self.base, name, size or self.file_size)
+
+    def attachments_info(self, msg_id):
+        if not self.attachment_every or msg_id % self.attachment_every:
+            return []
+        return [{'fileId': msg_id, 'filename': 'attachment-%d.txt' % msg_id, 'modificationDate': POST_DATE,
+                 'link': self.blob_url('attachment-%d' % msg_id)}]
+
+    def message(self, msg_id):
+        return {'msgId': msg_id, 'topicId': self.topic_of(msg_id), 'postDate': str(POST_DATE + msg_id),
+                'subject': 'Message %d' % msg_id, 'messageBody': '<p>Body of message %d</p>' % msg_id,
+                'attachmentsInfo': self.attachments_info(msg_id)}
+
+    def raw_message(self, msg_id):
+        return {'msgId': msg_id, 'postDate': str(POST_DATE + msg_id),
+                'rawEmail': 'Subject: Message %d\n\nBody of message %d\n' % (msg_id, msg_id)}
+
+    def message_index(self, start=1, count=1000):
+        start = max(1, start)
+        ids = range(start, min(self.messages, start + count - 1) + 1)
+        return {'messages': [{'messageId': i, 'topicId': self.topic_of(i)} for i in ids],
+                'totalRecords': self.messages, 'lastRecordId': self.messages, 'numTopics': len(self.topic_ids()),
+                'nextPageStart': ids[-1] + 1 if ids and ids[-1] < self.messages else 0}
+
+    def topic(self, topic_id):
+        last = min(self.messages, topic_id + self.messages_per_topic - 1)
+        following = topic_id + self.messages_per_topic
+        return {'topicId': topic_id, 'totalMsgInTopic': last - topic_id + 1,
+                'prevTopicId': topic_id - self.messages_per_topic if topic_id > 1 else 0,
+                'nextTopicId': following if following <= self.messages else 0,
+                'messages': [self.message(i) for i in range(topic_id, last + 1)]}
+
+    def file_list(self):
+        return {'dirEntries': [{'type': 0, 'fileName': 'file-%d.bin' % i, 'createdTime': POST_DATE,
+                                'downloadURL': self.blob_url('file-%d' % i)} for i in range(1, self.files + 1)]}
+
+    def photo_info(self, photo_id):
+        return [{'photoType': t, 'displayURL': self.blob_url('photo-%d-%s' % (photo_id, t), size)}
+                for t, size in (('tn', 2000), ('sn', 5000), ('or', self.file_size))]
+
+    def album_list(self, count=None):
+        albums = [{'albumId': i, 'albumName': 'Album %d' % i, 'modificationDate': POST_DATE}
+                  for i in range(1, self.albums + 1)]
+        return {'albums': albums[:count], 'total': self.albums}
+
+    def album(self, album_id, start=0, count=None):
+        first = (album_id - 1) * self.photos_per_album
+        ids = range(first + start + 1, first + min(self.photos_per_album, start + (count or 100)) + 1)
+        return {'photos': [{'photoId': i, 'photoName': 'photo %d' % i, 'creationDate': POST_DATE,
+                            'photoInfo': self.photo_info(i)} for i in ids],
+                'total': self.photos_per_album}
+
+    def attachment_list(self):
+        ids = [i for i in range(1, self.messages + 1) if self.attachments_info(i)]
+        return {'attachments': [{'attachmentId': i, 'modificationDate': POST_DATE} for i in ids]}
+
+    def attachment(self, attachment_id):
+        return {'attachmentId': attachment_id,
+                'files': [{'fileId': attachment_id, 'filename': 'photo-%d.jpg' % attachment_id,
+                           'modificationDate': POST_DATE, 'photoInfo': self.photo_info(attachment_id)}]}
+
+    def member_list(self, start=0, count=10):
+        ids = range(start + 1, min(self.members, start + count) + 1)
+        return {'total': self.members, 'members': [{'userId': i, 'yahooId': 'member%d' % i} for i in ids]}
+
+    def poll_list(self, start=0, count=100):
+        ids = list(range(self.polls, 0, -1))[start:start + count]
+        return [{'surveyId': i} for i in ids]
+
+    def poll(self, poll_id):
+        return {'surveyId': poll_id, 'dateCreated': POST_DATE, 'question': 'Poll %d?' % poll_id}
+
+    def api(self, target, parts, params):
+        """The ygData for an API request, or None if there is no such resource."""
+        def param(name, default):
+            return int(params[name]) if name in params else default
+
+        if target == 'messages':
+            if not parts:
+                return self.message_index(param('start', 1), param('count', 1000))
+            msg_id = int(parts[0])
+            if not 1 <= msg_id <= self.messages:
+                return None
+            return self.raw_message(msg_id) if parts[1:] == ['raw'] else self.message(msg_id)
+        elif target == 'topics':
+            topic_id = int(parts[0])
+            return self.topic(topic_id) if topic_id in self.topic_ids() else None
+        elif target == 'files':
+            return self.file_list()
+        elif target == 'albums':
+            if not parts:
+                return self.album_list(param('count', None))
+            album_id = int(parts[0])
+            return self.album(album_id, param('start', 0), param('count', None)) if album_id <= self.albums else None
+        elif target == 'attachments':
+            return self.attachment(int(parts[0])) if parts else self.attachment_list()
+        elif target == 'members':
+            return self.member_list(param('start', 0), param('count', 10))
+        elif target == 'polls':
+            return self.poll(int(parts[0])) if parts else self.poll_list(param('start', 0), param('count', 100))
+        return None
+
+
+class MockServer(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server for a SyntheticGroup, which counts the requests and bytes it serves.
+
+    latency seconds (plus up to the same again at random) are added to every response, and each of error_rate,
+    bad_size_rate, redirect_rate and not_found_rate is the fraction of API requests answered with a 500, a 64 byte
+    body, a 307 or a 404 respectively. Downloads get the same 500s and 64 byte bodies.
+    """
+    daemon_threads = True
+
+    def __init__(self, group, host='127.0.0.1', port=0, latency=0, error_rate=0, bad_size_rate=0, redirect_rate=0,
+                 not_found_rate=0, seed=0):
+        HTTPServer.__init__(self, (host, port), MockRequestHandler)
+        self.group = group
+        self.latency = latency
+        self.error_rate = error_rate
+        self.bad_size_rate = bad_size_rate
+        self.redirect_rate = redirect_rate
+        self.not_found_rate = not_found_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes = 0
+        self.thread = None
+
+        self.base_uri = 'http://%s:%d' % (host, self.server_port)
+        self.api_uri = self.base_uri + '/api'
+        group.base = self.base_uri
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name="MockServer")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def stats(self):
+        with self.lock:
+            return {'requests': self.requests, 'bytes': self.bytes}
+
+    def fault(self, download=False):
+        """Pick the fault, if any, to inject into a response."""
+        with self.lock:
+            roll = self.random.random()
+        for fault, rate in (('error', self.error_rate), ('bad_size', self.bad_size_rate),
+                            ('redirect', 0 if download else self.redirect_rate),
+                            ('not_found', 0 if download else self.not_found_rate)):
+            if roll < rate:
+                return fault
+            roll -= rate
+        return None
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, which Nagle's algorithm would hold up on kept-alive connections
+    disable_nagle_algorithm = True
+    API_PATH = re.compile(r'^/api/v[0-9]+/groups/([^/]*)/?([^/]*)/?(.*)$')
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency * (1 + server.random.random()))
+
+        url = urlsplit(self.path)
+        params = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+
+        if url.path.startswith('/blob/'):
+            if url.path.rsplit('-', 1)[-1] in server.group.missing_variants:
+                return self.reply(404, b'Not Found')
+            fault = server.fault(download=True)
+            if fault == 'error':
+                return self.reply(500, b'Internal Server Error')
+            size = 64 if fault == 'bad_size' else int(params.get('size', server.group.file_size))
+            return self.reply(200, b'x' * size, 'application/octet-stream')
+
+        match = self.API_PATH.match(url.path)
+        if not match:
+            return self.reply(404, b'Not Found')
+        group, target, parts = match.groups()
+        target = target or 'HackGroupInfo'
+
+        fault = server.fault()
+        if fault == 'error':
+            return self.reply(500, b'{"ygError": {}}')
+        elif fault == 'bad_size':
+            return self.reply(200, b'{"ygData": {"padding": "' + b'x' * 40 + b'"}}')
+        elif fault == 'redirect':
+            self.send_response(307)
+            self.send_header('Location', 'https://login.yahoo.com/')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return self.count(0)
+        elif fault == 'not_found':
+            return self.reply(404, b'{"ygError": {}}')
+
+        data = None
+        if group == server.group.name:
+            try:
+                data = server.group.api(target, [p for p in parts.split('/') if p], params)
+            except ValueError:
+                data = None
+        if data is None:
+            return self.reply(404, b'{"ygError": {}}')
+        self.reply(200, json.dumps({'ygData': data, 'ygPerms': {}}).encode('utf-8'))
+
+    def reply(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.count(len(body))
+
+    def count(self, size):
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.bytes += size
+
+
+def add_group_arguments(p):
+    """Add options for the size of the synthetic group and the faults to inject to ArgumentParser p."""
+    p.add_argument('--group', type=str, default='mockgroup', help='Name of the group (default mockgroup)')
+    p.add_argument('--messages', type=int, default=100, help='Number of messages (default 100)')
+    p.add_argument('--messages-per-topic', type=int, default=5, help='Messages in each topic (default 5)')
+    p.add_argument('--attachment-every', type=int, default=10,
+                   help='Give every n\'th message an attachment (default 10, 0 for none)')
+    p.add_argument('--files', type=int, default=10, help='Number of files (default 10)')
+    p.add_argument('--albums', type=int, default=2, help='Number of photo albums (default 2)')
+    p.add_argument('--photos-per-album', type=int, default=20, help='Photos in each album (default 20)')
+    p.add_argument('--members', type=int, default=250, help='Number of members (default 250)')
+    p.add_argument('--polls', type=int, default=5, help='Number of polls (default 5)')
+    p.add_argument('--file-size', type=int, default=10000, help='Size of each file and photo in bytes (default 10000)')
+    p.add_argument('--missing-variants', nargs='+', default=(), choices=('or', 'sn', 'tn'),
+                   help='Photo variants to answer with a 404, as for groups whose originals are gone')
+    p.add_argument('--latency', type=float, default=0, help='Base latency of each response in seconds (default 0)')
+    p.add_argument('--error-rate', type=float, default=0, help='Fraction of requests to answer with a 500')
+    p.add_argument('--bad-size-rate', type=float, default=0,
+                   help='Fraction of requests to answer with a 60-68 byte body')
+    p.add_argument('--redirect-rate', type=float, default=0, help='Fraction of API requests to answer with a 307')
+    p.add_argument('--not-found-rate', type=float, default=0, help='Fraction of API requests to answer with a 404')
+    p.add_argument('--seed', type=int, default=0, help='Seed for the choice of faults (default 0)')
+
+
+def server_from_args(args, host='127.0.0.1', port=0):
+    group = SyntheticGroup(args.group, args.messages, args.messages_per_topic, args.attachment_every, args.files,
+                           args.albums, args.photos_per_album, args.members, args.polls, args.file_size,
+                           args.missing_variants)
+    return MockServer(group, host, port, args.latency, args.error_rate, args.bad_size_rate, args.redirect_rate,
+                      args.not_found_rate, args.seed)
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description=__doc__)
+    p.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on (default 127.0.0.1)')
+    p.add_argument('--port', type=int, default=8080, help='Port to listen on (default 8080)')
+    add_group_arguments(p)
+    args = p.parse_args()
+
+    server = server_from_args(args, args.host, args.port)
+    print("Serving group '%s' with API at %s" % (args.group, server.api_uri))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
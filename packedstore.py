@@ -0,0 +1,88 @@
+from __future__ import unicode_literals
+import hashlib
+import io
+import json
+import os
+import threading
+import zlib
+
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class PackedStore(object):
+    """Append-only store of JSON records, packed into sharded, gzip-compressed JSON Lines files.
+
+    Records are keyed on their would-be file name relative to the group directory (e.g. 'email/123_raw.json'), and
+    each is written as a line {"path": ..., "data": ...} in its own gzip member, so the shards are ordinary .jsonl.gz
+    files that can also be read back a single record at a time from its offset. Offsets are kept in index.tsv in the
+    store directory, one line per record: path, shard number, offset and compressed length. A new shard is started
+    once the current one reaches shard_size bytes. Safe to share between threads.
+    """
+    INDEX_FILE = 'index.tsv'
+
+    def __init__(self, path, root=None, shard_size=256 * 1024 * 1024):
+        self.path = os.path.abspath(path)
+        self.root = os.path.abspath(root or os.path.dirname(self.path))
+        self.shard_size = shard_size
+        self.lock = threading.Lock()
+        self.index = {}
+        self.shard = 0
+
+        if not os.path.isdir(self.path):
+            os.mkdir(self.path)
+
+        index_name = os.path.join(self.path, self.INDEX_FILE)
+        if os.path.exists(index_name):
+            with io.open(index_name, 'r', encoding='utf-8') as f:
+                for line in f:
+                    key, shard, offset, length = line.rstrip('\n').split('\t')
+                    self.index[key] = (int(shard), int(offset), int(length))
+                    self.shard = max(self.shard, int(shard))
+
+        self.index_file = io.open(index_name, 'a', encoding='utf-8')
+        self.shard_file = open(self.shard_name(self.shard), 'ab')
+
+    def key(self, fname):
+        return os.path.relpath(os.path.abspath(fname), self.root).replace(os.sep, '/')
+
+    def shard_name(self, shard):
+        return os.path.join(self.path, 'records-%05d.jsonl.gz' % shard)
+
+    def has(self, fname):
+        return self.key(fname) in self.index
+
+    def add(self, fname, data):
+        """Append data as the record for fname. Returns the size and SHA-1 checksum of the uncompressed line."""
+        key = self.key(fname)
+        line = json.dumps({'path': key, 'data': data}, ensure_ascii=False).encode('utf-8') + b'\n'
+        compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS)
+        member = compressor.compress(line) + compressor.flush()
+
+        with self.lock:
+            self.shard_file.seek(0, os.SEEK_END)
+            if self.shard_file.tell() and self.shard_file.tell() + len(member) > self.shard_size:
+                self.shard_file.close()
+                self.shard += 1
+                self.shard_file = open(self.shard_name(self.shard), 'ab')
+            offset = self.shard_file.tell()
+            self.shard_file.write(member)
+            self.shard_file.flush()
+
+            self.index[key] = (self.shard, offset, len(member))
+            self.index_file.write('%s\t%d\t%d\t%d\n' % (key, self.shard, offset, len(member)))
+            self.index_file.flush()
+
+        return len(line), hashlib.sha1(line).hexdigest()
+
+    def get(self, fname):
+        """Read back the data stored for fname. Raises KeyError if there is no such record."""
+        shard, offset, length = self.index[self.key(fname)]
+        with open(self.shard_name(shard), 'rb') as f:
+            f.seek(offset)
+            member = f.read(length)
+        return json.loads(zlib.decompress(member, GZIP_WBITS).decode('utf-8'))['data']
+
+    def close(self):
+        with self.lock:
+            self.shard_file.close()
+            self.index_file.close()
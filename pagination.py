@@ -0,0 +1,124 @@
+from __future__ import unicode_literals
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+# Paging styles of list endpoints
+OFFSET = 'offset'   # start and count parameters, e.g. members, polls and the photos of an album
+CURSOR = 'cursor'   # each page gives the start of the next, e.g. the message index
+
+
+class Paginator(object):
+    """Pages through a list endpoint of the API, yielding its pages or items in order.
+
+    fetch(start, count) requests one page of page_size items, starting at start (None for the first page of a CURSOR
+    endpoint). The items are the page's items_key list, or the page itself if items_key is None.
+
+    OFFSET pages start at multiples of page_size from start. If the first page gives the number of items as
+    total_key, the rest of the pages are known and up to workers of them are fetched ahead concurrently; otherwise
+    pages are fetched one at a time until one is short. CURSOR pages are fetched one at a time, following next_key
+    until it is 0 or stops changing. If key is given, items already seen on an earlier page (by key(item)) are
+    dropped, for endpoints whose pages can overlap.
+
+    Only the pages in flight are held in memory. total and count give the total reported by the endpoint (or None)
+    and the number of items yielded so far.
+    """
+    logger = logging.getLogger(name="Paginator")
+
+    def __init__(self, fetch, items_key=None, style=OFFSET, page_size=100, start=None, total_key='total',
+                 next_key='nextPageStart', key=None, workers=1):
+        self.fetch = fetch
+        self.items_key = items_key
+        self.style = style
+        self.page_size = page_size
+        self.start = start
+        self.total_key = total_key
+        self.next_key = next_key
+        self.key = key
+        self.workers = workers
+        self.seen = set()
+        self.total = None
+        self.count = 0
+
+    def page_items(self, page):
+        """The items of page not seen before."""
+        items = page if self.items_key is None else page[self.items_key]
+        if self.key is not None:
+            new = []
+            for item in items:
+                k = self.key(item)
+                if k not in self.seen:
+                    self.seen.add(k)
+                    new.append(item)
+            items = new
+        self.count += len(items)
+        return items
+
+    def pages(self):
+        """Yield (start, page, items) for each page, where items are the page's items not seen before."""
+        if self.style == CURSOR:
+            return self.cursor_pages()
+        return self.offset_pages()
+
+    def items(self):
+        """Yield each item in turn."""
+        for _, _, items in self.pages():
+            for item in items:
+                yield item
+
+    def cursor_pages(self):
+        start = self.start
+        while True:
+            page = self.fetch(start, self.page_size)
+            self.total = page.get(self.total_key)
+            yield start, page, self.page_items(page)
+
+            next_start = page.get(self.next_key)
+            if not next_start or next_start == start:
+                return
+            start = next_start
+
+    def offset_pages(self):
+        start = self.start or 0
+        page = self.fetch(start, self.page_size)
+        if isinstance(page, dict):
+            self.total = page.get(self.total_key)
+        items = self.page_items(page)
+        yield start, page, items
+
+        if self.total is None:
+            # Fetch one at a time until a short page, or one with nothing new if the endpoint ignores start
+            while len(page if self.items_key is None else page[self.items_key]) >= self.page_size and items:
+                start += self.page_size
+                page = self.fetch(start, self.page_size)
+                items = self.page_items(page)
+                yield start, page, items
+            return
+
+        starts = range(start + self.page_size, self.total, self.page_size)
+        if self.workers <= 1 or len(starts) <= 1:
+            for start in starts:
+                page = self.fetch(start, self.page_size)
+                yield start, page, self.page_items(page)
+            return
+
+        self.logger.debug("Fetching %d pages with %d workers", len(starts), self.workers)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = deque()
+            starts = iter(starts)
+            try:
+                while True:
+                    # Keep workers pages in flight, so that pages are yielded in order without piling up in memory
+                    while len(pending) < self.workers:
+                        start = next(starts, None)
+                        if start is None:
+                            break
+                        pending.append((start, executor.submit(self.fetch, start, self.page_size)))
+                    if not pending:
+                        return
+                    start, future = pending.popleft()
+                    page = future.result()
+                    yield start, page, self.page_items(page)
+            finally:
+                for _, future in pending:
+                    future.cancel()
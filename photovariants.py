@@ -0,0 +1,119 @@
+from __future__ import unicode_literals
+from contextlib import contextmanager
+import codecs
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class PhotoVariants(object):
+    """Record of how often each photo variant ('or', 'hr', 'sn', 'tn') of a group can actually be downloaded.
+
+    For each photoType, keeps the number of downloads attempted and a moving average of their success, decaying by
+    `decay` with each attempt so that recent results count most. A type with at least min_attempts attempts and a
+    success rate below threshold is reported by unavailable(), so that smaller variants are tried first, except on
+    every probe_every'th photo, when it is tried again in case the originals have come back. Saved as JSON to path,
+    at most every save_interval seconds and on close() if changed. Safe to share between threads.
+
+    Several processes may share path, as with --parallel-sections. Each save replays the results recorded since the
+    last one onto what is in the file, under an exclusive lock where the platform has one, so that no process
+    overwrites the others' results.
+    """
+    logger = logging.getLogger(name="PhotoVariants")
+
+    def __init__(self, path, min_attempts=5, threshold=0.05, probe_every=50, decay=0.9, save_interval=30):
+        self.path = os.path.abspath(path)
+        self.min_attempts = min_attempts
+        self.threshold = threshold
+        self.probe_every = probe_every
+        self.decay = decay
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.since_probe = 0
+        # Results recorded since the last save, for each photo type
+        self.pending = {}
+        self.saved = time.time()
+        self.variants = self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, 'rb') as f:
+            return json.load(codecs.getreader('utf-8')(f))
+
+    def is_unavailable(self, photo_type):
+        # Must be called with self.lock held
+        v = self.variants.get(photo_type)
+        return v is not None and v['attempts'] >= self.min_attempts and v['success'] < self.threshold
+
+    def unavailable(self):
+        """The photo types which should not be tried first for the next photo."""
+        with self.lock:
+            self.since_probe += 1
+            if self.since_probe >= self.probe_every:
+                self.since_probe = 0
+                return []
+            return [t for t in self.variants if self.is_unavailable(t)]
+
+    def record(self, photo_type, ok):
+        """Record whether downloading a photo's photo_type variant succeeded."""
+        with self.lock:
+            was_unavailable = self.is_unavailable(photo_type)
+            self.update(self.variants, photo_type, ok)
+            self.pending.setdefault(photo_type, []).append(ok)
+
+            if self.is_unavailable(photo_type) and not was_unavailable:
+                self.logger.info("Photo variant '%s' is rarely available, trying smaller variants first", photo_type)
+            elif was_unavailable and not self.is_unavailable(photo_type):
+                self.logger.info("Photo variant '%s' is available again", photo_type)
+
+            if time.time() - self.saved >= self.save_interval:
+                self.save()
+
+    def update(self, variants, photo_type, ok):
+        v = variants.get(photo_type)
+        if v is None:
+            v = variants[photo_type] = {'attempts': 0, 'success': 1.0 if ok else 0.0}
+        v['attempts'] += 1
+        v['success'] = v['success'] * self.decay + (1 - self.decay) * (1 if ok else 0)
+
+    @contextmanager
+    def file_locked(self):
+        if fcntl is None:
+            yield
+            return
+        # A separate lock file, as path itself is replaced by each save
+        with open(self.path + '.lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def save(self):
+        # Must be called with self.lock held
+        with self.file_locked():
+            variants = self.load()
+            for photo_type, results in self.pending.items():
+                for ok in results:
+                    self.update(variants, photo_type, ok)
+            with open(self.path + '.tmp', 'wb') as f:
+                json.dump(variants, codecs.getwriter('utf-8')(f), indent=4, sort_keys=True)
+            os.rename(self.path + '.tmp', self.path)
+        # Now including what other processes have saved
+        self.variants = variants
+        self.pending = {}
+        self.saved = time.time()
+
+    def close(self):
+        with self.lock:
+            # Only when changed, so that a process which merely forked section processes doesn't save for nothing
+            if self.pending:
+                self.save()
@@ -0,0 +1,321 @@
+"""
+Where yahoo.py and yahoo_async.py archive to: the files and records they save, and the stores those go through.
+
+The stores are set by yahoo.py for the options given, and are None when not in use:
+manifest records archived files (--manifest), packed_store holds messages and topics (--packed), blob_store holds
+attachments and photos (--dedup) and photo_variants tracks which photo variants can be downloaded.
+overwrite is set for --overwrite. An archiver that can't archive its section at all raises SectionFailed.
+"""
+from __future__ import unicode_literals
+from manifest import Manifest
+from jsonstream import StreamedJSON, dump_object
+
+import codecs
+import json
+import logging
+import os
+import re
+import sys
+import time
+import unicodedata
+
+if (sys.version_info < (3, 0)):
+    text = unicode  # noqa: F821
+else:
+    text = str
+
+# Re-download files that have already been archived
+overwrite = False
+
+# Record of archived files, consulted by file_keep when --manifest is given
+manifest = None
+
+# Compressed container for messages and topics, used instead of individual files when --packed is given
+packed_store = None
+
+# Content-addressed store that attachments and photos are linked to, when --dedup is given
+blob_store = None
+
+# Which photo variants can usually be downloaded for this group, consulted by best_photo_variant
+photo_variants = None
+PHOTO_VARIANTS_FILE = 'photo_variants.json'
+
+# Position reached in the message metadata index, for --incremental runs
+METADATA_STATE_FILE = 'message_metadata_state.json'
+
+# Progress of an unfinished topic crawl, resumed by archive_topics
+TOPICS_CHECKPOINT_FILE = 'topics_checkpoint.json'
+
+
+class SectionFailed(Exception):
+    """Raised by an archiver that can't archive its section at all, such as when the group doesn't allow access to
+    it, so that the section is recorded as failed."""
+    pass
+
+
+def get_best_photoinfo(photoInfoArr, exclude=[]):
+    logger = logging.getLogger(name="get_best_photoinfo")
+    rs = {'tn': 0, 'sn': 1, 'hr': 2, 'or': 3}
+
+    # exclude types we're not interested in
+    for x in exclude:
+        if x in rs:
+            rs[x] = -1
+
+    best = photoInfoArr[0]
+    for info in photoInfoArr:
+        if info['photoType'] not in rs:
+            logger.error("photoType '%s' not known", info['photoType'])
+            continue
+        if rs[info['photoType']] >= rs[best['photoType']]:
+            best = info
+    if rs[best['photoType']] == -1:
+        return None
+    else:
+        return best
+
+
+def best_photo_variant(photoInfoArr, exclude=[]):
+    """
+    As get_best_photoinfo, but passing over variants photo_variants has found to be usually unavailable,
+    unless there is nothing else left to try.
+    """
+    unavailable = photo_variants.unavailable() if photo_variants is not None else []
+    best = get_best_photoinfo(photoInfoArr, exclude + unavailable)
+    if best is None and unavailable:
+        best = get_best_photoinfo(photoInfoArr, exclude)
+    return best
+
+
+def photo_variant_result(photo_type, ok):
+    """Record whether a download of a photo_type variant succeeded, in photo_variants if it is in use."""
+    if photo_variants is not None:
+        photo_variants.record(photo_type, ok)
+
+
+def load_metadata_state():
+    """
+    Returns the position in the message metadata index reached by the last run, and the IDs of messages it found but
+    couldn't archive, or None if there was no run.
+    """
+    if not os.path.exists(METADATA_STATE_FILE):
+        return None
+    with open(METADATA_STATE_FILE, 'rb') as f:
+        return json.load(codecs.getreader('utf-8')(f))
+
+
+def metadata_state(page_count, page_start, last_message_id):
+    return {'pageCount': page_count, 'pageStart': page_start, 'lastMessageId': last_message_id}
+
+
+def save_metadata_state(state, pending=()):
+    """
+    Save state, the position reached in the message metadata index, once the messages found in it have been archived.
+    pending are the IDs of those that couldn't be, for the next incremental run to try again.
+    """
+    state = dict(state, pendingMessageIds=sorted(pending))
+    with open(METADATA_STATE_FILE, 'wb') as f:
+        json.dump(state, codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
+
+
+def set_mtime(path, mtime):
+    """
+    Sets the last-modified date of a file or directory
+    """
+    atime = time.time()
+    os.utime(path, (atime, mtime))
+
+
+def set_file_mtime(fname, mtime):
+    """
+    As set_mtime, for a file which may be linked into the blob store. The timestamp of a link is shared with every
+    other file linked to the same blob, so it is left alone.
+    """
+    if blob_store is not None and (os.path.islink(fname) or os.stat(fname).st_nlink > 1):
+        return
+    set_mtime(fname, mtime)
+
+
+def write_empty_file(fname):
+    """
+    Leave an empty fname in place of a file that couldn't be downloaded. Anything already there is removed first
+    rather than truncated, as it may be linked to a blob shared with other files.
+    """
+    if os.path.lexists(fname):
+        os.remove(fname)
+    open(fname, 'wb').close()
+
+
+def sanitise_file_name(value):
+    """
+    Convert spaces to hyphens.  Remove characters that aren't alphanumerics, underscores, periods or hyphens.
+    Also strip leading and trailing whitespace and periods.
+    """
+    value = text(value)
+    value = unicodedata.normalize('NFKD', value).encode('ascii', 'ignore').decode('ascii')
+    value = re.sub(r'[^\w\s.-]', '', value).strip().strip('.')
+    return re.sub(r'[-\s]+', '-', value)
+
+
+def sanitise_folder_name(name):
+    return sanitise_file_name(name).replace('.', '_')
+
+
+def file_keep(fname, type=""):
+    """
+    Test existance of given file name and the overwrite flag.
+    If not overwriting and present then log the fact and the data type (type).
+    When the manifest is in use it is checked first, and files found only on disk are added to it, without a checksum.
+    Returns True if file present otherwise False
+    """
+    logger = logging.getLogger('file_keep')
+
+    if overwrite:
+        return False
+
+    if packed_store is not None and packed_store.has(fname):
+        logger.debug("Record already present %s", type)
+        return True
+
+    if manifest is not None and manifest.has(fname):
+        logger.debug("File already present %s", type)
+        return True
+
+    if os.path.exists(fname) is False:
+        return False
+
+    if manifest is not None:
+        # Reading every file already archived would make the first run with the manifest crawl, so it is hashed later
+        manifest.add_file(fname, checksum=False)
+    logger.debug("File already present %s", type)
+    return True
+
+
+def file_done(fname, unavailable=False):
+    """
+    Record that fname has been archived in the manifest, if it is in use.
+    """
+    if manifest is not None:
+        manifest.add_file(fname, Manifest.UNAVAILABLE if unavailable else Manifest.OK)
+
+
+def fetch_file(yga, url, fname):
+    """
+    Download url as fname, by way of the blob store if it is in use.
+    """
+    if link_known_url(url, fname):
+        return
+    yga.download_file(url, fname=fname)
+    store_download(fname, url)
+
+
+def link_known_url(url, fname):
+    """
+    If url has already been downloaded into the blob store, link fname to it and return True.
+    """
+    if blob_store is None:
+        return False
+    digest = blob_store.lookup(url)
+    if digest is None:
+        return False
+    logging.getLogger('link_known_url').debug("Already downloaded %s, linking %s", url, fname)
+    blob_store.link(digest, fname)
+    return True
+
+
+def store_download(fname, url):
+    """
+    Move the file downloaded from url into the blob store, if it is in use.
+    """
+    if blob_store is not None:
+        blob_store.add_file(fname, url)
+
+
+def save_record(fname, data, mtime=None):
+    """
+    Save the json of a message or topic as fname, or as a record in the packed store if it is in use.
+    """
+    if packed_store is None:
+        with open(fname, 'wb') as f:
+            json.dump(data, codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
+        if mtime is not None:
+            set_mtime(fname, mtime)
+        file_done(fname)
+        return
+
+    size, checksum = packed_store.add(fname, data)
+    if manifest is not None:
+        manifest.add(fname, Manifest.OK, size, checksum)
+
+
+def load_record(fname):
+    """
+    Load a message or topic saved by save_record.
+    """
+    if packed_store is not None and packed_store.has(fname):
+        return packed_store.get(fname)
+    with open(fname, 'rb') as f:
+        return json.load(codecs.getreader('utf-8')(f))
+
+
+def save_record_items(fname, fields, key, items):
+    """
+    As save_record, for a record whose array key is too large to hold in memory. Its elements are read from the
+    iterable items and written out one at a time, the rest of the record being given by fields.
+    """
+    if packed_store is None:
+        with open(fname, 'wb') as f:
+            dump_object(codecs.getwriter('utf-8')(f), fields, key, items)
+        file_done(fname)
+        return
+
+    # Records are packed whole
+    data = dict(fields)
+    data[key] = list(items)
+    save_record(fname, data)
+
+
+def load_record_items(fname, key):
+    """
+    Load a record saved by save_record or save_record_items, without holding its array key in memory.
+    Returns the rest of the record, and an iterable of the elements of key that reads them one at a time.
+    """
+    if packed_store is not None and packed_store.has(fname):
+        data = packed_store.get(fname)
+        return data, data.pop(key, [])
+    record = StreamedJSON(fname)
+    return record.fields(key), record.items(key)
+
+
+def record_exists(fname):
+    return (packed_store is not None and packed_store.has(fname)) or os.path.exists(fname)
+
+
+def make_folder(d, parent='', sanitize=True):
+    """
+    Create folder d (sanitised, unless told otherwise) within parent, without changing the working directory.
+    Returns the path of the folder, which is safe to use from concurrent workers.
+    """
+    path = os.path.join(parent, sanitise_folder_name(d) if sanitize else d)
+    try:
+        os.mkdir(path)
+    except OSError:
+        pass
+    return path
+
+
+class Mkchdir:
+    d = ""
+
+    def __init__(self, d, sanitize=True):
+        self.d = sanitise_folder_name(d) if sanitize else d
+
+    def __enter__(self):
+        try:
+            os.mkdir(self.d)
+        except OSError:
+            pass
+        os.chdir(self.d)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        os.chdir('..')
@@ -0,0 +1,32 @@
+import os
+
+from blobstore import BlobStore
+
+
+def test_add_file_dedups(tmpdir):
+    store = BlobStore(str(tmpdir.join('blobs')))
+    for name in ('a.jpg', 'b.jpg'):
+        tmpdir.join(name).write_binary(b'same photo')
+    digest = store.add_file(str(tmpdir.join('a.jpg')), 'http://example.com/a.jpg')
+    assert store.add_file(str(tmpdir.join('b.jpg')), 'http://example.com/b.jpg') == digest
+
+    blob = store.blob_path(digest)
+    assert os.listdir(os.path.dirname(blob)) == [digest]
+    assert os.path.samefile(str(tmpdir.join('a.jpg')), blob)
+    assert tmpdir.join('b.jpg').read_binary() == b'same photo'
+    store.close()
+
+
+def test_url_map_persists(tmpdir):
+    store = BlobStore(str(tmpdir.join('blobs')))
+    tmpdir.join('a.jpg').write_binary(b'photo')
+    digest = store.add_file(str(tmpdir.join('a.jpg')), 'http://example.com/a.jpg?x=1')
+    store.close()
+
+    store = BlobStore(str(tmpdir.join('blobs')))
+    assert store.lookup('http://example.com/a.jpg?x=1') == digest
+    assert store.lookup('http://example.com/other.jpg') is None
+
+    store.link(digest, str(tmpdir.join('copy.jpg')))
+    assert tmpdir.join('copy.jpg').read_binary() == b'photo'
+    store.close()
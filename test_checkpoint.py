@@ -0,0 +1,42 @@
+import os
+import signal
+
+import pytest
+
+from checkpoint import TopicCheckpoint
+
+
+def test_round_trip(tmpdir):
+    path = str(tmpdir.join('checkpoint.json'))
+    checkpoint = TopicCheckpoint(path)
+    checkpoint.indexed_topic_ids = [1, 5]
+    checkpoint.sets['retrievedTopicIds'].update([1, 5])
+    checkpoint.sets['potentialMessageIds'].update([7, 8])
+    checkpoint.done(1, 0, 5)
+    checkpoint.save()
+
+    resumed = TopicCheckpoint(path)
+    assert resumed.load()
+    assert resumed.indexed_topic_ids == [1, 5]
+    assert resumed.links == {1: (0, 5)}
+    # Topic 5 was still being processed, so must be fetched again
+    assert resumed.sets['retrievedTopicIds'] == {1}
+    assert resumed.sets['potentialMessageIds'] == {7, 8}
+
+    resumed.remove()
+    assert not TopicCheckpoint(path).load()
+
+
+def test_saved_on_signal(tmpdir):
+    path = str(tmpdir.join('checkpoint.json'))
+    checkpoint = TopicCheckpoint(path)
+    checkpoint.sets['retrievedMessageIds'].add(3)
+
+    with pytest.raises(SystemExit):
+        with checkpoint.saved_on_signal():
+            os.kill(os.getpid(), signal.SIGTERM)
+    assert signal.getsignal(signal.SIGTERM) == signal.SIG_DFL
+
+    resumed = TopicCheckpoint(path)
+    assert resumed.load()
+    assert resumed.sets['retrievedMessageIds'] == {3}
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import io
+import json
+
+from jsonstream import JSONStream, StreamedJSON, dump_list, dump_object
+
+DOCUMENT = {'ygPerms': {'a': [1, 2]}, 'ygData': {
+    'totalMsgInTopic': 3, 'nextTopicId': 12345678901234, 'prevTopicId': 0,
+    'messages': [{'msgId': i, 'subject': 'Ünïcode "quoted" %d' % i, 'values': [1.5, None, True, {}]} for i in range(3)],
+    'empty': []}}
+
+
+def test_streamed_items(tmpdir):
+    path = tmpdir.join('doc.json')
+    path.write_binary(json.dumps(DOCUMENT, ensure_ascii=False).encode('utf-8'))
+
+    doc = StreamedJSON(str(path), ('ygData',))
+    # A small chunk size splits strings and numbers across reads
+    JSONStream.CHUNK_SIZE, chunk_size = 7, JSONStream.CHUNK_SIZE
+    try:
+        assert list(doc.items('messages')) == DOCUMENT['ygData']['messages']
+        assert list(doc.items('empty')) == []
+        assert list(doc.items('missing')) == []
+        assert doc.fields('messages') == dict((k, v) for k, v in DOCUMENT['ygData'].items() if k != 'messages')
+        assert doc.load() == DOCUMENT['ygData']
+    finally:
+        JSONStream.CHUNK_SIZE = chunk_size
+
+
+def test_skip_and_errors():
+    stream = JSONStream(io.BytesIO(b' [ {"a": [1, {"b": "]"}]}, 2 ,3]'), chunk_size=2)
+    values = []
+    for i, _ in enumerate(stream.elements()):
+        if i == 0:
+            stream.skip()
+        else:
+            values.append(stream.value())
+    assert values == [2, 3]
+
+    stream = JSONStream(io.BytesIO(b'[1, 2'))
+    try:
+        [stream.value() for _ in stream.elements()]
+        assert False, "truncated document accepted"
+    except ValueError:
+        pass
+
+
+def test_dump_matches_json():
+    for items in ([], [1], DOCUMENT['ygData']['messages']):
+        f = io.StringIO()
+        dump_list(f, iter(items))
+        assert f.getvalue() == json.dumps(items, ensure_ascii=False, indent=4)
+
+    fields = dict((k, v) for k, v in DOCUMENT['ygData'].items() if k != 'messages')
+    f = io.StringIO()
+    dump_object(f, fields, 'messages', iter(DOCUMENT['ygData']['messages']))
+    assert json.loads(f.getvalue()) == DOCUMENT['ygData']
+    assert f.getvalue().startswith('{\n    "')
@@ -0,0 +1,36 @@
+import hashlib
+
+from manifest import Manifest
+
+
+def test_add_file(tmpdir):
+    tmpdir.mkdir('email').join('1.json').write_binary(b'{"msgId": 1}')
+    manifest = Manifest(str(tmpdir.join('manifest.sqlite')))
+    manifest.add_file(str(tmpdir.join('email', '1.json')))
+
+    status, size, checksum, updated = manifest.get(str(tmpdir.join('email', '1.json')))
+    assert status == Manifest.OK
+    assert size == 12
+    assert checksum == hashlib.sha1(b'{"msgId": 1}').hexdigest()
+    assert not manifest.has(str(tmpdir.join('email', '2.json')))
+
+
+def test_persists(tmpdir):
+    db = str(tmpdir.join('manifest.sqlite'))
+    manifest = Manifest(db)
+    manifest.add(str(tmpdir.join('1-a.txt')), Manifest.UNAVAILABLE)
+    manifest.close()
+
+    manifest = Manifest(db)
+    assert manifest.get(str(tmpdir.join('1-a.txt')))[0] == Manifest.UNAVAILABLE
+
+
+def test_checksum_worked_out_later(tmpdir):
+    tmpdir.join('1.json').write_binary(b'{"msgId": 1}')
+    manifest = Manifest(str(tmpdir.join('manifest.sqlite')))
+    manifest.add_file(str(tmpdir.join('1.json')), checksum=False)
+    assert manifest.get(str(tmpdir.join('1.json')))[1:3] == (12, None)
+
+    assert manifest.checksum(str(tmpdir.join('1.json'))) == hashlib.sha1(b'{"msgId": 1}').hexdigest()
+    assert manifest.get(str(tmpdir.join('1.json')))[2] == hashlib.sha1(b'{"msgId": 1}').hexdigest()
+    assert manifest.checksum(str(tmpdir.join('2.json'))) is None
@@ -0,0 +1,58 @@
+import json
+
+from metrics import Metrics
+
+
+def test_snapshot():
+    metrics = Metrics()
+    metrics.request('messages', 200, 0.2, 1000)
+    metrics.request('messages', 500, 3, 10)
+    metrics.retry('messages', 1.5)
+    metrics.bad_size('messages')
+    metrics.received('download', 64)
+
+    snapshot = metrics.snapshot()['endpoints']
+    assert snapshot['messages']['requests'] == {'200': 1, '500': 1}
+    assert snapshot['messages']['bytes'] == 1010
+    assert snapshot['messages']['backoff_seconds'] == 1.5
+    assert snapshot['messages']['latency']['buckets']['0.25'] == 1
+    assert snapshot['messages']['latency']['buckets']['5'] == 2
+    assert snapshot['download']['bytes'] == 64
+
+
+def test_write(tmpdir):
+    metrics = Metrics()
+    metrics.request('topics', 200, 0.01, 5)
+    metrics.write(str(tmpdir.join('metrics.json')), str(tmpdir.join('metrics.prom')))
+
+    assert json.loads(tmpdir.join('metrics.json').read())['endpoints']['topics']['requests'] == {'200': 1}
+    prom = tmpdir.join('metrics.prom').read().splitlines()
+    assert 'yga_requests_total{endpoint="topics",status="200"} 1' in prom
+    assert 'yga_request_seconds_bucket{endpoint="topics",le="+Inf"} 1' in prom
+    assert 'yga_bytes_total{endpoint="topics"} 5' in prom
+
+
+def test_export(tmpdir):
+    metrics = Metrics()
+    metrics.export(str(tmpdir.join('metrics.json')), str(tmpdir.join('metrics.prom')), interval=60)
+    metrics.request('topics', 200, 0.01)
+    metrics.close()
+    assert json.loads(tmpdir.join('metrics.json').read())['endpoints']['topics']['requests'] == {'200': 1}
+
+
+def test_merge():
+    metrics, other = Metrics(), Metrics()
+    metrics.request('messages', 200, 0.2, 100)
+    other.request('messages', 200, 0.3, 50)
+    other.request('messages', 500, 0.01)
+    other.retry('messages', 1.5)
+    other.waited(2)
+    metrics.merge(other.snapshot())
+
+    endpoint = metrics.snapshot()['endpoints']['messages']
+    assert endpoint['requests'] == {'200': 2, '500': 1}
+    assert endpoint['bytes'] == 150
+    assert endpoint['backoff_seconds'] == 1.5
+    assert endpoint['latency']['count'] == 3
+    assert endpoint['latency']['buckets']['0.25'] == 2
+    assert metrics.snapshot()['rate_limit_wait_seconds'] == 2
@@ -0,0 +1,212 @@
+import pytest
+
+from benchmark import archive_section, run_benchmark
+from mockserver import MockServer, SyntheticGroup
+from yahoogroupsapi import NotFound, YahooGroupsAPI
+
+
+@pytest.fixture
+def server():
+    server = MockServer(SyntheticGroup(messages=23, messages_per_topic=4, files=3)).start()
+    yield server
+    server.stop()
+
+
+def test_mock_api(server):
+    yga = YahooGroupsAPI('mockgroup')
+    yga.BASE_URI = server.api_uri
+
+    index = yga.messages(count=10, start=21)
+    assert [m['messageId'] for m in index['messages']] == [21, 22, 23]
+    assert yga.topics(21)['messages'][-1]['msgId'] == 23
+    assert len(yga.download_file(yga.files()['dirEntries'][0]['downloadURL'])) == 10000
+    with pytest.raises(NotFound):
+        yga.messages(24)
+    assert server.stats()['requests'] == 5
+
+
+def test_archive_sections(server, tmpdir):
+    with tmpdir.as_cwd():
+        archive_section('topics', server.api_uri, 'mockgroup', workers=2)
+        archive_section('files', server.api_uri, 'mockgroup')
+
+    topics = sorted(int(f.purebasename) for f in tmpdir.join('topics').listdir('*.json') if f.purebasename.isdigit())
+    assert topics == [1, 5, 9, 13, 17, 21]
+    # Messages 10 and 20 have attachments
+    assert tmpdir.join('topics', '10_attachments').check(dir=1)
+    assert len(tmpdir.join('files').listdir('*.bin')) == 3
+
+
+def test_benchmark_with_faults(server):
+    server.error_rate = server.bad_size_rate = 0.1
+    results = run_benchmark(server, ['email'])
+
+    assert results[0]['error'] is None
+    # 23 messages, each as HTML and raw, plus at least one index page and the retried faults
+    assert results[0]['requests'] > 47
+    assert results[0]['peak_rss'] > 0
+
+
+def test_archive_photos_concurrently(tmpdir):
+    server = MockServer(SyntheticGroup(albums=3, photos_per_album=120, file_size=100)).start()
+    try:
+        with tmpdir.as_cwd():
+            archive_section('photos', server.api_uri, 'mockgroup', workers=4)
+    finally:
+        server.stop()
+
+    albums = sorted(tmpdir.join('photos').listdir(lambda f: f.check(dir=1)))
+    assert [a.basename for a in albums] == ['1-Album-1', '2-Album-2', '3-Album-3']
+    for album in albums:
+        assert len(album.listdir('*.jpg')) == 120
+        assert len(album.listdir('photos-*.json')) == 2
+    # One album list request, then two pages and 120 photos per album
+    assert server.stats()['requests'] == 1 + 3 * 122
+
+
+def test_photo_variants_learned(tmpdir, monkeypatch):
+    import storage
+    from photovariants import PhotoVariants
+
+    server = MockServer(SyntheticGroup(albums=1, photos_per_album=30, file_size=100, missing_variants=('or',)))
+    server.start()
+    monkeypatch.setattr(storage, 'photo_variants', PhotoVariants(str(tmpdir.join('variants.json')), probe_every=10))
+    try:
+        with tmpdir.as_cwd():
+            archive_section('photos', server.api_uri, 'mockgroup')
+    finally:
+        server.stop()
+
+    # Originals are tried for the first 5 photos, and then only as a probe on every 10th
+    assert server.stats()['requests'] == 1 + 1 + 30 + 5 + 2
+    assert len(tmpdir.join('photos', '1-Album-1').listdir('*.jpg')) == 30
+
+
+def test_archive_members_and_polls(tmpdir):
+    import json
+
+    server = MockServer(SyntheticGroup(members=250, polls=205)).start()
+    try:
+        with tmpdir.as_cwd():
+            archive_section('members', server.api_uri, 'mockgroup', workers=3)
+            members_requests = server.stats()['requests']
+            archive_section('polls', server.api_uri, 'mockgroup')
+    finally:
+        server.stop()
+
+    members = json.loads(tmpdir.join('members', 'allmemberinfo.json').read_text('utf-8'))
+    assert members['total'] == 250
+    assert [m['userId'] for m in members['members']] == list(range(1, 251))
+    assert len(tmpdir.join('members').listdir('memberinfo_*.json')) == 3
+    assert members_requests == 3
+    # Three pages of the poll list, then each poll once
+    assert server.stats()['requests'] - members_requests == 3 + 205
+    assert len(tmpdir.join('polls').listdir('*.json')) == 205
+
+
+def test_topics_resume_from_checkpoint(tmpdir, monkeypatch):
+    import json
+    import yahoo
+
+    server = MockServer(SyntheticGroup(messages=40, messages_per_topic=4)).start()
+    process_single_topic = yahoo.process_single_topic
+    calls = []
+
+    def interrupted(topicId, *args):
+        calls.append(topicId)
+        if len(calls) == 4:
+            raise KeyboardInterrupt()
+        return process_single_topic(topicId, *args)
+
+    try:
+        with tmpdir.as_cwd():
+            monkeypatch.setattr(yahoo, 'process_single_topic', interrupted)
+            with pytest.raises(KeyboardInterrupt):
+                archive_section('topics', server.api_uri, 'mockgroup')
+            checkpoint = json.loads(tmpdir.join('topics', 'topics_checkpoint.json').read_text('utf-8'))
+            assert sorted(checkpoint['topicLinks']) == ['1', '5', '9']
+
+            # Topics done before the interruption are neither fetched nor read from disk again
+            monkeypatch.setattr(yahoo, 'process_single_topic', process_single_topic)
+            load_record_items = yahoo.load_record_items
+            loaded = []
+            monkeypatch.setattr(yahoo, 'load_record_items', lambda fname, key: loaded.append(fname) or
+                                load_record_items(fname, key))
+            before = server.stats()['requests']
+            archive_section('topics', server.api_uri, 'mockgroup')
+            resumed = server.stats()['requests'] - before
+    finally:
+        server.stop()
+
+    # No message metadata, just the 7 remaining topics and the attachments of messages 20, 30 and 40
+    assert resumed == 7 + 3
+    # which are saved and then read back
+    assert sorted(loaded) == sorted('%d.json' % i for i in range(13, 41, 4))
+    assert not tmpdir.join('topics', 'topics_checkpoint.json').check()
+    retrieved = json.loads(tmpdir.join('topics', 'retrievedTopicIds.json').read_text('utf-8'))
+    assert sorted(retrieved) == list(range(1, 41, 4))
+
+
+def test_topics_resume_mid_topic(tmpdir, monkeypatch):
+    import json
+    import yahoo
+
+    # Every fourth message has an attachment, so the last message of each topic does
+    server = MockServer(SyntheticGroup(messages=20, messages_per_topic=4, attachment_every=4)).start()
+    archive_messages_metadata = yahoo.archive_messages_metadata
+    process_single_attachment = yahoo.process_single_attachment
+    calls = []
+
+    def interrupted(*args):
+        calls.append(args)
+        if len(calls) == 5:
+            raise KeyboardInterrupt()
+        return process_single_attachment(*args)
+
+    # Without topic IDs from the metadata, topics are only found by probing messages and walking from topic to topic
+    monkeypatch.setattr(yahoo, 'archive_messages_metadata', lambda yga, incremental, topicIndex:
+                        archive_messages_metadata(yga, incremental, {}))
+    try:
+        with tmpdir.as_cwd():
+            # Interrupted at the last message of the last topic
+            monkeypatch.setattr(yahoo, 'process_single_attachment', interrupted)
+            with pytest.raises(KeyboardInterrupt):
+                archive_section('topics', server.api_uri, 'mockgroup')
+
+            monkeypatch.setattr(yahoo, 'process_single_attachment', process_single_attachment)
+            before = server.stats()['requests']
+            archive_section('topics', server.api_uri, 'mockgroup')
+            resumed = server.stats()['requests'] - before
+    finally:
+        server.stop()
+
+    # A message probed to find the topic again, whose saved copy is then read back, and the attachment of message 20
+    assert resumed == 2
+    assert tmpdir.join('topics', '20_attachments').check(dir=1)
+    retrieved = json.loads(tmpdir.join('topics', 'retrievedTopicIds.json').read_text('utf-8'))
+    assert sorted(retrieved) == [1, 5, 9, 13, 17]
+
+
+def test_incremental_email_retries_failed_messages(server, tmpdir, monkeypatch):
+    import json
+    import yahoo
+
+    yga = YahooGroupsAPI('mockgroup')
+    yga.BASE_URI = server.api_uri
+    archive_message_content = yahoo.archive_message_content
+    with tmpdir.as_cwd():
+        monkeypatch.setattr(yahoo, 'archive_message_content', lambda yga, id, *args:
+                            id != 5 and archive_message_content(yga, id, *args))
+        yahoo.archive_email(yga, incremental=True)
+        state = json.loads(tmpdir.join('message_metadata_state.json').read_text('utf-8'))
+        assert state['lastMessageId'] == 23
+        assert state['pendingMessageIds'] == [5]
+
+        monkeypatch.setattr(yahoo, 'archive_message_content', archive_message_content)
+        before = server.stats()['requests']
+        yahoo.archive_email(yga, incremental=True)
+        # The message count, the last metadata page again, then message 5 as HTML and raw
+        assert server.stats()['requests'] - before == 1 + 1 + 2
+    state = json.loads(tmpdir.join('message_metadata_state.json').read_text('utf-8'))
+    assert state['pendingMessageIds'] == []
+    assert tmpdir.join('5.json').check()
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+import gzip
+import json
+
+from packedstore import PackedStore
+
+
+def test_add_and_get(tmpdir):
+    store = PackedStore(str(tmpdir.join('packed')))
+    store.add(str(tmpdir.join('email', '1.json')), {'msgId': 1, 'subject': 'café'})
+    store.add(str(tmpdir.join('email', '2.json')), {'msgId': 2})
+
+    assert store.has(str(tmpdir.join('email', '1.json')))
+    assert not store.has(str(tmpdir.join('email', '3.json')))
+    assert store.get(str(tmpdir.join('email', '1.json'))) == {'msgId': 1, 'subject': 'café'}
+    store.close()
+
+    # The shard is an ordinary gzipped JSON Lines file
+    with gzip.open(str(tmpdir.join('packed', 'records-00000.jsonl.gz')), 'rb') as f:
+        records = [json.loads(line.decode('utf-8')) for line in f]
+    assert [r['path'] for r in records] == ['email/1.json', 'email/2.json']
+
+
+def test_reopen_and_rotate(tmpdir):
+    store = PackedStore(str(tmpdir.join('packed')), shard_size=1)
+    for i in range(3):
+        store.add(str(tmpdir.join('topics', '%d.json' % i)), {'topicId': i})
+    store.close()
+
+    store = PackedStore(str(tmpdir.join('packed')), shard_size=1)
+    assert store.shard == 2
+    assert [store.get(str(tmpdir.join('topics', '%d.json' % i))) for i in range(3)] == [{'topicId': i} for i in range(3)]
@@ -0,0 +1,59 @@
+import threading
+
+from pagination import CURSOR, Paginator
+
+
+def offset_fetch(total, calls, report_total=True):
+    def fetch(start, count):
+        with lock:
+            calls.append(start)
+        items = list(range(start, min(total, start + count)))
+        return {'total': total, 'items': items} if report_total else items
+    lock = threading.Lock()
+    return fetch
+
+
+def test_offset_with_total_concurrently():
+    calls = []
+    paginator = Paginator(offset_fetch(1050, calls), 'items', page_size=100, workers=4)
+    pages = list(paginator.pages())
+
+    assert [start for start, _, _ in pages] == list(range(0, 1100, 100))
+    assert [i for _, _, items in pages for i in items] == list(range(1050))
+    assert sorted(calls) == list(range(0, 1100, 100))
+    assert (paginator.total, paginator.count) == (1050, 1050)
+
+
+def test_offset_without_total():
+    calls = []
+    assert list(Paginator(offset_fetch(250, calls, False)).items()) == list(range(250))
+    assert calls == [0, 100, 200]
+
+    # A full last page takes one more request to find the end
+    calls = []
+    assert len(list(Paginator(offset_fetch(200, calls, False)).items())) == 200
+    assert calls == [0, 100, 200]
+
+
+def test_duplicates_dropped():
+    # Pages that overlap by one, and an endpoint that ignores start altogether
+    overlapping = Paginator(lambda start, count: list(range(max(0, start - 1), min(250, max(0, start - 1) + count))),
+                            key=lambda i: i)
+    assert list(overlapping.items()) == list(range(250))
+
+    calls = []
+    ignoring = Paginator(lambda start, count: calls.append(start) or list(range(count)), key=lambda i: i)
+    assert list(ignoring.items()) == list(range(100))
+    assert calls == [0, 100]
+
+
+def test_cursor():
+    def fetch(start, count):
+        start = start or 1
+        ids = list(range(start, min(start + count, 26)))
+        # Like the message index, the last page may point back at itself
+        return {'messages': ids, 'totalRecords': 25, 'nextPageStart': ids[-1] + 1 if ids[-1] < 25 else start}
+
+    paginator = Paginator(fetch, 'messages', CURSOR, page_size=10, total_key='totalRecords')
+    assert [start for start, _, _ in paginator.pages()] == [None, 11, 21]
+    assert list(Paginator(fetch, 'messages', CURSOR, page_size=10, start=11).items()) == list(range(11, 26))
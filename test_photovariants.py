@@ -0,0 +1,41 @@
+from photovariants import PhotoVariants
+
+
+def test_unavailable_and_probe(tmpdir):
+    variants = PhotoVariants(str(tmpdir.join('variants.json')), min_attempts=3, threshold=0.5, probe_every=4,
+                             decay=0.5)
+    variants.record('sn', True)
+    for _ in range(3):
+        variants.record('or', False)
+
+    assert [variants.unavailable() for _ in range(4)] == [['or'], ['or'], ['or'], []]
+
+    # Recovered originals are noticed once probes succeed
+    variants.record('or', True)
+    variants.record('or', True)
+    assert variants.unavailable() == []
+
+
+def test_persisted(tmpdir):
+    path = str(tmpdir.join('variants.json'))
+    variants = PhotoVariants(path, min_attempts=2)
+    variants.record('or', False)
+    variants.record('or', False)
+    variants.close()
+
+    assert PhotoVariants(path, min_attempts=2).unavailable() == ['or']
+
+
+def test_processes_merge_results(tmpdir):
+    path = str(tmpdir.join('variants.json'))
+    # As each section process has its own copy, loaded before any of them saved
+    first, second = PhotoVariants(path), PhotoVariants(path)
+    first.record('or', False)
+    first.record('sn', True)
+    second.record('or', False)
+    first.close()
+    second.close()
+
+    variants = PhotoVariants(path).variants
+    assert variants['or']['attempts'] == 2
+    assert variants['sn']['attempts'] == 1
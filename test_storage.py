@@ -0,0 +1,48 @@
+import storage
+from manifest import Manifest
+
+
+def test_file_keep(tmpdir, monkeypatch):
+    with tmpdir.as_cwd():
+        assert not storage.file_keep('1.json')
+        storage.save_record('1.json', {'msgId': 1})
+        assert storage.file_keep('1.json')
+
+        monkeypatch.setattr(storage, 'overwrite', True)
+        assert not storage.file_keep('1.json')
+
+
+def test_file_keep_with_manifest(tmpdir, monkeypatch):
+    manifest = Manifest(str(tmpdir.join('manifest.sqlite')))
+    monkeypatch.setattr(storage, 'manifest', manifest)
+    with tmpdir.as_cwd():
+        storage.save_record('1.json', {'msgId': 1})
+        assert manifest.has('1.json')
+
+        # Found in the manifest without looking on disk
+        tmpdir.join('1.json').remove()
+        assert storage.file_keep('1.json')
+    manifest.close()
+
+
+def test_empty_file_leaves_blob(tmpdir, monkeypatch):
+    from blobstore import BlobStore
+
+    blob_store = BlobStore(str(tmpdir.join('blobs')))
+    monkeypatch.setattr(storage, 'blob_store', blob_store)
+    with tmpdir.as_cwd():
+        for fname in ('a.jpg', 'b.jpg'):
+            tmpdir.join(fname).write_binary(b'photo')
+            storage.store_download(fname, None)
+        blob = tmpdir.join('blobs').visit(lambda f: f.check(file=1) and f.size() == 5)
+        mtime = next(blob).mtime()
+
+        storage.set_file_mtime('a.jpg', 1000)
+        storage.write_empty_file('b.jpg')
+        storage.set_file_mtime('b.jpg', 1000)
+    blob_store.close()
+
+    assert tmpdir.join('a.jpg').read_binary() == b'photo'
+    assert tmpdir.join('a.jpg').mtime() == mtime
+    assert tmpdir.join('b.jpg').size() == 0
+    assert tmpdir.join('b.jpg').mtime() == 1000
@@ -0,0 +1,43 @@
+from io import BytesIO
+
+from warcio.archiveiterator import ArchiveIterator
+
+from warcfiles import BackgroundWARCWriter
+
+
+def write_pair(writer, n):
+    request = BytesIO(b'GET /%d HTTP/1.1\r\nHost: example.com\r\n\r\n' % n)
+    response = BytesIO(b'HTTP/1.1 200 OK\r\nContent-Length: 1000\r\n\r\n' + b'x' * 1000)
+    req = writer.create_warc_record('http://example.com/%d' % n, 'request', request, len(request.getvalue()))
+    resp = writer.create_warc_record('http://example.com/%d' % n, 'response', response, len(response.getvalue()))
+    # capture_http closes its buffers as soon as the pair has been handed over
+    request.close()
+    response.close()
+    writer.write_request_response_pair(req, resp)
+
+
+def read_types(fname):
+    with open(fname, 'rb') as f:
+        return [record.rec_type for record in ArchiveIterator(f)]
+
+
+def test_rotation(tmpdir):
+    writer = BackgroundWARCWriter(str(tmpdir.join('data')), {'software': 'test'}, max_size=1)
+    for n in range(3):
+        write_pair(writer, n)
+    writer.close()
+
+    for n in range(3):
+        assert read_types(str(tmpdir.join('data-%05d.warc.gz' % n))) == ['warcinfo', 'response', 'request']
+    assert not tmpdir.join('data-00003.warc.gz').exists()
+
+
+def test_new_run_starts_new_file(tmpdir):
+    for _ in range(2):
+        writer = BackgroundWARCWriter(str(tmpdir.join('data')))
+        for n in range(3):
+            write_pair(writer, n)
+        writer.close()
+
+    for n in range(2):
+        assert read_types(str(tmpdir.join('data-%05d.warc.gz' % n))) == ['warcinfo'] + ['response', 'request'] * 3
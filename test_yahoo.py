@@ -0,0 +1,67 @@
+import json
+import os
+import time
+
+import yahoo
+from metrics import Metrics
+
+
+class FakeClient(object):
+    metrics = None
+    ww = None
+
+
+def test_run_sections_concurrently(tmpdir, monkeypatch):
+    monkeypatch.setattr(yahoo, 'section_status', yahoo.OrderedDict())
+    client = FakeClient()
+
+    def slow():
+        client.metrics.request('messages', 200, 0.1, 100)
+        time.sleep(0.5)
+
+    def quick():
+        with open('about.json', 'w') as f:
+            f.write('{}')
+
+    def broken():
+        raise ValueError("broken section")
+
+    metrics = Metrics()
+    start = time.time()
+    with tmpdir.as_cwd():
+        yahoo.run_sections([('topics', 'topics', slow), ('email', 'email', slow), ('about', 'about', quick),
+                            ('polls', 'polls', broken)], processes=2, clients=(client,), metrics=metrics)
+    # Quick sections go first, then the two slow ones together
+    assert time.time() - start < 0.9
+
+    with open(str(tmpdir.join(yahoo.SECTION_STATUS_FILE))) as f:
+        status = json.load(f)
+    assert [(name, s['status']) for name, s in status.items()] == \
+        [('about', 'ok'), ('polls', 'failed'), ('topics', 'ok'), ('email', 'ok')]
+    assert status['polls']['error'] == 'broken section'
+    assert tmpdir.join('about', 'about.json').exists()
+    assert metrics.snapshot()['endpoints']['messages']['requests'] == {'200': 2}
+
+
+def test_run_sections_in_order(tmpdir, monkeypatch):
+    monkeypatch.setattr(yahoo, 'section_status', yahoo.OrderedDict())
+    done = []
+    with tmpdir.as_cwd():
+        yahoo.run_sections([('topics', 'topics', lambda: done.append(os.path.basename(os.getcwd()))),
+                            ('about', 'about', lambda: done.append(os.path.basename(os.getcwd())))])
+    assert done == ['topics', 'about']
+    assert list(yahoo.section_status) == ['topics', 'about']
+
+
+def test_section_failed_by_archiver(tmpdir, monkeypatch):
+    import yahoogroupsapi
+
+    class NoPolls(object):
+        def polls(self, **opts):
+            raise yahoogroupsapi.Unauthorized()
+
+    monkeypatch.setattr(yahoo, 'section_status', yahoo.OrderedDict())
+    with tmpdir.as_cwd():
+        yahoo.run_sections([('polls', 'polls', lambda: yahoo.archive_polls(NoPolls()))])
+    assert yahoo.section_status['polls']['status'] == 'failed'
+    assert yahoo.section_status['polls']['error'] == "Couldn't access Polls functionality for this group"
@@ -0,0 +1,32 @@
+import sys
+
+from yahoo_batch import read_groups, run_batch
+
+# Stands in for yahoo.py: fails the first time it is run for group 'flaky', and always for group 'bad'.
+FAKE_ARCHIVER = '''
+import json, os, sys
+group = sys.argv[1]
+seen = os.path.join(group, 'seen')
+first = not os.path.exists(seen)
+open(seen, 'w').close()
+ok = group == 'good' or (group == 'flaky' and not first)
+with open(os.path.join(group, 'archive_status.json'), 'w') as f:
+    json.dump({'topics': {'status': 'ok' if ok else 'failed'}}, f)
+sys.exit(0 if ok else 1)
+'''
+
+
+def test_read_groups(tmpdir):
+    tmpdir.join('groups.txt').write('one\n\n# comment\ntwo  # trailing\none\n')
+    assert read_groups(str(tmpdir.join('groups.txt'))) == ['one', 'two']
+
+
+def test_run_batch_retries(tmpdir):
+    with tmpdir.as_cwd():
+        summary = run_batch([sys.executable, '-c', FAKE_ARCHIVER], ['good', 'flaky', 'bad'], jobs=2, retries=1,
+                            summary_file='summary.json')
+
+    assert [(g, s['status'], s['attempts']) for g, s in summary.items()] == \
+        [('good', 'ok', 1), ('flaky', 'ok', 2), ('bad', 'failed', 2)]
+    assert summary['bad']['sections'] == {'topics': {'status': 'failed'}}
+    assert tmpdir.join('summary.json').exists()
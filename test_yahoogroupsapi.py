@@ -1,17 +1,24 @@
 import yahoogroupsapi  # Must be imported first
 from yahoogroupsapi import YahooGroupsAPI
 
+import json
 import responses
 import sys
+import threading
+import time
 from pytest import fixture, raises
 from requests.cookies import RequestsCookieJar
 from warcio.archiveiterator import ArchiveIterator
 from warcio.warcwriter import BufferWARCWriter
 
 if (sys.version_info < (3, 0)):
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
     from Cookie import SimpleCookie
+    from SocketServer import ThreadingMixIn
 else:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
     from http.cookies import SimpleCookie
+    from socketserver import ThreadingMixIn
 
 YGPERMS_NONE = {"resourceCapabilityList": [
     {"resourceType": "GROUP", "capabilities": []}, {"resourceType": "PHOTO", "capabilities": []},
@@ -83,6 +90,51 @@ def test_warc_enabled():
     assert expected == actual
 
 
+def test_warc_per_instance():
+    # Serve locally, since responses' mocking bypasses the connection the recording adapter taps.
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            body = ('{"ygData": {"path": "%s"}}' % self.path).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    server = Server(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever).start()
+    try:
+        writers = {}
+        threads = []
+        for group in ('one', 'two'):
+            yga = YahooGroupsAPI(group)
+            yga.BASE_URI = 'http://127.0.0.1:%d/api' % server.server_port
+            writers[group] = BufferWARCWriter(gzip=False)
+            yga.set_warc_writer(writers[group])
+            threads += [threading.Thread(target=yga.messages, args=(i,)) for i in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    for group, writer in writers.items():
+        records = list(ArchiveIterator(writer.get_stream()))
+        assert sorted(r.rec_headers['WARC-Target-URI'] for r in records if r.rec_type == 'response') == \
+            ['http://127.0.0.1:%d/api/v1/groups/%s/messages/%d' % (server.server_port, group, i) for i in range(5)]
+        assert len(records) == 10
+
+
 def test_correct_ua(yahoo_response):
     r = yahoo_response('v1/groups/groupname/', {})
     yga = YahooGroupsAPI('groupname', headers={'User-Agent': 'test'})
@@ -107,7 +159,7 @@ def test_not_authenticated_error(yahoo_response):
     yga = YahooGroupsAPI('groupname')
     with raises(yahoogroupsapi.Recoverable):    # Temporary fix, replaced: yahoogroupsapi.NotAuthenticated
         yga.HackGroupInfo()
-    assert len(r.calls) == 15
+    assert len(r.calls) == 3
 
 
 def test_one_retry(yahoo_response):
@@ -128,3 +180,364 @@ def test_fifteen_retries(yahoo_response):
         yga.HackGroupInfo()
 
     assert len(r.calls) == 15
+
+
+def test_delay_shared_between_threads(yahoo_response):
+    yahoo_response('v1/groups/groupname/', {})
+    yga = YahooGroupsAPI('groupname', min_delay=0.05)
+    threads = [threading.Thread(target=yga.HackGroupInfo) for _ in range(4)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert time.time() - start >= 3 * 0.05
+
+
+def test_rate_limiter_burst():
+    limiter = yahoogroupsapi.RateLimiter(20, burst=3)
+    start = time.time()
+    for _ in range(3):
+        limiter.acquire()
+    assert time.time() - start < 0.05
+    limiter.acquire()
+    assert time.time() - start >= 0.04
+
+
+def test_rate_limiter_shared_file(tmpdir):
+    state_file = str(tmpdir.join('rate'))
+    limiters = [yahoogroupsapi.RateLimiter(20, state_file=state_file) for _ in range(2)]
+    start = time.time()
+    for limiter in limiters * 2:
+        limiter.acquire()
+    assert time.time() - start >= 3 * 0.05 * 0.9
+
+
+def test_download_file_bad_size_retry():
+    url = 'https://xa.yimg.com/file'
+    with responses.RequestsMock() as r:
+        r.add(responses.GET, url, body=b'x' * 64)
+        r.add(responses.GET, url, body=b'y' * 1000)
+        yga = YahooGroupsAPI('groupname')
+        assert yga.download_file(url) == b'y' * 1000
+        assert len(r.calls) == 2
+
+
+def test_download_file_resume(tmpdir):
+    url = 'https://xa.yimg.com/file'
+    fname = str(tmpdir.join('file'))
+    tmpdir.join('file.part').write_binary(b'a' * 100)
+    with responses.RequestsMock() as r:
+        r.add(responses.GET, url, body=b'b' * 50, status=206, headers={'Content-Range': 'bytes 100-149/150'})
+        yga = YahooGroupsAPI('groupname')
+        yga.download_file(url, fname=fname)
+        assert r.calls[0].request.headers['Range'] == 'bytes=100-'
+
+    assert tmpdir.join('file').read_binary() == b'a' * 100 + b'b' * 50
+    assert not tmpdir.join('file.part').exists()
+
+
+def test_cache_reuses_response(yahoo_response):
+    r = yahoo_response('v1/groups/groupname/messages/1', {'msgId': 1})
+    yga = YahooGroupsAPI('groupname', cache=yahoogroupsapi.ResponseCache())
+    first = yga.messages(1)
+    first['msgId'] = 2
+    assert yga.messages(1) == {'msgId': 1}
+    assert len(r.calls) == 1
+
+
+def test_cache_on_disk(yahoo_response, tmpdir):
+    r = yahoo_response('v1/groups/groupname/messages/1', {'msgId': 1})
+    YahooGroupsAPI('groupname', cache=yahoogroupsapi.ResponseCache(path=str(tmpdir))).messages(1)
+    YahooGroupsAPI('groupname', cache=yahoogroupsapi.ResponseCache(path=str(tmpdir))).messages(1)
+    assert len(r.calls) == 1
+
+    YahooGroupsAPI('groupname', cache=yahoogroupsapi.ResponseCache(path=str(tmpdir), ttl=-1)).messages(1)
+    assert len(r.calls) == 2
+
+
+def test_cache_skips_lists(yahoo_response, tmpdir):
+    r = yahoo_response('v1/groups/groupname/messages', {'lastRecordId': 1})
+    yahoo_response('v1/groups/groupname/messages', {'lastRecordId': 2})
+    yga = YahooGroupsAPI('groupname', cache=yahoogroupsapi.ResponseCache(path=str(tmpdir)))
+    assert yga.messages()['lastRecordId'] == 1
+    # The message index grows, so is requested again rather than reused
+    assert yga.messages()['lastRecordId'] == 2
+    assert len(r.calls) == 2
+
+
+def test_cache_coalesces_concurrent_requests():
+    def slow_response(request):
+        time.sleep(0.1)
+        return (200, {}, '{"ygData": {"msgId": 1}}')
+
+    with responses.RequestsMock() as r:
+        r.add_callback(responses.GET, 'https://groups.yahoo.com/api/v1/groups/groupname/messages/1',
+                       callback=slow_response)
+        yga = YahooGroupsAPI('groupname', cache=yahoogroupsapi.ResponseCache())
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(yga.messages(1))) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results == [{'msgId': 1}] * 4
+        assert len(r.calls) == 1
+
+
+def test_rate_limiter_parent():
+    parent = yahoogroupsapi.RateLimiter(20)
+    limiters = [yahoogroupsapi.RateLimiter(100, parent=parent) for _ in range(2)]
+    start = time.time()
+    for limiter in limiters * 2:
+        limiter.acquire()
+    assert time.time() - start >= 3 * 0.05 * 0.9
+
+
+def test_metrics(yahoo_response):
+    r = yahoo_response('v1/groups/groupname/', ygError={}, status=500)
+    r.add(responses.GET, 'https://groups.yahoo.com/api/v1/groups/groupname/', json={'ygData': {}})
+    yga = YahooGroupsAPI('groupname')
+    yga.HackGroupInfo()
+
+    endpoint = yga.metrics.snapshot()['endpoints']['HackGroupInfo']
+    assert endpoint['requests'] == {'500': 1, '200': 1}
+    assert endpoint['retries'] == 1
+    assert endpoint['latency']['count'] == 2
+
+
+def test_retry_after(yahoo_response):
+    r = yahoo_response('v1/groups/groupname/', ygError={}, status=429, adding_headers={'Retry-After': '0.2'})
+    r = yahoo_response('v1/groups/groupname/', {})
+    yga = YahooGroupsAPI('groupname')
+    start = time.time()
+    yga.HackGroupInfo()
+    assert time.time() - start >= 0.2
+    assert len(r.calls) == 2
+
+
+def test_unknown_status_not_retried(yahoo_response):
+    r = yahoo_response('v1/groups/groupname/', ygError={}, status=410)
+    yga = YahooGroupsAPI('groupname')
+    with raises(yahoogroupsapi.Recoverable):
+        yga.HackGroupInfo()
+    assert len(r.calls) == 1
+
+
+def test_retry_budget(yahoo_response):
+    r = yahoo_response('v1/groups/groupname/', ygError={}, status=500)
+    yga = YahooGroupsAPI('groupname', retry_policy=yahoogroupsapi.RetryPolicy(budget=3))
+    for _ in range(2):
+        with raises(yahoogroupsapi.Recoverable):
+            yga.HackGroupInfo()
+    assert len(r.calls) == 5
+
+
+def test_circuit_breaker():
+    policy = yahoogroupsapi.RetryPolicy(breaker_threshold=3, breaker_pause=0.2)
+    for attempt in range(3):
+        assert policy.wait_time() == 0
+        policy.retry_delay(500, attempt)
+    assert policy.wait_time() > 0.1
+
+    time.sleep(0.2)
+    assert policy.wait_time() == 0
+    # Only the probe goes through until it succeeds or fails
+    assert policy.wait_time() > 0
+    policy.retry_delay(500, 3)
+    assert policy.wait_time() > 0.3
+
+    time.sleep(0.4)
+    assert policy.wait_time() == 0
+    policy.success()
+    assert policy.wait_time() == 0
+
+
+def test_circuit_breaker_probe_raises(yahoo_response):
+    r = yahoo_response('v1/groups/groupname/', {})
+    r.replace(responses.GET, 'https://groups.yahoo.com/api/v1/groups/groupname/', body=ValueError("Unexpected"))
+    policy = yahoogroupsapi.RetryPolicy(breaker_threshold=1, breaker_pause=0.1)
+    yga = YahooGroupsAPI('groupname', retry_policy=policy)
+    policy.retry_delay(500, 0)
+    time.sleep(0.1)
+    with raises(ValueError):
+        yga.HackGroupInfo()
+
+    # The probe failed, so the breaker opens again rather than waiting on it forever
+    assert 0 < policy.wait_time() <= 0.2
+    time.sleep(0.2)
+    assert policy.wait_time() == 0
+
+
+def test_adaptive_delay():
+    limiter = yahoogroupsapi.RateLimiter(2)
+    adaptive = yahoogroupsapi.AdaptiveDelay(limiter, min_delay=0.2, max_delay=2, window=10, threshold=0.1, step=1)
+    for _ in range(10):
+        adaptive.observe()
+    assert limiter.rate == 3
+
+    for _ in range(30):
+        adaptive.observe()
+    assert limiter.rate == 5    # No faster than min_delay
+
+    for failure in (None, 500, None, 'bad_size', 404):
+        adaptive.observe(failure)
+    assert limiter.rate == 2.5
+
+    for _ in range(10):
+        adaptive.observe(500)
+    assert limiter.rate == 0.5  # No slower than max_delay
+
+
+def test_adaptive_delay_observes_requests(yahoo_response):
+    yahoo_response('v1/groups/groupname/', ygError={}, status=500)
+    yahoo_response('v1/groups/groupname/', {})
+    limiter = yahoogroupsapi.RateLimiter(100)
+    adaptive = yahoogroupsapi.AdaptiveDelay(limiter, min_delay=0.01, max_delay=1, window=4, threshold=0.5)
+    yga = YahooGroupsAPI('groupname', rate_limiter=limiter,
+                         retry_policy=yahoogroupsapi.RetryPolicy(adaptive_delay=adaptive))
+    yga.HackGroupInfo()
+    assert list(adaptive.outcomes) == [True, False]
+
+
+def test_stream_json(yahoo_response, tmpdir):
+    result = {'total': 2, 'attachments': [{'attachmentId': 1}, {'attachmentId': 2}]}
+    r = yahoo_response('v1/groups/groupname/attachments', ygError={}, status=500)
+    r = yahoo_response('v1/groups/groupname/attachments', result)
+    yga = YahooGroupsAPI('groupname')
+    fname = str(tmpdir.join('attachments.json'))
+
+    with yga.stream_json(fname, 'attachments', count=999999) as attachments:
+        assert list(attachments.items('attachments')) == result['attachments']
+        assert attachments.fields('attachments') == {'total': 2}
+    assert len(r.calls) == 2
+    assert tmpdir.listdir() == []
+
+
+def test_stream_json_cut_short(tmpdir):
+    body = json.dumps({'ygData': {'attachments': [{'attachmentId': i} for i in range(1000)]}}).encode('utf-8')
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            requests_seen.append(self.path)
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            # The first response's connection drops part way through the body
+            self.wfile.write(body if len(requests_seen) > 1 else body[:1000])
+            self.close_connection = True
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever).start()
+    try:
+        yga = YahooGroupsAPI('groupname', retry_policy=yahoogroupsapi.RetryPolicy(max_delay=0))
+        yga.BASE_URI = 'http://127.0.0.1:%d/api' % server.server_port
+        fname = str(tmpdir.join('attachments.json'))
+        with yga.stream_json(fname, 'attachments', count=999999) as attachments:
+            assert len(list(attachments.items('attachments'))) == 1000
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert len(requests_seen) == 2
+    assert tmpdir.listdir() == []
+
+
+@fixture
+def slow_server():
+    """Serves 10000 bytes, honouring Range requests. The first request's body stalls after 1000 bytes: it trickles if
+    the server's trickle attribute is set, otherwise it stops altogether."""
+    body = bytes(bytearray(i % 256 for i in range(10000)))
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            self.server.ranges.append(self.headers.get('Range'))
+            start = int(self.headers['Range'][6:-1]) if self.headers.get('Range') else 0
+            self.send_response(206 if start else 200)
+            self.send_header('Content-Length', str(len(body) - start))
+            if start:
+                self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(body) - 1, len(body)))
+            self.end_headers()
+            if len(self.server.ranges) > 1:
+                self.wfile.write(body[start:])
+                return
+            self.wfile.write(body[:1000])
+            self.wfile.flush()
+            for i in range(1000, 1100 if self.server.trickle else 1000):
+                time.sleep(0.02)
+                self.wfile.write(body[i:i+1])
+                self.wfile.flush()
+            time.sleep(2)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    server = Server(('127.0.0.1', 0), Handler)
+    server.body = body
+    server.ranges = []
+    server.trickle = False
+    threading.Thread(target=server.serve_forever).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_file_read_timeout(slow_server, tmpdir):
+    url = 'http://127.0.0.1:%d/file' % slow_server.server_port
+    fname = str(tmpdir.join('file'))
+    yga = YahooGroupsAPI('groupname', download_timeout=(1, 0.3))
+    yga.CHUNK_SIZE = 100
+
+    yga.download_file(url, fname=fname)
+    assert slow_server.ranges == [None, 'bytes=1000-']
+    assert tmpdir.join('file').read_binary() == slow_server.body
+
+
+def test_download_file_stalled(slow_server, tmpdir):
+    slow_server.trickle = True
+    url = 'http://127.0.0.1:%d/file' % slow_server.server_port
+    fname = str(tmpdir.join('file'))
+    # A byte every 0.02s never trips the read timeout, but is well under the minimum rate
+    yga = YahooGroupsAPI('groupname', download_timeout=(1, 1), min_download_rate=1000, stall_time=0.3)
+
+    start = time.time()
+    yga.download_file(url, fname=fname)
+    assert time.time() - start < 1.5
+    assert len(slow_server.ranges) == 2
+    assert tmpdir.join('file').read_binary() == slow_server.body
+
+
+def test_slow_consumer_not_stalled():
+    url = 'https://xa.yimg.com/file'
+    with responses.RequestsMock() as rsps:
+        rsps.add(responses.GET, url, body=b'x' * 5000)
+        yga = YahooGroupsAPI('groupname', min_download_rate=100000, stall_time=0.1)
+        yga.CHUNK_SIZE = 1000
+        r = yga.s.get(url, stream=True)
+        received = 0
+        # Time spent on each chunk by the caller doesn't count against the connection
+        for chunk in yga.watch_chunks(r):
+            time.sleep(0.05)
+            received += len(chunk)
+    assert received == 5000
+
+
+def test_download_file_malware(tmpdir):
+    url = 'https://xa.yimg.com/file'
+    fname = str(tmpdir.join('file'))
+    with responses.RequestsMock() as r:
+        r.add(responses.GET, url, body=b'This file may contain malware', status=400)
+        yga = YahooGroupsAPI('groupname')
+        yga.download_file(url, fname=fname)
+        assert len(r.calls) == 1
+    assert tmpdir.join('file').read_binary() == b'This file may contain malware'
@@ -0,0 +1,238 @@
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+
+import asyncio  # noqa: E402
+from aiohttp import web  # noqa: E402
+
+import yahoogroupsapi  # noqa: E402
+from yahoogroupsapi_async import AsyncYahooGroupsAPI, HTTPError  # noqa: E402
+
+
+def serve(routes, test, **api_args):
+    """Run the coroutine function test against a local server for routes, passing it a client pointed at the server
+    and created with api_args."""
+    async def main():
+        app = web.Application()
+        app.add_routes(routes)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        base = 'http://127.0.0.1:%d' % port
+
+        yga = AsyncYahooGroupsAPI('groupname', **api_args)
+        yga.BASE_URI = base + '/api'
+        try:
+            return await test(yga, base)
+        finally:
+            await yga.close()
+            await runner.cleanup()
+
+    return asyncio.new_event_loop().run_until_complete(main())
+
+
+def test_get_json():
+    async def handler(request):
+        assert dict(request.query) == {'param1': 'c', 'param2': '4'}
+        return web.json_response({'ygData': {'result': 'returned data'}})
+
+    async def test(yga, base):
+        return await yga.files('a', 2, param1='c', param2=4)
+
+    json = serve([web.get('/api/v2/groups/groupname/files/a/2', handler)], test)
+    assert json == {'result': 'returned data'}
+
+
+def test_one_retry():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            return web.json_response({'ygError': {}}, status=500)
+        return web.json_response({'ygData': {'ok': 'on second try'}})
+
+    async def test(yga, base):
+        return await yga.HackGroupInfo()
+
+    assert serve([web.get('/api/v1/groups/groupname/', handler)], test) == {'ok': 'on second try'}
+    assert len(calls) == 2
+
+
+def test_unauthorized_error():
+    async def handler(request):
+        return web.json_response({'ygError': {'errorCode': 1103}}, status=401)
+
+    async def test(yga, base):
+        with pytest.raises(yahoogroupsapi.Unauthorized):
+            await yga.HackGroupInfo()
+
+    serve([web.get('/api/v1/groups/groupname/', handler)], test)
+
+
+def test_concurrent_requests():
+    in_flight = []
+    peak = []
+
+    async def handler(request):
+        in_flight.append(request)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.05)
+        in_flight.pop()
+        return web.json_response({'ygData': {'msgId': int(request.match_info['id'])}})
+
+    async def test(yga, base):
+        return await asyncio.gather(*[yga.messages(i) for i in range(10)])
+
+    results = serve([web.get('/api/v1/groups/groupname/messages/{id}', handler)], test)
+    assert [r['msgId'] for r in results] == list(range(10))
+    assert max(peak) > 1
+
+
+def test_cache_coalesces_concurrent_requests():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        await asyncio.sleep(0.05)
+        return web.json_response({'ygData': {'msgId': 1}})
+
+    async def test(yga, base):
+        yga.cache = yahoogroupsapi.ResponseCache()
+        results = await asyncio.gather(*[yga.messages(1) for _ in range(5)])
+        results.append(await yga.messages(1))
+        return results
+
+    results = serve([web.get('/api/v1/groups/groupname/messages/1', handler)], test)
+    assert results == [{'msgId': 1}] * 6
+    assert len(calls) == 1
+
+
+def test_download_file():
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            return web.Response(body=b'x' * 64)
+        return web.Response(body=b'y' * 1000)
+
+    async def missing(request):
+        return web.Response(status=404)
+
+    async def test(yga, base):
+        with pytest.raises(HTTPError):
+            await yga.download_file(base + '/missing')
+        return await yga.download_file(base + '/file')
+
+    assert serve([web.get('/file', handler), web.get('/missing', missing)], test) == b'y' * 1000
+    assert len(calls) == 2
+
+
+def slow_file(ranges, trickle):
+    """Handler serving 10000 bytes, honouring Range requests. The first request's body stalls after 1000 bytes: it
+    trickles if trickle is set, otherwise it stops altogether."""
+    body = bytes(bytearray(i % 256 for i in range(10000)))
+
+    async def handler(request):
+        ranges.append(request.headers.get('Range'))
+        start = int(request.headers['Range'][6:-1]) if 'Range' in request.headers else 0
+        r = web.StreamResponse(status=206 if start else 200)
+        r.content_length = len(body) - start
+        if start:
+            r.headers['Content-Range'] = 'bytes %d-%d/%d' % (start, len(body) - 1, len(body))
+        await r.prepare(request)
+        if len(ranges) > 1:
+            await r.write(body[start:])
+            return r
+        await r.write(body[:1000])
+        for i in range(1000, 1100 if trickle else 1000):
+            await asyncio.sleep(0.02)
+            await r.write(body[i:i+1])
+        await asyncio.sleep(2)
+        return r
+
+    return body, handler
+
+
+@pytest.mark.parametrize('trickle', [False, True])
+def test_download_file_slow(tmpdir, trickle):
+    ranges = []
+    body, handler = slow_file(ranges, trickle)
+    fname = str(tmpdir.join('file'))
+
+    async def test(yga, base):
+        yga.CHUNK_SIZE = 100
+        await yga.download_file(base + '/file', fname=fname)
+
+    # A byte every 0.02s never trips the read timeout, but is well under the minimum rate
+    serve([web.get('/file', handler)], test, download_timeout=(1, 0.3 if not trickle else 1), min_download_rate=1000,
+          stall_time=0.3)
+    assert ranges[0] is None
+    assert len(ranges) == 2
+    assert tmpdir.join('file').read_binary() == body
+
+
+def test_stream_json(tmpdir):
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            return web.json_response({'ygError': {}}, status=500)
+        return web.json_response({'ygData': {'total': 2, 'attachments': [{'attachmentId': 1}, {'attachmentId': 2}]}})
+
+    fname = str(tmpdir.join('attachments.json.raw'))
+
+    async def test(yga, base):
+        return await yga.stream_json(fname, 'attachments', count=999999)
+
+    with serve([web.get('/api/v1/groups/groupname/attachments', handler)], test) as attachments:
+        assert [a['attachmentId'] for a in attachments.items('attachments')] == [1, 2]
+        assert attachments.fields('attachments') == {'total': 2}
+    assert len(calls) == 2
+    assert tmpdir.listdir() == []
+
+
+def test_async_topics_resume_from_checkpoint(tmpdir, monkeypatch):
+    import json
+    import yahoo_async
+    from benchmark import archive_section
+    from mockserver import MockServer, SyntheticGroup
+
+    server = MockServer(SyntheticGroup(messages=40, messages_per_topic=4)).start()
+    process_single_topic = yahoo_async.TopicCrawl.process_single_topic
+    done = []
+
+    async def interrupted(self, topicId, refresh=False):
+        # Topics are fetched concurrently, so the first three are let finish before the rest fail
+        if topicId > 9:
+            while len(done) < 3:
+                await asyncio.sleep(0.01)
+            raise RuntimeError("Interrupted")
+        topicResults = await process_single_topic(self, topicId, refresh)
+        done.append(topicId)
+        return topicResults
+
+    try:
+        with tmpdir.as_cwd():
+            monkeypatch.setattr(yahoo_async.TopicCrawl, 'process_single_topic', interrupted)
+            with pytest.raises(RuntimeError):
+                archive_section('topics', server.api_uri, 'mockgroup', use_async=True)
+            checkpoint = json.loads(tmpdir.join('topics', 'topics_checkpoint.json').read_text('utf-8'))
+            assert sorted(checkpoint['topicLinks']) == ['1', '5', '9']
+
+            monkeypatch.setattr(yahoo_async.TopicCrawl, 'process_single_topic', process_single_topic)
+            before = server.stats()['requests']
+            archive_section('topics', server.api_uri, 'mockgroup', use_async=True)
+            resumed = server.stats()['requests'] - before
+    finally:
+        server.stop()
+
+    # As with the threaded crawl, no message metadata, just the 7 remaining topics and their 3 attachments
+    assert resumed == 7 + 3
+    assert not tmpdir.join('topics', 'topics_checkpoint.json').check()
+    retrieved = json.loads(tmpdir.join('topics', 'retrievedTopicIds.json').read_text('utf-8'))
+    assert sorted(retrieved) == list(range(1, 41, 4))
@@ -0,0 +1,228 @@
+from __future__ import unicode_literals
+import functools
+import logging
+import os
+import shutil
+import threading
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
+
+try:
+    from queue import Queue
+    from urllib.parse import urlsplit
+except ImportError:
+    from Queue import Queue
+    from urlparse import urlsplit
+
+from requests.adapters import HTTPAdapter
+from warcio.utils import BUFF_SIZE
+from warcio.warcwriter import WARCWriter
+
+
+class BackgroundWARCWriter(object):
+    """WARC writer which compresses and writes records on a background thread, into a series of numbered files.
+
+    Records are queued for writing, up to queue_size pairs at once, so the request path only pays for copying the
+    captured request and response. Output goes to <prefix>-00000.warc.gz, <prefix>-00001.warc.gz and so on, each
+    starting with a warcinfo record built from info; a new file is started once the current one reaches max_size
+    bytes (if given). Each run starts a new file rather than appending to the last.
+
+    Provides the parts of warcio's WARCWriter interface used by WARCAdapter, and may be shared between threads.
+    """
+    logger = logging.getLogger(name="BackgroundWARCWriter")
+
+    def __init__(self, prefix, info=None, max_size=None, queue_size=100):
+        # Files are opened by the writer thread, whenever it gets to them, wherever the working directory is then
+        self.prefix = os.path.abspath(prefix)
+        self.info = info
+        self.max_size = max_size
+        self.queue = Queue(queue_size)
+        self.error = None
+
+        # Builds records on the calling thread; does no writing of its own.
+        self.builder = WARCWriter(None, gzip=True)
+
+        self.number = 0
+        while os.path.exists(self.file_name(self.number)):
+            self.number += 1
+        self.out = None
+        self.writer = None
+
+        self.thread = threading.Thread(target=self.run, name="BackgroundWARCWriter")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def file_name(self, number):
+        return '%s-%05d.warc.gz' % (self.prefix, number)
+
+    def create_warc_record(self, uri, record_type, payload=None, length=None, *args, **kwargs):
+        # The caller closes payload once the record is handed over, so the record must carry its own copy.
+        if payload is not None:
+            copy = SpooledTemporaryFile(BUFF_SIZE)
+            shutil.copyfileobj(payload, copy)
+            copy.seek(0)
+            payload = copy
+        return self.builder.create_warc_record(uri, record_type, payload, length, *args, **kwargs)
+
+    def create_warcinfo_record(self, filename, info):
+        return self.builder.create_warcinfo_record(filename, info)
+
+    def write_request_response_pair(self, req, resp, params=None):
+        self.check()
+        self.queue.put((req, resp))
+
+    def write_record(self, record, params=None):
+        self.check()
+        self.queue.put((record,))
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def open_next(self):
+        if self.out is not None:
+            self.out.close()
+            self.number += 1
+        name = self.file_name(self.number)
+        self.logger.info("Writing WARC records to %s", name)
+        self.out = open(name, 'wb')
+        self.writer = WARCWriter(self.out, gzip=True)
+        self.writer.write_record(self.writer.create_warcinfo_record(os.path.basename(name), self.info or {}))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                if self.out is None or (self.max_size and self.out.tell() >= self.max_size):
+                    self.open_next()
+                if len(item) == 2:
+                    self.writer.write_request_response_pair(*item)
+                else:
+                    self.writer.write_record(item[0])
+                self.out.flush()
+            except Exception as e:
+                self.logger.exception("Failed to write WARC record")
+                self.error = e
+            finally:
+                for record in item:
+                    record.raw_stream.close()
+
+        if self.out is not None:
+            self.out.close()
+
+    def close(self):
+        """Wait for queued records to be written, and close the current file."""
+        self.queue.put(None)
+        self.thread.join()
+        self.check()
+
+
+class RecordingStream(object):
+    """Wraps a response's underlying file, keeping a copy of everything read from it until it is closed."""
+
+    def __init__(self, fp, on_close):
+        self.fp = fp
+        self.on_close = on_close
+        self.buffer = SpooledTemporaryFile(BUFF_SIZE)
+
+    def read(self, *args):
+        data = self.fp.read(*args)
+        self.buffer.write(data)
+        return data
+
+    def read1(self, *args):
+        data = self.fp.read1(*args)
+        self.buffer.write(data)
+        return data
+
+    def readline(self, *args):
+        data = self.fp.readline(*args)
+        self.buffer.write(data)
+        return data
+
+    def readinto(self, b):
+        n = self.fp.readinto(b)
+        if n:
+            self.buffer.write(memoryview(b)[:n])
+        return n
+
+    def close(self):
+        self.fp.close()
+        if self.on_close is not None:
+            on_close, self.on_close = self.on_close, None
+            on_close(self.buffer)
+
+    def __getattr__(self, name):
+        return getattr(self.fp, name)
+
+
+class WARCAdapter(HTTPAdapter):
+    """Transport adapter which records each request and response made through it to a WARC writer.
+
+    Mounted on a single session, so unlike warcio's capture_http, nothing is patched process-wide and sessions
+    may record to different writers concurrently. The request is rebuilt from the prepared request, and the
+    response from its status line and headers plus the body exactly as read from the connection (still chunked
+    and compressed, if it was sent that way). A response is written once its body has been read and closed, so a
+    body that is only partly read is only partly recorded.
+    """
+    logger = logging.getLogger(name="WARCAdapter")
+
+    def __init__(self, writer, *args, **kwargs):
+        super(WARCAdapter, self).__init__(*args, **kwargs)
+        self.writer = writer
+        self.lock = threading.Lock()
+
+    def send(self, request, *args, **kwargs):
+        response = super(WARCAdapter, self).send(request, *args, **kwargs)
+        record = functools.partial(self.write_records, request, response)
+
+        # Tap the socket file below http.client where there is one, so the body is recorded as it was sent.
+        owner = response.raw
+        if hasattr(owner._fp, 'fp'):
+            if owner._fp.fp is None:
+                # http.client has already read the whole (empty) body.
+                record(BytesIO())
+                return response
+            owner = owner._fp
+            owner.fp = RecordingStream(owner.fp, record)
+        else:
+            owner._fp = RecordingStream(owner._fp, record)
+        return response
+
+    def write_records(self, request, response, body):
+        try:
+            url = urlsplit(request.url)
+            head = ['%s %s HTTP/1.1' % (request.method, request.path_url)]
+            if 'Host' not in request.headers:
+                head.append('Host: %s' % url.netloc)
+            head += ['%s: %s' % item for item in request.headers.items()]
+            request_data = ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1')
+            if request.body:
+                request_data += request.body if isinstance(request.body, bytes) else request.body.encode('utf-8')
+
+            raw = response.raw
+            headers = raw.headers.iteritems() if hasattr(raw.headers, 'iteritems') else raw.headers.items()
+            head = ['HTTP/%s %d %s' % ('1.0' if raw.version == 10 else '1.1', raw.status, raw.reason)]
+            head += ['%s: %s' % item for item in headers]
+            response_data = SpooledTemporaryFile(BUFF_SIZE)
+            response_data.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+            body.seek(0)
+            shutil.copyfileobj(body, response_data)
+            length = response_data.tell()
+            response_data.seek(0)
+
+            req = self.writer.create_warc_record(request.url, 'request', payload=BytesIO(request_data),
+                                                 length=len(request_data))
+            resp = self.writer.create_warc_record(request.url, 'response', payload=response_data, length=length)
+            with self.lock:
+                self.writer.write_request_response_pair(req, resp)
+            response_data.close()
+        except Exception:
+            # Never let a recording failure break the download itself
+            self.logger.exception("Failed to record %s", request.url)
+        finally:
+            body.close()
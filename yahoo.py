@@ -2,26 +2,42 @@
 from __future__ import unicode_literals
 import yahoogroupsapi
 from yahoogroupsapi import YahooGroupsAPI
+from manifest import Manifest
+from packedstore import PackedStore
+from blobstore import BlobStore
+from photovariants import PhotoVariants
+from jsonstream import dump_list, dump_object
+from pagination import CURSOR, Paginator
+from checkpoint import TopicCheckpoint
+from metrics import Metrics
+import storage
+from storage import (PHOTO_VARIANTS_FILE, TOPICS_CHECKPOINT_FILE, Mkchdir, SectionFailed, best_photo_variant,
+                     fetch_file, file_done, file_keep, get_best_photoinfo, load_metadata_state, load_record_items,
+                     make_folder, metadata_state, photo_variant_result, record_exists, sanitise_file_name,
+                     sanitise_folder_name, save_metadata_state, save_record, save_record_items, set_file_mtime,
+                     set_mtime, write_empty_file)
 
 import argparse
 import codecs
 import datetime
 import json
+import itertools
 import logging
-import math
+import multiprocessing
 import os
-import re
 import requests.exceptions
+import threading
 import time
 import sys
-import unicodedata
 from os.path import basename
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from requests.cookies import RequestsCookieJar, create_cookie
 
 
 if (sys.version_info < (3, 0)):
     from cookielib import LWPCookieJar
+    from Queue import Empty
     from urllib import unquote
     from HTMLParser import HTMLParser
     hp = HTMLParser()
@@ -29,6 +45,7 @@ if (sys.version_info < (3, 0)):
     text = unicode  # noqa: F821
 else:
     from http.cookiejar import LWPCookieJar
+    from queue import Empty
     from urllib.parse import unquote
     from html import unescape as html_unescape
     text = str
@@ -41,60 +58,80 @@ WARC_META_PARAMS = OrderedDict([('software', 'yahoo-group-archiver'),
                                 ('command-arguments', ' '.join(sys.argv))
                                 ])
 
+# Progress of an unfinished topic crawl, consulted by process_single_topic while archive_topics runs
+topic_checkpoint = None
 
-def get_best_photoinfo(photoInfoArr, exclude=[]):
-    logger = logging.getLogger(name="get_best_photoinfo")
-    rs = {'tn': 0, 'sn': 1, 'hr': 2, 'or': 3}
+# Outcome of each section archived by this run, saved to SECTION_STATUS_FILE as each section finishes
+section_status = OrderedDict()
+SECTION_STATUS_FILE = 'archive_status.json'
 
-    # exclude types we're not interested in
-    for x in exclude:
-        if x in rs:
-            rs[x] = -1
+# Sections which take little time, and are started first when archiving sections concurrently
+QUICK_SECTIONS = ('about', 'links', 'polls', 'database', 'calendar', 'members')
 
-    best = photoInfoArr[0]
-    for info in photoInfoArr:
-        if info['photoType'] not in rs:
-            logger.error("photoType '%s' not known", info['photoType'])
-            continue
-        if rs[info['photoType']] >= rs[best['photoType']]:
-            best = info
-    if rs[best['photoType']] == -1:
-        return None
-    else:
-        return best
+# Shares the --delay budget between processes archiving sections concurrently, when no --rate-limit-file is given
+SECTION_RATE_LIMIT_FILE = 'rate_limit.json'
 
 
-def archive_messages_metadata(yga):
+def archive_messages_metadata(yga, incremental=False, topic_index=None):
+    """
+    Save the message metadata index pages and return the message IDs listed in them, and the position reached in the
+    index, to be saved with save_metadata_state once those messages have been archived.
+    If incremental, paging resumes from the last page seen by the previous run, and only IDs of messages newer
+    than that run, or that it couldn't archive, are returned.
+    If a topic_index dict is given, it is filled with the topic ID of each message that lists one.
+    """
     logger = logging.getLogger('archive_message_metadata')
-    params = {'sortOrder': 'asc', 'direction': 1, 'count': 1000}
+
+    def fetch(start, count):
+        params = {'sortOrder': 'asc', 'direction': 1, 'count': count}
+        if start:
+            params['start'] = start
+        return yga.messages(**params)
 
     message_ids = []
-    next_page_start = float('inf')
     page_count = 0
 
     logger.info("Archiving message metadata...")
-    last_next_page_start = 0
 
-    while next_page_start > 0:
-        msgs = yga.messages(**params)
+    state = load_metadata_state() if incremental else None
+    last_message_id = state['lastMessageId'] if state else 0
+    if state:
+        page_count = state['pageCount']
+        logger.info("Resuming message metadata from page %d, after message id %d", page_count, state['lastMessageId'])
+
+    reached = None
+    paginator = Paginator(fetch, 'messages', CURSOR, page_size=1000, start=state['pageStart'] if state else None,
+                          total_key='totalRecords')
+    for page_start, msgs, page in paginator.pages():
         with open("message_metadata_%s.json" % page_count, 'wb') as f:
             json.dump(msgs, codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
 
-        message_ids += [msg['messageId'] for msg in msgs['messages']]
+        page_ids = [msg['messageId'] for msg in page]
+        message_ids += page_ids
+        if topic_index is not None:
+            topic_index.update((msg['messageId'], msg['topicId']) for msg in page if msg.get('topicId'))
 
         logger.info("Archived message metadata records (%d of %d)", len(message_ids), msgs['totalRecords'])
 
+        last_message_id = max([last_message_id] + page_ids)
+        reached = metadata_state(page_count, page_start or 0, last_message_id)
         page_count += 1
-        next_page_start = params['start'] = msgs['nextPageStart']
-        if next_page_start == last_next_page_start:
-            break
-        last_next_page_start = next_page_start
 
-    return message_ids
+    if state:
+        pending = state.get('pendingMessageIds', [])
+        message_ids = sorted(set(pending).union(id for id in message_ids if id > state['lastMessageId']))
+        logger.info("Found %d new messages since the last run, and %d it couldn't archive",
+                    len(message_ids) - len(pending), len(pending))
+
+    return message_ids, reached
 
 
 def archive_message_content(yga, id, status="", skipHTML=False, skipRaw=False):
+    """
+    Archive message id, returning False if it couldn't all be fetched.
+    """
     logger = logging.getLogger('archive_message_content')
+    ok = True
 
     if skipRaw is False:
         fname = "%s_raw.json" % (id,)
@@ -102,12 +139,10 @@ def archive_message_content(yga, id, status="", skipHTML=False, skipRaw=False):
             try:
                 logger.info("Fetching  raw message id: %d %s", id, status)
                 raw_json = yga.messages(id, 'raw')
-                with open(fname, 'wb') as f:
-                    json.dump(raw_json, codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
-                if 'postDate' in raw_json:
-                    set_mtime(fname, int(raw_json['postDate']))
+                save_record(fname, raw_json, int(raw_json['postDate']) if 'postDate' in raw_json else None)
             except Exception:
                 logger.exception("Raw grab failed for message %d", id)
+                ok = False
 
     if skipHTML is False:
         fname = "%s.json" % (id,)
@@ -115,31 +150,27 @@ def archive_message_content(yga, id, status="", skipHTML=False, skipRaw=False):
             try:
                 logger.info("Fetching html message id: %d %s", id, status)
                 html_json = yga.messages(id)
-                with open(fname, 'wb') as f:
-                    json.dump(html_json, codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
-                if 'postDate' in html_json:
-                    set_mtime(fname, int(html_json['postDate']))
+                save_record(fname, html_json, int(html_json['postDate']) if 'postDate' in html_json else None)
 
                 if 'attachmentsInfo' in html_json and len(html_json['attachmentsInfo']) > 0:
-                    with Mkchdir("%d_attachments" % id):
-                        process_single_attachment(yga, html_json['attachmentsInfo'])
+                    attach_dir = make_folder("%d_attachments" % id)
+                    process_single_attachment(yga, html_json['attachmentsInfo'], attach_dir)
                     if 'postDate' in html_json:
-                        set_mtime(sanitise_folder_name("%d_attachments" % id), int(html_json['postDate']))
+                        set_mtime(attach_dir, int(html_json['postDate']))
             except Exception:
                 logger.exception("HTML grab failed for message %d", id)
+                ok = False
+    return ok
 
 
-def archive_email(yga, message_subset=None, start=None, stop=None, skipHTML=False, skipRaw=False):
+def archive_email(yga, message_subset=None, start=None, stop=None, skipHTML=False, skipRaw=False, workers=1,
+                  incremental=False):
     logger = logging.getLogger('archive_email')
     try:
         # Grab messages for initial counts and permissions check
         init_messages = yga.messages()
     except yahoogroupsapi.AuthenticationError:
-        logger.error("Couldn't access Messages functionality for this group")
-        return
-    except Exception:
-        logger.exception("Unknown error archiving messages")
-        return
+        raise SectionFailed("Couldn't access Messages functionality for this group")
 
     if start is not None or stop is not None:
         start = start or 1
@@ -154,65 +185,149 @@ def archive_email(yga, message_subset=None, start=None, stop=None, skipHTML=Fals
             message_subset = list(s)
             message_subset.sort()
 
+    reached = None
     if not message_subset:
-        message_subset = archive_messages_metadata(yga)
+        message_subset, reached = archive_messages_metadata(yga, incremental)
         logger.info("Group has %s messages (maximum id: %s), fetching all",
                     len(message_subset), (message_subset or ['n/a'])[-1])
 
-    n = 1
-    for id in message_subset:
-        status = "(%d of %d)" % (n, len(message_subset))
-        n += 1
-        try:
-            archive_message_content(yga, id, status, skipHTML, skipRaw)
-        except Exception:
-            logger.exception("Failed to get message id: %d", id)
-            continue
+    failed = []
+    if workers > 1:
+        logger.info("Fetching messages with %d workers", workers)
+        total = len(message_subset)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [(id, executor.submit(archive_message_content, yga, id, "(%d of %d)" % (n, total), skipHTML, skipRaw))
+                       for n, id in enumerate(message_subset, 1)]
+            for id, future in futures:
+                try:
+                    if not future.result():
+                        failed.append(id)
+                except Exception:
+                    logger.exception("Failed to get message id: %d", id)
+                    failed.append(id)
+    else:
+        n = 1
+        for id in message_subset:
+            status = "(%d of %d)" % (n, len(message_subset))
+            n += 1
+            try:
+                if not archive_message_content(yga, id, status, skipHTML, skipRaw):
+                    failed.append(id)
+            except Exception:
+                logger.exception("Failed to get message id: %d", id)
+                failed.append(id)
+
+    # Only now are the messages found in the metadata archived, or known to need another try
+    if reached is not None:
+        save_metadata_state(reached, failed)
 
 
-def archive_topics(yga):
+def archive_topics(yga, incremental=False, workers=1):
+    """
+    Archive every topic, finding them from the message metadata and then by following the links between topics.
+    Progress is checkpointed in TOPICS_CHECKPOINT_FILE, and a crawl that was interrupted resumes from it.
+    """
+    global topic_checkpoint
     logger = logging.getLogger('archive_topics')
 
-	# Grab messages for initial counts and permissions check
-    logger.info("Initializing messages.")
+    checkpoint = TopicCheckpoint(TOPICS_CHECKPOINT_FILE)
+    if checkpoint.load() and checkpoint.incremental == incremental:
+        logger.info("Resuming from checkpoint, with %d topics and %d messages already retrieved.",
+                    len(checkpoint.sets['retrievedTopicIds']), len(checkpoint.sets['retrievedMessageIds']))
+        expectedTopics = checkpoint.expected_topics
+        indexedTopicIds = checkpoint.indexed_topic_ids
+    else:
+        checkpoint = TopicCheckpoint(TOPICS_CHECKPOINT_FILE)
+
+        # Grab messages for initial counts and permissions check
+        logger.info("Initializing messages.")
+        try:
+            init_messages = yga.messages()
+        except yahoogroupsapi.AuthenticationError:
+            raise SectionFailed("Couldn't access Messages functionality for this group")
+
+        expectedTopics = init_messages['numTopics']
+
+        logger.info("Getting message metadata.")
+        topicIndex = {}
+        message_subset, reached = archive_messages_metadata(yga, incremental, topicIndex)
+        if len(message_subset) == 0:
+            if incremental:
+                logger.info("No new messages since the last run.")
+                save_metadata_state(reached)
+            else:
+                raise SectionFailed("No messages available")
+            return
+
+        # Occasionally messages reported in the metadata aren't actually available from Yahoo.
+        # We also found a group where expectedTopics was 1 less than the actual number of topics available, but the script still downloaded everything.
+        logger.info("Expecting %d topics and %d messages.",expectedTopics,len(message_subset))
+
+        # Fetch the topics the metadata told us about directly. This leaves only messages without a topic in the
+        # metadata, or in topics that couldn't be fetched, to be found by probing messages one at a time.
+        indexedTopicIds = sorted(set(topicIndex[msgId] for msgId in message_subset if msgId in topicIndex))
+        logger.info("Found %d topics in the message metadata.", len(indexedTopicIds))
+
+        checkpoint.incremental = incremental
+        checkpoint.metadata_state = reached
+        checkpoint.expected_topics = expectedTopics
+        checkpoint.indexed_topic_ids = indexedTopicIds
+        checkpoint.sets['potentialMessageIds'].update(message_subset)
+        # Saved straight away, so that a resumed crawl doesn't page through the message metadata again
+        checkpoint.save()
+
+    unretrievableTopicIds = checkpoint.sets['unretrievableTopicIds']
+    unretrievableMessageIds = checkpoint.sets['unretrievableMessageIds']
+    retrievedTopicIds = checkpoint.sets['retrievedTopicIds']
+    retrievedMessageIds = checkpoint.sets['retrievedMessageIds']
+    potentialMessageIds = checkpoint.sets['potentialMessageIds']
+
+    topic_checkpoint = checkpoint
     try:
-        init_messages = yga.messages()
-    except yahoogroupsapi.AuthenticationError:
-        logger.error("Couldn't access Messages functionality for this group")
-        return
+        with checkpoint.saved_on_signal():
+            if workers > 1:
+                logger.info("Crawling topics with %d workers", workers)
+                crawl_topics_concurrently(workers,indexedTopicIds,unretrievableTopicIds,unretrievableMessageIds,retrievedTopicIds,retrievedMessageIds,potentialMessageIds,expectedTopics,incremental)
+            else:
+                for topicId in indexedTopicIds:
+                    if topicId not in retrievedTopicIds and topicId not in unretrievableTopicIds:
+                        process_single_topic(topicId,unretrievableTopicIds,unretrievableMessageIds,retrievedTopicIds,retrievedMessageIds,potentialMessageIds,expectedTopics,incremental)
+
+                # Continue trying to grab topics and messages until all potential messages are retrieved or found to be unretrievable.
+                while potentialMessageIds:
+                    startingTopicId = find_topic_id(unretrievableTopicIds,unretrievableMessageIds,retrievedTopicIds,retrievedMessageIds,potentialMessageIds)
+                    if startingTopicId is not None:
+                        process_surrounding_topics(startingTopicId,unretrievableTopicIds,unretrievableMessageIds,retrievedTopicIds,retrievedMessageIds,potentialMessageIds,expectedTopics,incremental)
+    except BaseException:
+        checkpoint.save()
+        raise
+    finally:
+        topic_checkpoint = None
 
-    expectedTopics = init_messages['numTopics']
-    
-    logger.info("Getting message metadata.")
-    message_subset = archive_messages_metadata(yga)
-    if len(message_subset) == 0:
-        logger.error("ERROR: no messages available.")
-        return
-    
-	# Occasionally messages reported in the metadata aren't actually available from Yahoo.
-	# We also found a group where expectedTopics was 1 less than the actual number of topics available, but the script still downloaded everything.
-    logger.info("Expecting %d topics and %d messages.",expectedTopics,len(message_subset))
-    
-    unretrievableTopicIds = set()
-    unretrievableMessageIds = set()
-    retrievedTopicIds = set()
-    retrievedMessageIds = set()
-    potentialMessageIds = set(message_subset)
-    
-    # Continue trying to grab topics and messages until all potential messages are retrieved or found to be unretrievable.
-    while potentialMessageIds:
-        startingTopicId = find_topic_id(unretrievableTopicIds,unretrievableMessageIds,retrievedTopicIds,retrievedMessageIds,potentialMessageIds)
-        if startingTopicId is not None:
-            process_surrounding_topics(startingTopicId,unretrievableTopicIds,unretrievableMessageIds,retrievedTopicIds,retrievedMessageIds,potentialMessageIds,expectedTopics)
-    
-           
     logger.info("Topic archiving complete.")
     logger.info("There are %d retrieved topic(s).",len(retrievedTopicIds))
     logger.info("There are %d retrieved message(s).",len(retrievedMessageIds))           
     logger.info("There are %d unretrievable topic(s).",len(unretrievableTopicIds))
     logger.info("There are %d unretrievable message(s).",len(unretrievableMessageIds))
     
-    # Save the tracking sets.
+    # Only now are the messages found in the metadata archived, or known to need another try
+    if checkpoint.metadata_state is not None:
+        save_metadata_state(checkpoint.metadata_state, unretrievableMessageIds)
+
+    # Save the tracking sets, adding to those of earlier runs if incremental.
+    if incremental:
+        for fname, ids in (("retrievedTopicIds.json", retrievedTopicIds), ("retrievedMessageIds.json", retrievedMessageIds)):
+            if os.path.exists(fname):
+                with open(fname, 'rb') as f:
+                    ids.update(json.load(codecs.getreader('utf-8')(f)))
+        # Anything retrieved this time is no longer unretrievable.
+        for fname, ids, retrieved in (("unretrievableTopicIds.json", unretrievableTopicIds, retrievedTopicIds),
+                                      ("unretrievableMessageIds.json", unretrievableMessageIds, retrievedMessageIds)):
+            if os.path.exists(fname):
+                with open(fname, 'rb') as f:
+                    ids.update(json.load(codecs.getreader('utf-8')(f)))
+            ids.difference_update(retrieved)
+
     with open("retrievedTopicIds.json", 'wb') as f:
             json.dump(list(retrievedTopicIds), codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
     with open("retrievedMessageIds.json", 'wb') as f:
@@ -221,70 +336,135 @@ def archive_topics(yga):
             json.dump(list(unretrievableTopicIds), codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
     with open("unretrievableMessageIds.json", 'wb') as f:
             json.dump(list(unretrievableMessageIds), codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)           
+    checkpoint.remove()
 
 
 # Find a topic ID from among potentialMessageIds to start topic archiving with.
 # Also save messages from unretrievable topics when possible.
 def find_topic_id(unretrievableTopicIds,unretrievableMessageIds,retrievedTopicIds,retrievedMessageIds,potentialMessageIds):
-    logger = logging.getLogger('find_topic_id')
-    
     # Keep looking as long as the set of potential message IDs is not emty.
     while potentialMessageIds:
         # Check an arbitrary message.
         msgId = potentialMessageIds.pop()
-        logger.info("Checking message ID %d to find topic.",msgId)
-        try:
-            html_json = yga.messages(msgId)
-            topicId = html_json.get("topicId")
-            logger.info("The message is part of topic ID %d", topicId)
-            
-            writeMessage = False
-            
-            # We've already retrieved this topic. This could indicate a bug, or maybe messages have been added since it was downloaded.
-            # We'll want to save the individual message.
-            if topicId in retrievedTopicIds:
-                logger.error("ERROR: This topic has already been archived.")
-                writeMessage = True
-            
-            # We've previously tried getting this topic, and it's no good.
-            # Since this is the only way to get the message, go ahead and save it.
-            elif topicId in unretrievableTopicIds:
-                logger.info("This topic is known to be unretrievable. Saving individual message.")
-                writeMessage = True
-                
-            
-            # If we got a message despite some issue with the topic, go ahead and save it.
-            # Sometimes Yahoo will give you a message in an unretrievable topic through the messages API.
-            if writeMessage:                
-                retrievedMessageIds.add(msgId)
-                with Mkchdir('email'):
-                    if file_keep("%s.json" % (msgId,), "html message id: %d" % (msgId,)) is False:
-                        with open("%s.json" % (msgId,), 'wb') as f:
-                            json.dump(html_json, codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
-
-                    if 'attachmentsInfo' in html_json and len(html_json['attachmentsInfo']) > 0:
-                        with Mkchdir("%d_attachments" % msgId):
-                            process_single_attachment(yga, html_json['attachmentsInfo'])
-                logger.info("%d total messages downloaded.",len(retrievedMessageIds))
-                continue # Keep trying to find a topic ID.
-            
-            
-            # We found a valid topic. Put msgId back in potentialMessageIds since it should be archived with the topic.
-            else:
-                potentialMessageIds.add(msgId)
-                return topicId
-            
-        except:
-            logger.exception("HTML grab failed for message %d", msgId)
-            unretrievableMessageIds.add(msgId)
-    
-    # Ran out of messages to check.        
+        topicId = probe_message_topic(msgId,unretrievableTopicIds,unretrievableMessageIds,retrievedTopicIds,retrievedMessageIds,potentialMessageIds)
+        if topicId is not None:
+            return topicId
+
+    # Ran out of messages to check.
     return None
-    
-    
-def process_surrounding_topics(startingTopicId,unretrievableTopicIds,unretrievableMessageIds,retrievedTopicIds,retrievedMessageIds,potentialMessageIds,expectedTopics):
+
+
+# Fetch a message (already taken out of potentialMessageIds) to find its topic ID.
+# Returns the topic ID if it should be archived, otherwise saves the message individually and returns None.
+def probe_message_topic(msgId,unretrievableTopicIds,unretrievableMessageIds,retrievedTopicIds,retrievedMessageIds,potentialMessageIds):
+    logger = logging.getLogger('find_topic_id')
+
+    logger.info("Checking message ID %d to find topic.",msgId)
+    try:
+        html_json = yga.messages(msgId)
+        topicId = html_json.get("topicId")
+        logger.info("The message is part of topic ID %d", topicId)
+        
+        writeMessage = False
+        
+        # We've already retrieved this topic. This could indicate a bug, or maybe messages have been added since it was downloaded.
+        # We'll want to save the individual message.
+        if topicId in retrievedTopicIds:
+            logger.error("ERROR: This topic has already been archived.")
+            writeMessage = True
+        
+        # We've previously tried getting this topic, and it's no good.
+        # Since this is the only way to get the message, go ahead and save it.
+        elif topicId in unretrievableTopicIds:
+            logger.info("This topic is known to be unretrievable. Saving individual message.")
+            writeMessage = True
+            
+        
+        # If we got a message despite some issue with the topic, go ahead and save it.
+        # Sometimes Yahoo will give you a message in an unretrievable topic through the messages API.
+        if writeMessage:                
+            retrievedMessageIds.add(msgId)
+            email_dir = make_folder('email')
+            fname = os.path.join(email_dir, "%s.json" % (msgId,))
+            if file_keep(fname, "html message id: %d" % (msgId,)) is False:
+                save_record(fname, html_json)
+
+            if 'attachmentsInfo' in html_json and len(html_json['attachmentsInfo']) > 0:
+                attach_dir = make_folder("%d_attachments" % msgId, email_dir)
+                process_single_attachment(yga, html_json['attachmentsInfo'], attach_dir)
+            logger.info("%d total messages downloaded.",len(retrievedMessageIds))
+            return None # Keep trying to find a topic ID.
+        
+        
+        # We found a valid topic. Put msgId back in potentialMessageIds since it should be archived with the topic.
+        else:
+            potentialMessageIds.add(msgId)
+            return topicId
+        
+    except:
+        logger.exception("HTML grab failed for message %d", msgId)
+        unretrievableMessageIds.add(msgId)
+        return None
+
+
+def crawl_topics_concurrently(workers,indexedTopicIds,unretrievableTopicIds,unretrievableMessageIds,retrievedTopicIds,retrievedMessageIds,potentialMessageIds,expectedTopics,incremental=False):
+    """
+    Concurrent version of the crawl in archive_topics, sharing its tracking sets.
+    Topics known from the metadata are fetched by a pool of workers. Then, until no potential messages remain,
+    starting topics are found for messages spread across the remaining message IDs, and from each of those the
+    previous and next topic chains are walked at the same time. A walker stops when it reaches a topic another
+    walker has already claimed.
+    """
     logger = logging.getLogger(name="process_surrounding_topics")
-    topicResults = process_single_topic(startingTopicId,unretrievableTopicIds,unretrievableMessageIds,retrievedTopicIds,retrievedMessageIds,potentialMessageIds,expectedTopics)
+    claimedTopicIds = set()
+    claimLock = threading.Lock()
+
+    def fetch_topic(topicId, refresh=False):
+        with claimLock:
+            if topicId in claimedTopicIds:
+                return None
+            claimedTopicIds.add(topicId)
+        return process_single_topic(topicId,unretrievableTopicIds,unretrievableMessageIds,retrievedTopicIds,retrievedMessageIds,potentialMessageIds,expectedTopics,refresh)
+
+    def walk(topicId, direction):
+        while topicId > 0:
+            if topicId in unretrievableTopicIds:
+                logger.info("Reached known unretrievable topic ID %d",topicId)
+                break
+            if incremental and direction == "prevTopicId" and record_exists("%s.json" % (topicId,)):
+                logger.info("Reached topic ID %d archived by an earlier run",topicId)
+                break
+            topicResults = fetch_topic(topicId)
+            if topicResults is None:
+                logger.info("Reached topic ID %d, already claimed by another walker",topicId)
+                break
+            topicId = topicResults[direction]
+
+    def probe(msgId):
+        return probe_message_topic(msgId,unretrievableTopicIds,unretrievableMessageIds,retrievedTopicIds,retrievedMessageIds,potentialMessageIds)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(lambda topicId: fetch_topic(topicId, incremental), indexedTopicIds):
+            pass
+
+        while potentialMessageIds:
+            candidates = sorted(potentialMessageIds)
+            seeds = candidates[::max(1, len(candidates) // workers)][:workers]
+            potentialMessageIds.difference_update(seeds)
+
+            startingTopicIds = set(topicId for topicId in executor.map(probe, seeds) if topicId is not None)
+            walks = []
+            for topicResults in executor.map(lambda topicId: fetch_topic(topicId, incremental), startingTopicIds):
+                if topicResults is not None and topicResults["gotTopic"]:
+                    walks.append(executor.submit(walk, topicResults["prevTopicId"], "prevTopicId"))
+                    walks.append(executor.submit(walk, topicResults["nextTopicId"], "nextTopicId"))
+            for w in walks:
+                w.result()
+
+
+def process_surrounding_topics(startingTopicId,unretrievableTopicIds,unretrievableMessageIds,retrievedTopicIds,retrievedMessageIds,potentialMessageIds,expectedTopics,incremental=False):
+    logger = logging.getLogger(name="process_surrounding_topics")
+    topicResults = process_single_topic(startingTopicId,unretrievableTopicIds,unretrievableMessageIds,retrievedTopicIds,retrievedMessageIds,potentialMessageIds,expectedTopics,incremental)
     if topicResults["gotTopic"] is False:
         return
         
@@ -307,6 +487,9 @@ def process_surrounding_topics(startingTopicId,unretrievableTopicIds,unretrievab
         if prevTopicId in unretrievableTopicIds:
             logger.info("Reached known unretrievable topic ID %d",prevTopicId)
             break
+        if incremental and record_exists("%s.json" % (prevTopicId,)):
+            logger.info("Reached topic ID %d archived by an earlier run",prevTopicId)
+            break
         topicResults = process_single_topic(prevTopicId,unretrievableTopicIds,unretrievableMessageIds,retrievedTopicIds,retrievedMessageIds,potentialMessageIds,expectedTopics)
         prevTopicId = topicResults["prevTopicId"]
         
@@ -320,24 +503,34 @@ def process_surrounding_topics(startingTopicId,unretrievableTopicIds,unretrievab
         nextTopicId = topicResults["nextTopicId"]
 
  
-def process_single_topic(topicId,unretrievableTopicIds,unretrievableMessageIds,retrievedTopicIds,retrievedMessageIds,potentialMessageIds,expectedTopics):
+def process_single_topic(topicId,unretrievableTopicIds,unretrievableMessageIds,retrievedTopicIds,retrievedMessageIds,potentialMessageIds,expectedTopics,refresh=False):
     logger = logging.getLogger(name="process_single_topic")
     topicResults = {
         "gotTopic": False,
         "nextTopicId": 0,
         "prevTopicId": 0
     }
+
+    # A topic this crawl has already done, before it was interrupted and resumed, need not be read again.
+    links = topic_checkpoint.links.get(topicId) if topic_checkpoint is not None else None
+    if links is not None and record_exists("%s.json" % (topicId,)):
+        logger.info("Topic ID %d was archived before resuming from the checkpoint", topicId)
+        retrievedTopicIds.add(topicId)
+        topicResults["gotTopic"] = True
+        topicResults["prevTopicId"], topicResults["nextTopicId"] = links
+        return topicResults
     
-    # Grab the topic.
+    # Grab the topic. A big thread can be too large to hold in memory, so its messages are read one at a time.
     topic_json = None
+    messages = None
     gotTopic = False
     
-    # We already have the topic on disk and don't want to overwrite it.
-    if file_keep("%s.json" % (topicId,), "topic id: %d" % (topicId,)):
+    # We already have the topic on disk and don't want to overwrite it. Unless refreshing: an incremental run
+    # refreshes the topics it finds from new messages, as they hold a message any copy on disk is missing.
+    if not refresh and file_keep("%s.json" % (topicId,), "topic id: %d" % (topicId,)):
         # However, we need the previous and next topic, so we have to load the json.
         try:
-            with open('%s.json' % (topicId,), 'r', encoding='utf-8') as f:
-                topic_json = json.load(f)
+            topic_json, messages = load_record_items('%s.json' % (topicId,), 'messages')
             gotTopic = True
         except:
             logger.exception("ERROR: couldn't load %s.json from disk.",topicId)
@@ -346,11 +539,11 @@ def process_single_topic(topicId,unretrievableTopicIds,unretrievableMessageIds,r
     if gotTopic is False:
         try:
             logger.info("Fetching topic ID %d", topicId)
-            topic_json = yga.topics(topicId,maxResults=999999)
+            with yga.stream_json('%s.json.raw' % (topicId,), 'topics', topicId, maxResults=999999) as topic:
+                # Save it now.
+                save_record_items("%s.json" % (topicId,), topic.fields('messages'), 'messages', topic.items('messages'))
+            topic_json, messages = load_record_items('%s.json' % (topicId,), 'messages')
             gotTopic = True
-            # Save it now.
-            with open("%s.json" % (topicId,), 'wb') as f:
-                json.dump(topic_json, codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
         except:
             logger.exception("ERROR downloading topic ID %d", topicId)
     
@@ -366,72 +559,87 @@ def process_single_topic(topicId,unretrievableTopicIds,unretrievableMessageIds,r
     topicResults["prevTopicId"] = topic_json.get("prevTopicId")
 
     # Figure out what messages we got and download attachments.
-    messages = topic_json.get("messages")
+    topicMessageIds = []
     for message in messages:
         # Track what messages we've gotten.
         msgId = message.get("msgId")
+        topicMessageIds.append(msgId)
+        # Already retrieved if this topic was partly processed before resuming from a checkpoint.
+        known = msgId in retrievedMessageIds
         retrievedMessageIds.add(msgId)
         unretrievableMessageIds.discard(msgId) # probably not in there, but possible if we got an intermittent timeout
-        try:
-            potentialMessageIds.remove(msgId)
-        # Intermittent timeouts can cause this.
-        except:
-            logger.exception("ERROR: Tried to remove msgId %d from potentialMessageIds when it wasn't there.",msgId)
+        # Intermittent timeouts can cause this. A refreshed topic also holds messages archived by earlier runs.
+        if msgId not in potentialMessageIds and not refresh and not known:
+            logger.error("ERROR: msgId %d of topic ID %d wasn't in potentialMessageIds.",msgId,topicId)
                             
         # Download messsage attachments if there are any.
         if 'attachmentsInfo' in message and len(message['attachmentsInfo']) > 0:
-            with Mkchdir("%d_attachments" % msgId):
-                process_single_attachment(yga, message['attachmentsInfo'])
-        
+            attach_dir = make_folder("%d_attachments" % msgId)
+            process_single_attachment(yga, message['attachmentsInfo'], attach_dir)
+
+    # Only taken out of potentialMessageIds once the whole topic is done, so that if the crawl is interrupted part
+    # way through, a resumed crawl can still find the topic, and the topics beyond it, from its messages.
+    potentialMessageIds.difference_update(topicMessageIds)
     logger.info("Fetched topic ID %d with message count %d (topic %d of %d). %d total messages downloaded.",topicId,topic_json.get("totalMsgInTopic"),len(retrievedTopicIds),expectedTopics,len(retrievedMessageIds))   
+    if topic_checkpoint is not None:
+        topic_checkpoint.done(topicId, topicResults["prevTopicId"], topicResults["nextTopicId"])
     return topicResults
 
 
-def process_single_attachment(yga, attach):
+def process_single_attachment(yga, attach, path=''):
     logger = logging.getLogger(name="process_single_attachment")
     for frec in attach:
-        fname = sanitise_file_name("%s-%s" % (frec['fileId'], frec['filename']))
+        fname = os.path.join(path, sanitise_file_name("%s-%s" % (frec['fileId'], frec['filename'])))
 
         if file_keep(fname, "file: %s" % (fname,)) is False:
-            with open(fname, 'wb') as f:
-                logger.info("Fetching attachment '%s'", frec['filename'])
-                if 'link' in frec:
-                    # try and download the attachment
-                    # (sometimes yahoo doesn't keep them)
-                    try:
-                        yga.download_file(frec['link'], f=f)
-                    except requests.exceptions.HTTPError as err:
-                        logger.error("ERROR downloading attachment '%s': %s", frec['link'], err)
-                    continue
+            logger.info("Fetching attachment '%s'", frec['filename'])
+            if 'link' in frec:
+                # try and download the attachment
+                # (sometimes yahoo doesn't keep them)
+                try:
+                    fetch_file(yga, frec['link'], fname)
+                    file_done(fname)
+                except yahoogroupsapi.DOWNLOAD_ERRORS as err:
+                    logger.error("ERROR downloading attachment '%s': %s", frec['link'], err)
+                    # leave an empty file, so we don't try again on the next run
+                    write_empty_file(fname)
+                    file_done(fname, unavailable=True)
+                continue
 
-                elif 'photoInfo' in frec:
-                    process_single_photo(frec['photoInfo'],f)
+            if 'photoInfo' in frec:
+                process_single_photo(frec['photoInfo'],fname)
+            else:
+                write_empty_file(fname)
 
-            set_mtime(fname, frec['modificationDate'])
+            set_file_mtime(fname, frec['modificationDate'])
+            file_done(fname)
 
 
-def process_single_photo(photoinfo,f):
+def process_single_photo(photoinfo,fname):
     logger = logging.getLogger(name="process_single_photo")
     # keep retrying until we find the largest image size we can download
     # (sometimes yahoo doesn't keep the originals)
     exclude = []
     ok = False
     while not ok:
-        # find best photoinfo (largest size)
-        bestPhotoinfo = get_best_photoinfo(photoinfo, exclude)
+        # find best photoinfo (largest size, of those likely to be available)
+        bestPhotoinfo = best_photo_variant(photoinfo, exclude)
 
         if bestPhotoinfo is None:
             logger.error("Can't find a viable copy of this photo")
+            write_empty_file(fname)
             break
 
         # try and download it
         try:
-            yga.download_file(bestPhotoinfo['displayURL'], f=f)
+            fetch_file(yga, bestPhotoinfo['displayURL'], fname)
+            photo_variant_result(bestPhotoinfo['photoType'], True)
             ok = True
-        except requests.exceptions.HTTPError as err:
+        except yahoogroupsapi.DOWNLOAD_ERRORS as err:
             # yahoo says no. exclude this size and try for another.
             logger.error("ERROR downloading '%s' variant %s: %s", bestPhotoinfo['displayURL'],
                          bestPhotoinfo['photoType'], err)
+            photo_variant_result(bestPhotoinfo['photoType'], False)
             exclude.append(bestPhotoinfo['photoType'])
 
 def archive_files(yga, subdir=None):
@@ -442,7 +650,10 @@ def archive_files(yga, subdir=None):
         else:
             file_json = yga.files()
     except Exception:
-        logger.error("Couldn't access Files functionality for this group")
+        if not subdir:
+            raise SectionFailed("Couldn't access Files functionality for this group")
+        # The rest of the files can still be archived
+        logger.exception("Couldn't access files folder %s", subdir)
         return
 
     with open('fileinfo.json', 'wb') as f:
@@ -458,9 +669,9 @@ def archive_files(yga, subdir=None):
             new_name = sanitise_file_name("%d_%s" % (n, name))
             if file_keep(new_name, ": %s" % (new_name,)) is False:
                 logger.info("Fetching file '%s' as '%s' (%d/%d)", name, new_name, n, sz)
-                with open(new_name, 'wb') as f:
-                    yga.download_file(path['downloadURL'], f)
-                set_mtime(new_name, path['createdTime'])
+                fetch_file(yga, path['downloadURL'], new_name)
+                set_file_mtime(new_name, path['createdTime'])
+                file_done(new_name)
 
         elif path['type'] == 1:
             # Directory
@@ -476,71 +687,98 @@ def archive_files(yga, subdir=None):
 def archive_attachments(yga):
     logger = logging.getLogger(name="archive_attachments")
     try:
-        attachments_json = yga.attachments(count=999999)
+        # The index of every attachment can be too large to parse in memory, so read it one attachment at a time
+        attachments_json = yga.stream_json('allattachmentinfo.json.raw', 'attachments', count=999999)
     except Exception:
-        logger.error("Couldn't access Attachments functionality for this group")
-        return
-
-    with open('allattachmentinfo.json', 'wb') as f:
-        json.dump(attachments_json['attachments'], codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
-
-    n = 0
-    for a in attachments_json['attachments']:
-        n += 1
-        with Mkchdir(a['attachmentId']):
-            try:
-                a_json = yga.attachments(a['attachmentId'])
-            except Exception:
-                logger.error("Attachment id %d inaccessible.", a['attachmentId'])
-                continue
-            with open('attachmentinfo.json', 'wb') as f:
-                json.dump(a_json, codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
-                process_single_attachment(yga, a_json['files'])
-        set_mtime(sanitise_folder_name(a['attachmentId']), a['modificationDate'])
+        raise SectionFailed("Couldn't access Attachments functionality for this group")
+
+    with attachments_json:
+        with open('allattachmentinfo.json', 'wb') as f:
+            dump_list(codecs.getwriter('utf-8')(f), attachments_json.items('attachments'))
+        for a in attachments_json.items('attachments'):
+            with Mkchdir(a['attachmentId']):
+                try:
+                    a_json = yga.attachments(a['attachmentId'])
+                except Exception:
+                    logger.error("Attachment id %d inaccessible.", a['attachmentId'])
+                    continue
+                with open('attachmentinfo.json', 'wb') as f:
+                    json.dump(a_json, codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
+                    process_single_attachment(yga, a_json['files'])
+            set_mtime(sanitise_folder_name(a['attachmentId']), a['modificationDate'])
 
 
-def archive_photos(yga):
+def archive_photos(yga, workers=1):
+    """
+    Archive every album. With workers > 1, albums and their photos are fetched concurrently by that many workers,
+    each page's photos being queued as soon as the page arrives, while up to as many album pages are fetched ahead.
+    """
     logger = logging.getLogger(name="archive_photos")
     try:
-        nb_albums = yga.albums(count=5)['total'] + 1
+        albums = yga.albums(count=100)
     except Exception:
-        logger.error("Couldn't access Photos functionality for this group")
-        return
-    albums = yga.albums(count=nb_albums)
-    n = 0
+        raise SectionFailed("Couldn't access Photos functionality for this group")
+    if len(albums['albums']) >= 100:
+        # Yahoo sometimes has an off-by-one error in the album count...
+        albums = yga.albums(count=albums['total'] + 1)
 
     with open('albums.json', 'wb') as f:
         json.dump(albums['albums'], codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
 
-    for a in albums['albums']:
-        n += 1
-        name = html_unescape(a['albumName'])
-        # Yahoo sometimes has an off-by-one error in the album count...
-        logger.info("Fetching album '%s' (%d/%d)", name, n, albums['total'])
-
-        folder = "%d-%s" % (a['albumId'], name)
-
-        with Mkchdir(folder):
-            photos = yga.albums(a['albumId'])
-            pages = int(photos['total'] / 100 + 1)
-            p = 0
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
 
-            for page in range(pages):
-                photos = yga.albums(a['albumId'], start=page*100, count=100)
-                with open('photos-%d.json' % page, 'wb') as f:
-                    json.dump(photos['photos'], codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
+    def fetch_photo(folder, photo, status):
+        try:
+            pname = html_unescape(photo['photoName'])
+            fname = os.path.join(folder, sanitise_file_name("%d-%s.jpg" % (photo['photoId'], pname)))
+            if file_keep(fname, "photo: %s" % (fname,)) is False:
+                logger.info("Fetching photo '%s' %s", pname, status)
+                process_single_photo(photo['photoInfo'], fname)
+                set_file_mtime(fname, photo['creationDate'])
+                file_done(fname)
+        except Exception:
+            logger.exception("Failed to archive photos")
+
+    def fetch_album(folder, album):
+        # The first page gives the album's total, so the rest can be requested straight away
+        paginator = Paginator(lambda start, count: yga.albums(album['albumId'], start=start, count=count), 'photos',
+                              workers=workers)
+        for page, (start, photos, page_photos) in enumerate(paginator.pages()):
+            with open(os.path.join(folder, 'photos-%d.json' % page), 'wb') as f:
+                json.dump(photos['photos'], codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
+
+            for p, photo in enumerate(page_photos, start + 1):
+                status = "(%d/%d) from album '%s'" % (p, photos['total'], html_unescape(album['albumName']))
+                if executor is None:
+                    fetch_photo(folder, photo, status)
+                else:
+                    executor.submit(fetch_photo, folder, photo, status)
+
+    def archive_album(n, folder, album):
+        logger.info("Fetching album '%s' (%d/%d)", html_unescape(album['albumName']), n, len(albums['albums']))
+        try:
+            fetch_album(folder, album)
+        except Exception:
+            logger.exception("Failed to archive photos")
+
+    folders = []
+    album_futures = []
+    for n, a in enumerate(albums['albums'], 1):
+        folder = make_folder("%d-%s" % (a['albumId'], html_unescape(a['albumName'])))
+        folders.append((folder, a))
+        if executor is None:
+            archive_album(n, folder, a)
+        else:
+            album_futures.append(executor.submit(archive_album, n, folder, a))
 
-                for photo in photos['photos']:
-                    p += 1
-                    pname = html_unescape(photo['photoName'])
-                    fname = sanitise_file_name("%d-%s.jpg" % (photo['photoId'], pname))
-                    if file_keep(fname, "photo: %s" % (fname,)) is False:
-                        logger.info("Fetching photo '%s' (%d/%d)", pname, p, photos['total'])
-                        with open(fname, 'wb') as f:
-                            process_single_photo(photo['photoInfo'],f)
-                        set_mtime(fname, photo['creationDate'])
+    if executor is not None:
+        # Every album must have queued its photos before the executor stops taking more
+        for future in album_futures:
+            future.result()
+        executor.shutdown()
 
-        set_mtime(sanitise_folder_name(folder), a['modificationDate'])
+    for folder, a in folders:
+        set_mtime(folder, a['modificationDate'])
 
 
 def archive_db(yga):
@@ -548,10 +786,8 @@ def archive_db(yga):
     try:
         db_json = yga.database()
     except yahoogroupsapi.AuthenticationError:
-        db_json = None
         # 401 or 403 error means Permission Denied; 307 means redirect to login. Retrying won't help.
-        logger.error("Couldn't access Database functionality for this group")
-        return
+        raise SectionFailed("Couldn't access Database functionality for this group")
 
     with open('databases.json', 'wb') as f:
         json.dump(db_json, codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
@@ -567,15 +803,16 @@ def archive_db(yga):
             uri = "https://groups.yahoo.com/neo/groups/%s/database/%s/records/export?format=csv" % (yga.group, table['tableId'])
 
             if file_keep(sanitise_file_name(name), "database: %s" % (sanitise_file_name(name),)) is False:
-                with open(sanitise_file_name(name), 'wb') as f:
-                    yga.download_file(uri, f)
+                yga.download_file(uri, fname=sanitise_file_name(name))
                 set_mtime(sanitise_file_name(name), table['dateLastModified'])
+                file_done(sanitise_file_name(name))
 
             records_json = yga.database(table['tableId'], 'records')
             if file_keep('%s_records.json' % table['tableId'], "database records: %s_records.json" % (table['tableId'],)) is False:
                 with open('%s_records.json' % table['tableId'], 'wb') as f:
                     json.dump(records_json, codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
                 set_mtime('%s_records.json' % table['tableId'], table['dateLastModified'])
+                file_done('%s_records.json' % table['tableId'])
         except Exception:
             logger.exception("Failed to get table '%s' (%d/%d)", table['name'], n, nts)
             continue
@@ -587,7 +824,9 @@ def archive_links(yga, subdir=''):
     try:
         links = yga.links(linkdir=subdir)
     except yahoogroupsapi.AuthenticationError:
-        logger.error("Couldn't access Links functionality for this group")
+        if not subdir:
+            raise SectionFailed("Couldn't access Links functionality for this group")
+        logger.error("Couldn't access links folder %s", subdir)
         return
 
     with open('links.json', 'wb') as f:
@@ -608,8 +847,7 @@ def archive_calendar(yga):
     groupinfo = yga.HackGroupInfo()
 
     if 'entityId' not in groupinfo:
-        logger.error("Couldn't download calendar/events: missing entityId")
-        return
+        raise SectionFailed("Couldn't download calendar/events: missing entityId")
 
     entityId = groupinfo['entityId']
 
@@ -620,22 +858,19 @@ def archive_calendar(yga):
     logger.info("Getting wssid. Expecting 401 or 403 response.")
     try:
         yga.download_file(tmpUri)  # We expect a 403 or 401  here
-        logger.error("Attempt to get wssid returned HTTP 200, which is unexpected!")  # we should never hit this
-        return
+        raise SectionFailed("Attempt to get wssid returned HTTP 200, which is unexpected!")  # we should never hit this
     except requests.exceptions.HTTPError as e:
         if e.response.status_code == 403 or e.response.status_code == 401:
             try:
                 tmpJson = json.loads(e.response.text)['calendarError']
             except:
                 logger.exception("ERROR: Couldn't load wssid exception to get calendarError.")
-                return
+                raise SectionFailed("Couldn't load wssid exception to get calendarError")
         else:
-            logger.error("Attempt to get wssid returned an unexpected response status %d" % e.response.status_code)
-            return
+            raise SectionFailed("Attempt to get wssid returned an unexpected response status %d" % e.response.status_code)
 
     if 'wssid' not in tmpJson:
-        logger.error("Couldn't download calendar/events: missing wssid")
-        return
+        raise SectionFailed("Couldn't download calendar/events: missing wssid")
     wssid = tmpJson['wssid']
     
     # Getting everything since the launch of Yahoo! Groups (January 30, 2001)
@@ -650,9 +885,9 @@ def archive_calendar(yga):
         try:
             logger.info("Trying to get events between %s and %s", jsonStart, jsonEnd)
             calContentRaw = yga.download_file(calURL)
-        except requests.exception.HTTPError:
-            logger.error("Unrecoverable error getting events between %s and %s: URL %s", jsonStart, jsonEnd, calURL)
-            return
+        except requests.exceptions.HTTPError:
+            raise SectionFailed("Unrecoverable error getting events between %s and %s: URL %s" %
+                                (jsonStart, jsonEnd, calURL))
 
         calContent = json.loads(calContentRaw)
         if calContent['events']['count'] > 0:
@@ -685,51 +920,26 @@ def archive_about(yga):
         bestphotoinfo = get_best_photoinfo(statistics['groupHomePage']['photoInfo'], exclude)
         fname = 'GroupPhoto-%s' % basename(bestphotoinfo['displayURL']).split('?')[0]
         logger.info("Downloading the photo in group description as %s", fname)
-        with open(sanitise_file_name(fname), 'wb') as f:
-            process_single_photo(statistics['groupHomePage']['photoInfo'],f)
+        process_single_photo(statistics['groupHomePage']['photoInfo'],sanitise_file_name(fname))
 
     if statistics['groupCoverPhoto']['hasCoverImage']:
         # Base filename on largest photo size.
         bestphotoinfo = get_best_photoinfo(statistics['groupCoverPhoto']['photoInfo'], exclude)
         fname = 'GroupCover-%s' % basename(bestphotoinfo['displayURL']).split('?')[0]
         logger.info("Downloading the group cover as %s", fname)
-        with open(sanitise_file_name(fname), 'wb') as f:
-            process_single_photo(statistics['groupCoverPhoto']['photoInfo'],f)
+        process_single_photo(statistics['groupCoverPhoto']['photoInfo'],sanitise_file_name(fname))
 
 
 def archive_polls(yga):
     logger = logging.getLogger(name="archive_polls")
+    # The poll list gives no total, so is paged until a short page. Polls added while paging can shift a poll onto
+    # the next page too, so duplicates are dropped.
+    paginator = Paginator(lambda start, count: yga.polls(count=count, sort='DESC', start=start),
+                          key=lambda p: p['surveyId'])
     try:
-        pollsList = yga.polls(count=100, sort='DESC')
+        pollsList = list(paginator.items())
     except yahoogroupsapi.AuthenticationError:
-        logger.error("Couldn't access Polls functionality for this group")
-        return
-
-    if len(pollsList) == 100:
-        logger.info("Got 100 polls, checking if there are more ...")
-        endoflist = False
-        offset = 99
-
-        while not endoflist:
-            tmpList = yga.polls(count=100, sort='DESC', start=offset)
-            tmpCount = len(tmpList)
-            logger.info("Got %d more polls", tmpCount)
-
-            # Trivial case first
-            if tmpCount < 100:
-                endoflist = True
-
-            # Again we got 100 polls, increase the offset
-            if tmpCount == 100:
-                offset += 99
-
-            # Last survey
-            if pollsList[len(pollsList)-1]['surveyId'] == tmpList[len(tmpList)-1]['surveyId']:
-                logger.info("No new polls found with offset %d", offset)
-                endoflist = True
-                break
-
-            pollsList += tmpList
+        raise SectionFailed("Couldn't access Polls functionality for this group")
 
     totalPolls = len(pollsList)
     logger.info("Found %d polls to grab", totalPolls)
@@ -751,87 +961,172 @@ def archive_polls(yga):
 
 
 
-def archive_members(yga):
+def archive_members(yga, workers=1):
+    """
+    Archive the member list, 100 records to a page. The first page gives the total, and with workers > 1 that many of
+    the rest are fetched concurrently. Members are written to allmemberinfo.json as each page arrives.
+    """
     logger = logging.getLogger(name="archive_members")
+    # we can dump 100 member records at a time
+    paginator = Paginator(lambda start, count: yga.members('confirmed', start=start, count=count), 'members',
+                          workers=workers)
+    pages = paginator.pages()
     try:
-        confirmed_json = yga.members('confirmed')
+        first = next(pages)
     except yahoogroupsapi.AuthenticationError:
-        logger.error("Couldn't access Members list functionality for this group")
-        return
-    n_members = confirmed_json['total']
-    # we can dump 100 member records at a time
-    all_members = []
-    for i in range(int(math.ceil(n_members)/100 + 1)):
-        confirmed_json = yga.members('confirmed', start=100*i, count=100)
-        all_members = all_members + confirmed_json['members']
-        with open('memberinfo_%d.json' % i, 'wb') as f:
-            json.dump(confirmed_json, codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
-    all_json_data = {"total": n_members, "members": all_members}
+        raise SectionFailed("Couldn't access Members list functionality for this group")
+
+    def members():
+        for i, (_, confirmed_json, page) in enumerate(itertools.chain([first], pages)):
+            with open('memberinfo_%d.json' % i, 'wb') as f:
+                json.dump(confirmed_json, codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
+            for member in page:
+                yield member
+
     with open('allmemberinfo.json', 'wb') as f:
-        json.dump(all_json_data, codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
-    logger.info("Saved members: Expected: %d, Actual: %d", n_members, len(all_members))
+        dump_object(codecs.getwriter('utf-8')(f), {"total": paginator.total}, 'members', members())
+    logger.info("Saved members: Expected: %d, Actual: %d", paginator.total, paginator.count)
 
 
 ####
 # Utility Functions
 ####
 
-def set_mtime(path, mtime):
+class Section(Mkchdir):
     """
-    Sets the last-modified date of a file or directory
+    Mkchdir for one section of the archive. Records the section's outcome and duration in the global section_status,
+    and saves it to SECTION_STATUS_FILE in the parent folder. An error is logged rather than stopping the run, including
+    the SectionFailed an archiver raises when it can't archive its section.
     """
-    atime = time.time()
-    os.utime(path, (atime, mtime))
+    def __init__(self, name, d, save_status=True):
+        Mkchdir.__init__(self, d)
+        self.name = name
+        self.save_status = save_status
 
+    def __enter__(self):
+        self.start = time.time()
+        Mkchdir.__enter__(self)
 
-def sanitise_file_name(value):
-    """
-    Convert spaces to hyphens.  Remove characters that aren't alphanumerics, underscores, periods or hyphens.
-    Also strip leading and trailing whitespace and periods.
-    """
-    value = text(value)
-    value = unicodedata.normalize('NFKD', value).encode('ascii', 'ignore').decode('ascii')
-    value = re.sub(r'[^\w\s.-]', '', value).strip().strip('.')
-    return re.sub(r'[-\s]+', '-', value)
+    def __exit__(self, exc_type, exc_value, traceback):
+        Mkchdir.__exit__(self, exc_type, exc_value, traceback)
+
+        status = OrderedDict([('status', 'ok'), ('seconds', round(time.time() - self.start, 3))])
+        handled = exc_type is not None and issubclass(exc_type, Exception)
+        if handled:
+            if issubclass(exc_type, SectionFailed):
+                # The archiver gave up of its own accord, so the reason is enough
+                logging.getLogger('Section').error("Archiving %s failed: %s", self.name, exc_value)
+            else:
+                logging.getLogger('Section').error("Archiving %s failed", self.name,
+                                                   exc_info=(exc_type, exc_value, traceback))
+            status.update([('status', 'failed'), ('error', text(exc_value) or exc_type.__name__)])
+        elif exc_type is not None:
+            status['status'] = 'interrupted'
+        section_status[self.name] = status
+        if self.save_status:
+            save_section_status()
+        return handled
 
 
-def sanitise_folder_name(name):
-    return sanitise_file_name(name).replace('.', '_')
+def save_section_status():
+    with open(SECTION_STATUS_FILE, 'wb') as f:
+        json.dump(section_status, codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
 
 
-def file_keep(fname, type = ""):
+def run_section_process(queue, name, folder, func, clients):
     """
-    Test existance of given file name and global overwrite flag.
-    If not overwriting and present then log the fact and the data type (type).
-    Returns True if file present otherwise False
+    Body of the process archiving one section for run_sections. Reports the outcome and the metrics for the
+    section's requests back to the parent process through queue.
     """
-    logger = logging.getLogger('file_keep')
+    metrics = Metrics()
+    warc_writers = []
+    inherited = storage.manifest
+    if inherited is not None:
+        # An SQLite connection must not be used from both sides of a fork
+        storage.manifest = Manifest(inherited.path, inherited.root)
+    for client in clients:
+        client.metrics = metrics
+        if client.ww is not None:
+            # The parent's writer thread does not exist in this process, so each section writes its own WARC files
+            from warcfiles import BackgroundWARCWriter
+            ww = BackgroundWARCWriter('%s-%s' % (client.ww.prefix, name), client.ww.info, client.ww.max_size)
+            client.set_warc_writer(ww)
+            warc_writers.append(ww)
 
-    if args.overwrite:
-        return False
-    
-    if os.path.exists(fname) is False:
-        return False
-    
-    logger.debug("File already present %s", type)
-    return True
+    try:
+        with Section(name, folder, save_status=False):
+            func()
+        for ww in warc_writers:
+            ww.close()
+        if storage.manifest is not inherited:
+            storage.manifest.close()
+    finally:
+        queue.put((name, section_status.get(name), metrics.snapshot()))
 
 
-class Mkchdir:
-    d = ""
+def run_sections(sections, processes=1, clients=(), metrics=None):
+    """
+    Archive each of sections, a list of (name, folder, function) tuples, as a Section.
 
-    def __init__(self, d, sanitize=True):
-        self.d = sanitise_folder_name(d) if sanitize else d
+    With processes > 1, up to that many sections are archived at once, each in a process of its own, since the
+    archivers work relative to the current directory. The processes share the budget of any rate limiter with a
+    state file. Sections in QUICK_SECTIONS are started first, so that they are not held up behind the long ones.
+    The status of each section, including those still running, is kept in SECTION_STATUS_FILE. clients are the API
+    clients the functions use; the metrics of their requests in each process are added to metrics.
+    """
+    logger = logging.getLogger(name="run_sections")
+    context = None
+    if processes > 1 and hasattr(os, 'fork'):
+        context = multiprocessing.get_context('fork') if hasattr(multiprocessing, 'get_context') else multiprocessing
+    elif processes > 1:
+        logger.warning("Sections can only be archived concurrently where processes can be forked, archiving them "
+                       "one at a time")
+
+    if context is None:
+        for name, folder, func in sections:
+            with Section(name, folder):
+                func()
+        return
 
-    def __enter__(self):
-        try:
-            os.mkdir(self.d)
-        except OSError:
-            pass
-        os.chdir(self.d)
+    queue = context.Queue()
+    waiting = sorted(sections, key=lambda section: section[0] not in QUICK_SECTIONS)
+    running = OrderedDict()
+    try:
+        while waiting or running:
+            while waiting and len(running) < processes:
+                name, folder, func = waiting.pop(0)
+                process = context.Process(target=run_section_process, args=(queue, name, folder, func, clients),
+                                          name=name)
+                process.start()
+                running[name] = process
+                section_status[name] = OrderedDict([('status', 'running'), ('started', time.time())])
+                save_section_status()
+                logger.info("Started section %s (%d running, %d waiting)", name, len(running), len(waiting))
 
-    def __exit__(self, exc_type, exc_value, traceback):
-        os.chdir('..')
+            try:
+                name, status, snapshot = queue.get(timeout=1)
+            except Empty:
+                for name, process in list(running.items()):
+                    # A process which has reported its outcome exits cleanly, and its report will be read next time
+                    if not process.is_alive() and process.exitcode != 0:
+                        del running[name]
+                        logger.error("Section %s exited with code %d", name, process.exitcode)
+                        section_status[name] = OrderedDict([('status', 'failed'),
+                                                            ('error', 'exited with code %d' % process.exitcode)])
+                        save_section_status()
+                continue
+
+            running.pop(name).join()
+            section_status[name] = status or OrderedDict([('status', 'failed')])
+            save_section_status()
+            if metrics is not None:
+                metrics.merge(snapshot)
+            logger.info("Section %s %s after %.0f seconds (%d running, %d waiting)", name,
+                        section_status[name]['status'], section_status[name].get('seconds', 0), len(running),
+                        len(waiting))
+    finally:
+        for process in running.values():
+            process.terminate()
 
 
 class CustomFormatter(logging.Formatter):
@@ -919,15 +1214,89 @@ if __name__ == "__main__":
                     'option provided.')
     pc.add_argument('--ids', nargs='+', type=int,
                     help='Get email message by ID(s). Space separated, terminated by another flag or --')
+    pc.add_argument('--incremental', action='store_true',
+                    help='Only page through the message index from where the last run stopped, and only fetch '
+                    'messages and topics which are new since then')
 
     pf = p.add_argument_group(title='Output Options')
     pf.add_argument('-w', '--warc', action='store_true',
                     help='Output WARC file of raw network requests. [Requires warcio package installed]')
+    pf.add_argument('--warc-size', type=int, default=1024,
+                    help='Start a new WARC file once the current one reaches this many megabytes (default 1024, '
+                    '0 for no limit)')
+    pf.add_argument('--packed', action='store_true',
+                    help='Store messages and topics as records in compressed, sharded JSON Lines files under packed/, '
+                    'instead of one file each')
+    pf.add_argument('--manifest', action='store_true',
+                    help='Keep a record of archived files in manifest.sqlite, which is checked instead of looking for '
+                    'each file on disk when resuming')
+    pf.add_argument('--dedup', action='store_true',
+                    help='Store each distinct attachment, photo and file once under blobs/, named by its checksum, '
+                    'and hard link to it from the archive. URLs already downloaded are not fetched again')
+    pf.add_argument('--metrics', action='store_true',
+                    help='Save request counts, latencies, retries and bytes per API endpoint to metrics.json and, '
+                    'in Prometheus text format, metrics.prom')
+    pf.add_argument('--metrics-interval', type=float, default=60,
+                    help='Seconds between updates of the --metrics files (default 60)')
 
     p.add_argument('-v', '--verbose', action='store_true')
     p.add_argument('--colour', '--color', action='store_true',
                    help='Colour log output to terminal [Requires coloredlogs package installed]')
     p.add_argument('--delay', type=float, default=0.2, help='Minimum delay between requests (default 0.2s)')
+    p.add_argument('--burst', type=int, default=1,
+                   help='Number of requests that may be made back to back before --delay applies (default 1)')
+    p.add_argument('--rate-limit-file', type=str,
+                   help='File used to share the --delay and --burst request budget with other archiver processes '
+                   'on this host')
+    p.add_argument('--global-delay', type=float,
+                   help='Minimum delay between requests across all processes sharing --rate-limit-file, with '
+                   '--delay then applying to this process alone')
+    p.add_argument('--auto-delay', action='store_true',
+                   help='Tune the delay between requests while archiving, starting from --delay: speeding up while '
+                   'requests succeed, and slowing down when the server starts to fail them')
+    p.add_argument('--min-delay', type=float, default=0.05,
+                   help='Shortest delay between requests with --auto-delay (default 0.05s)')
+    p.add_argument('--max-delay', type=float, default=5,
+                   help='Longest delay between requests with --auto-delay (default 5s)')
+    p.add_argument('--retries', type=int, default=15,
+                   help='Maximum attempts at a request failing with a 5xx error, 60-68 byte body or connection error '
+                   '(default 15). Other failures are retried fewer times, or not at all')
+    p.add_argument('--max-backoff', type=float, default=60,
+                   help='Maximum delay before retrying a failed request, unless the server asks for longer '
+                   '(default 60s)')
+    p.add_argument('--retry-budget', type=int,
+                   help='Maximum number of retries across the whole run (default no limit)')
+    p.add_argument('--breaker-threshold', type=int, default=20,
+                   help='Pause all requests after this many consecutive failures (default 20, 0 to disable)')
+    p.add_argument('--breaker-pause', type=float, default=60,
+                   help='Seconds to pause for after --breaker-threshold failures, doubling while they persist '
+                   '(default 60s)')
+    p.add_argument('--connect-timeout', type=float, default=15,
+                   help='Seconds to wait for a file or photo download to connect before retrying it (default 15s)')
+    p.add_argument('--read-timeout', type=float, default=60,
+                   help='Seconds to wait for more of a download to arrive before retrying it (default 60s)')
+    p.add_argument('--min-download-rate', type=float, default=1024,
+                   help='Bytes per second below which a download counts as stalled and is retried, resuming where '
+                   'it got to (default 1024, 0 to disable)')
+    p.add_argument('--stall-time', type=float, default=60,
+                   help='Seconds over which --min-download-rate is measured (default 60s)')
+    p.add_argument('--workers', type=int, default=1,
+                   help='Number of messages, topics, photos or pages of members and albums to fetch concurrently, '
+                   'sharing the --delay budget (default 1)')
+    p.add_argument('--parallel-sections', type=int, default=1,
+                   help='Number of sections to archive at once, each in its own process, sharing the --delay budget. '
+                   'Quick sections such as about, links and polls are started first (default 1)')
+    p.add_argument('--cache-size', type=int, default=0,
+                   help='Number of API responses to keep in memory, so that sections needing the same data do not '
+                   'request it again (default 0, disabled)')
+    p.add_argument('--cache-dir', type=str,
+                   help='Keep API responses in this directory, for reuse by later runs. Lists of the group\'s '
+                   'content, such as the message index, are always requested afresh')
+    p.add_argument('--cache-ttl', type=float,
+                   help='Maximum age in seconds of responses reused from --cache-dir (default no limit)')
+    p.add_argument('--async', dest='use_async', action='store_true',
+                   help='Archive email, topics and attachments with the asyncio client, keeping many requests in '
+                   'flight at once. [Requires Python 3.6+ and the aiohttp package installed]')
 
     p.add_argument('group', type=str)
 
@@ -959,7 +1328,36 @@ if __name__ == "__main__":
     if args.user_agent:
         headers['User-Agent'] = args.user_agent
 
-    yga = YahooGroupsAPI(args.group, cookie_jar, headers, min_delay=args.delay)
+    section_limit_file = None
+    if args.parallel_sections > 1:
+        if args.packed:
+            sys.exit("Error: --packed can not be combined with --parallel-sections.")
+        # Every section's process shares this one's --delay budget
+        section_limit_file = os.path.abspath(os.path.join(args.group, SECTION_RATE_LIMIT_FILE))
+
+    if args.global_delay is not None and args.rate_limit_file:
+        global_limiter = yahoogroupsapi.RateLimiter(1.0 / args.global_delay if args.global_delay else 0, args.burst,
+                                                    args.rate_limit_file)
+        rate_limiter = yahoogroupsapi.RateLimiter(1.0 / args.delay if args.delay else 0, args.burst,
+                                                  section_limit_file, parent=global_limiter)
+    else:
+        rate_limiter = yahoogroupsapi.RateLimiter(1.0 / args.delay if args.delay else 0, args.burst,
+                                                  args.rate_limit_file or section_limit_file)
+    cache = None
+    if args.cache_size or args.cache_dir:
+        cache = yahoogroupsapi.ResponseCache(args.cache_size, args.cache_dir and os.path.abspath(args.cache_dir),
+                                             args.cache_ttl)
+    adaptive_delay = None
+    if args.auto_delay:
+        adaptive_delay = yahoogroupsapi.AdaptiveDelay(rate_limiter, args.min_delay, args.max_delay)
+    retry_policy = yahoogroupsapi.RetryPolicy(args.retries, args.delay, args.max_backoff, args.retry_budget,
+                                              args.breaker_threshold or None, args.breaker_pause,
+                                              adaptive_delay=adaptive_delay)
+    metrics = Metrics()
+    yga = YahooGroupsAPI(args.group, cookie_jar, headers, min_delay=args.delay, rate_limiter=rate_limiter,
+                         cache=cache, metrics=metrics, retry_policy=retry_policy,
+                         download_timeout=(args.connect_timeout, args.read_timeout),
+                         min_download_rate=args.min_download_rate, stall_time=args.stall_time)
 
     # Default to all unique content. This includes topics and raw email, 
     # but not the full email download since that would duplicate html emails we get through topics.
@@ -968,59 +1366,104 @@ if __name__ == "__main__":
         args.files = args.photos = args.database = args.links = args.calendar = args.about = \
             args.polls = args.attachments = args.members = args.topics = args.raw = True
 
+    if args.use_async:
+        try:
+            import yahoo_async
+            from yahoogroupsapi_async import AsyncYahooGroupsAPI
+            ayga = AsyncYahooGroupsAPI(args.group, cookie_jar, headers, min_delay=args.delay, rate_limiter=rate_limiter,
+                                       cache=cache, metrics=metrics, retry_policy=retry_policy,
+                                       download_timeout=(args.connect_timeout, args.read_timeout),
+                                       min_download_rate=args.min_download_rate, stall_time=args.stall_time)
+        except (ImportError, SyntaxError):
+            sys.exit("Error: The asyncio client requires Python 3.6+ and the 'aiohttp' package to be installed.")
+        if args.warc:
+            sys.exit("Error: WARC output is not supported with --async.")
+
     with Mkchdir(args.group, sanitize=False):
         log_file_handler = logging.FileHandler('archive.log', 'a', 'utf-8')
         log_file_handler.setFormatter(log_formatter)
         root_logger.addHandler(log_file_handler)
 
+        storage.overwrite = args.overwrite
+        if args.manifest:
+            storage.manifest = Manifest('manifest.sqlite')
+        if args.packed:
+            storage.packed_store = PackedStore('packed')
+        if args.dedup:
+            storage.blob_store = BlobStore('blobs')
+        if args.photos or args.attachments:
+            storage.photo_variants = PhotoVariants(PHOTO_VARIANTS_FILE)
+        if args.metrics:
+            metrics.export('metrics.json', 'metrics.prom', args.metrics_interval)
+
         if args.warc:
             try:
-                from warcio import WARCWriter
+                from warcfiles import BackgroundWARCWriter
             except ImportError:
                 logging.error('WARC output requires the warcio package to be installed.')
                 exit(1)
-            fhwarc = open('data.warc.gz', 'ab')
-            warc_writer = WARCWriter(fhwarc)
-            warcmeta = warc_writer.create_warcinfo_record(fhwarc.name, WARC_META_PARAMS)
-            warc_writer.write_record(warcmeta)
+            warc_writer = BackgroundWARCWriter('data', WARC_META_PARAMS,
+                                               max_size=args.warc_size * 1024 * 1024 if args.warc_size else None)
             yga.set_warc_writer(warc_writer)
 
+        sections = []
         if args.email:
-            with Mkchdir('email'):
-                archive_email(yga, message_subset=args.ids, start=args.start, stop=args.stop)
+            if args.use_async:
+                sections.append(('email', 'email', lambda: yahoo_async.run(ayga, yahoo_async.archive_email(
+                    ayga, message_subset=args.ids, start=args.start, stop=args.stop, incremental=args.incremental))))
+            else:
+                sections.append(('email', 'email', lambda: archive_email(
+                    yga, message_subset=args.ids, start=args.start, stop=args.stop, workers=args.workers,
+                    incremental=args.incremental)))
         if args.files:
-            with Mkchdir('files'):
-                archive_files(yga)
+            sections.append(('files', 'files', lambda: archive_files(yga)))
         if args.photos:
-            with Mkchdir('photos'):
-                archive_photos(yga)
+            sections.append(('photos', 'photos', lambda: archive_photos(yga, workers=args.workers)))
         if args.topics:
-            with Mkchdir('topics'):
-                archive_topics(yga)
-        if args.raw:
-            with Mkchdir('email'):
-                archive_email(yga, message_subset=args.ids, start=args.start, stop=args.stop,skipHTML=True)
+            if args.use_async:
+                sections.append(('topics', 'topics', lambda: yahoo_async.run(ayga, yahoo_async.archive_topics(
+                    ayga, incremental=args.incremental))))
+            else:
+                sections.append(('topics', 'topics', lambda: archive_topics(
+                    yga, incremental=args.incremental, workers=args.workers)))
+        # The email section archives raw email too, into the same folder from the same message metadata
+        if args.raw and not args.email:
+            if args.use_async:
+                sections.append(('raw', 'email', lambda: yahoo_async.run(ayga, yahoo_async.archive_email(
+                    ayga, message_subset=args.ids, start=args.start, stop=args.stop, skipHTML=True,
+                    incremental=args.incremental))))
+            else:
+                sections.append(('raw', 'email', lambda: archive_email(
+                    yga, message_subset=args.ids, start=args.start, stop=args.stop, skipHTML=True,
+                    workers=args.workers, incremental=args.incremental)))
         if args.database:
-            with Mkchdir('databases'):
-                archive_db(yga)
+            sections.append(('database', 'databases', lambda: archive_db(yga)))
         if args.links:
-            with Mkchdir('links'):
-                archive_links(yga)
+            sections.append(('links', 'links', lambda: archive_links(yga)))
         if args.about:
-            with Mkchdir('about'):
-                archive_about(yga)
+            sections.append(('about', 'about', lambda: archive_about(yga)))
         if args.polls:
-            with Mkchdir('polls'):
-                archive_polls(yga)
+            sections.append(('polls', 'polls', lambda: archive_polls(yga)))
         if args.attachments:
-            with Mkchdir('attachments'):
-                archive_attachments(yga)
+            if args.use_async:
+                sections.append(('attachments', 'attachments', lambda: yahoo_async.run(
+                    ayga, yahoo_async.archive_attachments(ayga))))
+            else:
+                sections.append(('attachments', 'attachments', lambda: archive_attachments(yga)))
         if args.members:
-            with Mkchdir('members'):
-                archive_members(yga)
+            sections.append(('members', 'members', lambda: archive_members(yga, workers=args.workers)))
         if args.calendar:
-            with Mkchdir('calendar'):
-                archive_calendar(yga)
+            sections.append(('calendar', 'calendar', lambda: archive_calendar(yga)))
+
+        clients = (yga, ayga) if args.use_async else (yga,)
+        run_sections(sections, args.parallel_sections, clients, metrics)
 
         if args.warc:
-            fhwarc.close()
+            warc_writer.close()
+        for store in (storage.manifest, storage.packed_store, storage.blob_store, storage.photo_variants):
+            if store is not None:
+                store.close()
+        metrics.close()
+
+    if any(status['status'] != 'ok' for status in section_status.values()):
+        sys.exit(1)
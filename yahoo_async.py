@@ -0,0 +1,481 @@
+# asyncio versions of the message, topic and attachment archivers in yahoo.py, for use with AsyncYahooGroupsAPI.
+# Requires Python 3.6+ and the aiohttp package.
+
+import asyncio
+import codecs
+import json
+import logging
+import os
+
+import yahoogroupsapi
+from yahoogroupsapi_async import DOWNLOAD_ERRORS
+from checkpoint import TopicCheckpoint
+from jsonstream import dump_list
+from storage import (TOPICS_CHECKPOINT_FILE, SectionFailed, best_photo_variant, file_done, file_keep,
+                     link_known_url, load_metadata_state, load_record_items, make_folder, metadata_state,
+                     photo_variant_result, record_exists, sanitise_file_name, save_metadata_state, save_record,
+                     save_record_items, set_file_mtime, set_mtime, store_download, write_empty_file)
+
+
+def run(yga, coro):
+    """Run an archiver coroutine to completion in a new event loop, closing the API session afterwards."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.run_until_complete(yga.close())
+        loop.close()
+
+
+async def run_bounded(func, items, concurrency):
+    """Await func(item) for every item, with at most concurrency calls outstanding at once."""
+    items = iter(items)
+
+    async def worker():
+        for item in items:
+            await func(item)
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+
+def dump_json(fname, data):
+    with open(fname, 'wb') as f:
+        json.dump(data, codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
+
+
+def load_json(fname, default=None):
+    if not os.path.exists(fname):
+        return default
+    with open(fname, 'rb') as f:
+        return json.load(codecs.getreader('utf-8')(f))
+
+
+async def archive_messages_metadata(yga, incremental=False, topic_index=None):
+    """As yahoo.archive_messages_metadata."""
+    logger = logging.getLogger('archive_message_metadata')
+    params = {'sortOrder': 'asc', 'direction': 1, 'count': 1000}
+
+    message_ids = []
+    next_page_start = float('inf')
+    page_count = 0
+
+    logger.info("Archiving message metadata...")
+    last_next_page_start = 0
+
+    state = load_metadata_state() if incremental else None
+    reached = None
+    last_message_id = state['lastMessageId'] if state else 0
+    if state:
+        page_count = state['pageCount']
+        if state['pageStart']:
+            params['start'] = last_next_page_start = state['pageStart']
+        logger.info("Resuming message metadata from page %d, after message id %d", page_count, last_message_id)
+
+    while next_page_start > 0:
+        page_start = params.get('start', 0)
+        msgs = await yga.messages(**params)
+        dump_json("message_metadata_%s.json" % page_count, msgs)
+
+        page_ids = [msg['messageId'] for msg in msgs['messages']]
+        message_ids += page_ids
+        if topic_index is not None:
+            topic_index.update((msg['messageId'], msg['topicId']) for msg in msgs['messages'] if msg.get('topicId'))
+
+        logger.info("Archived message metadata records (%d of %d)", len(message_ids), msgs['totalRecords'])
+
+        last_message_id = max([last_message_id] + page_ids)
+        reached = metadata_state(page_count, page_start, last_message_id)
+        page_count += 1
+        next_page_start = params['start'] = msgs['nextPageStart']
+        if next_page_start == last_next_page_start:
+            break
+        last_next_page_start = next_page_start
+
+    if state:
+        pending = state.get('pendingMessageIds', [])
+        message_ids = sorted(set(pending).union(id for id in message_ids if id > state['lastMessageId']))
+        logger.info("Found %d new messages since the last run, and %d it couldn't archive",
+                    len(message_ids) - len(pending), len(pending))
+
+    return message_ids, reached
+
+
+async def archive_message_content(yga, id, status="", skipHTML=False, skipRaw=False):
+    """Archive message id, returning False if it couldn't all be fetched."""
+    logger = logging.getLogger('archive_message_content')
+    ok = True
+
+    if skipRaw is False:
+        fname = "%s_raw.json" % (id,)
+        if file_keep(fname, " raw message id: %s" % (id,)) is False:
+            try:
+                logger.info("Fetching  raw message id: %d %s", id, status)
+                raw_json = await yga.messages(id, 'raw')
+                save_record(fname, raw_json, int(raw_json['postDate']) if 'postDate' in raw_json else None)
+            except Exception:
+                logger.exception("Raw grab failed for message %d", id)
+                ok = False
+
+    if skipHTML is False:
+        fname = "%s.json" % (id,)
+        if file_keep(fname, " raw message id: %s" % (id,)) is False:
+            try:
+                logger.info("Fetching html message id: %d %s", id, status)
+                html_json = await yga.messages(id)
+                save_record(fname, html_json, int(html_json['postDate']) if 'postDate' in html_json else None)
+
+                if 'attachmentsInfo' in html_json and len(html_json['attachmentsInfo']) > 0:
+                    attach_dir = make_folder("%d_attachments" % id)
+                    await process_single_attachment(yga, html_json['attachmentsInfo'], attach_dir)
+                    if 'postDate' in html_json:
+                        set_mtime(attach_dir, int(html_json['postDate']))
+            except Exception:
+                logger.exception("HTML grab failed for message %d", id)
+                ok = False
+    return ok
+
+
+async def archive_email(yga, message_subset=None, start=None, stop=None, skipHTML=False, skipRaw=False,
+                        incremental=False):
+    logger = logging.getLogger('archive_email')
+    try:
+        # Grab messages for initial counts and permissions check
+        init_messages = await yga.messages()
+    except yahoogroupsapi.AuthenticationError:
+        raise SectionFailed("Couldn't access Messages functionality for this group")
+
+    if start is not None or stop is not None:
+        start = start or 1
+        stop = stop or init_messages['lastRecordId']
+        stop = min(stop, init_messages['lastRecordId'])
+        message_subset = sorted(set(range(start, stop + 1)).union(message_subset or []))
+
+    reached = None
+    if not message_subset:
+        message_subset, reached = await archive_messages_metadata(yga, incremental)
+        logger.info("Group has %s messages (maximum id: %s), fetching all",
+                    len(message_subset), (message_subset or ['n/a'])[-1])
+
+    total = len(message_subset)
+    failed = []
+
+    async def fetch(item):
+        n, id = item
+        try:
+            if not await archive_message_content(yga, id, "(%d of %d)" % (n, total), skipHTML, skipRaw):
+                failed.append(id)
+        except Exception:
+            logger.exception("Failed to get message id: %d", id)
+            failed.append(id)
+
+    await run_bounded(fetch, enumerate(message_subset, 1), yga.max_in_flight)
+
+    # Only now are the messages found in the metadata archived, or known to need another try
+    if reached is not None:
+        save_metadata_state(reached, failed)
+
+
+async def archive_topics(yga, incremental=False):
+    """As yahoo.archive_topics, checkpointed in TOPICS_CHECKPOINT_FILE in the same way."""
+    logger = logging.getLogger('archive_topics')
+
+    checkpoint = TopicCheckpoint(TOPICS_CHECKPOINT_FILE)
+    if checkpoint.load() and checkpoint.incremental == incremental:
+        logger.info("Resuming from checkpoint, with %d topics and %d messages already retrieved.",
+                    len(checkpoint.sets['retrievedTopicIds']), len(checkpoint.sets['retrievedMessageIds']))
+    else:
+        checkpoint = TopicCheckpoint(TOPICS_CHECKPOINT_FILE)
+
+        logger.info("Initializing messages.")
+        try:
+            init_messages = await yga.messages()
+        except yahoogroupsapi.AuthenticationError:
+            raise SectionFailed("Couldn't access Messages functionality for this group")
+
+        logger.info("Getting message metadata.")
+        topicIndex = {}
+        message_subset, reached = await archive_messages_metadata(yga, incremental, topicIndex)
+        if len(message_subset) == 0:
+            if incremental:
+                logger.info("No new messages since the last run.")
+                save_metadata_state(reached)
+            else:
+                raise SectionFailed("No messages available")
+            return
+
+        logger.info("Expecting %d topics and %d messages.", init_messages['numTopics'], len(message_subset))
+
+        # Fetch the topics the metadata told us about directly, leaving only the remaining messages to be probed.
+        indexedTopicIds = sorted(set(topicIndex[msgId] for msgId in message_subset if msgId in topicIndex))
+        logger.info("Found %d topics in the message metadata.", len(indexedTopicIds))
+
+        checkpoint.incremental = incremental
+        checkpoint.metadata_state = reached
+        checkpoint.expected_topics = init_messages['numTopics']
+        checkpoint.indexed_topic_ids = indexedTopicIds
+        checkpoint.sets['potentialMessageIds'].update(message_subset)
+        checkpoint.save()
+
+    crawl = TopicCrawl(yga, checkpoint)
+    try:
+        with checkpoint.saved_on_signal():
+            await run_bounded(crawl.process_indexed_topic, checkpoint.indexed_topic_ids, yga.max_in_flight)
+
+            while crawl.potentialMessageIds:
+                startingTopicId = await crawl.find_topic_id()
+                if startingTopicId is not None:
+                    await crawl.process_surrounding_topics(startingTopicId)
+    except BaseException:
+        checkpoint.save()
+        raise
+
+    logger.info("Topic archiving complete.")
+    logger.info("There are %d retrieved topic(s).", len(crawl.retrievedTopicIds))
+    logger.info("There are %d retrieved message(s).", len(crawl.retrievedMessageIds))
+    logger.info("There are %d unretrievable topic(s).", len(crawl.unretrievableTopicIds))
+    logger.info("There are %d unretrievable message(s).", len(crawl.unretrievableMessageIds))
+
+    # Only now are the messages found in the metadata archived, or known to need another try
+    if checkpoint.metadata_state is not None:
+        save_metadata_state(checkpoint.metadata_state, crawl.unretrievableMessageIds)
+
+    if incremental:
+        for fname, ids in (("retrievedTopicIds.json", crawl.retrievedTopicIds),
+                           ("retrievedMessageIds.json", crawl.retrievedMessageIds)):
+            ids.update(load_json(fname, []))
+        for fname, ids, retrieved in (("unretrievableTopicIds.json", crawl.unretrievableTopicIds, crawl.retrievedTopicIds),
+                                      ("unretrievableMessageIds.json", crawl.unretrievableMessageIds,
+                                       crawl.retrievedMessageIds)):
+            ids.update(load_json(fname, []))
+            ids.difference_update(retrieved)
+
+    dump_json("retrievedTopicIds.json", list(crawl.retrievedTopicIds))
+    dump_json("retrievedMessageIds.json", list(crawl.retrievedMessageIds))
+    dump_json("unretrievableTopicIds.json", list(crawl.unretrievableTopicIds))
+    dump_json("unretrievableMessageIds.json", list(crawl.unretrievableMessageIds))
+    checkpoint.remove()
+
+
+class TopicCrawl:
+    """State of an archive_topics run, kept in a TopicCheckpoint; the tracking sets are as in yahoo.archive_topics.
+       The previous and next topic chains from each starting topic are walked concurrently."""
+
+    def __init__(self, yga, checkpoint):
+        self.yga = yga
+        self.checkpoint = checkpoint
+        self.expectedTopics = checkpoint.expected_topics
+        self.incremental = checkpoint.incremental
+        self.unretrievableTopicIds = checkpoint.sets['unretrievableTopicIds']
+        self.unretrievableMessageIds = checkpoint.sets['unretrievableMessageIds']
+        self.retrievedTopicIds = checkpoint.sets['retrievedTopicIds']
+        self.retrievedMessageIds = checkpoint.sets['retrievedMessageIds']
+        self.potentialMessageIds = checkpoint.sets['potentialMessageIds']
+
+    async def find_topic_id(self):
+        logger = logging.getLogger('find_topic_id')
+
+        while self.potentialMessageIds:
+            msgId = self.potentialMessageIds.pop()
+            logger.info("Checking message ID %d to find topic.", msgId)
+            try:
+                html_json = await self.yga.messages(msgId)
+                topicId = html_json.get("topicId")
+                logger.info("The message is part of topic ID %d", topicId)
+
+                if topicId in self.retrievedTopicIds:
+                    logger.error("ERROR: This topic has already been archived.")
+                elif topicId in self.unretrievableTopicIds:
+                    logger.info("This topic is known to be unretrievable. Saving individual message.")
+                else:
+                    # Put msgId back in potentialMessageIds since it should be archived with the topic.
+                    self.potentialMessageIds.add(msgId)
+                    return topicId
+
+                self.retrievedMessageIds.add(msgId)
+                email_dir = make_folder('email')
+                fname = os.path.join(email_dir, "%s.json" % (msgId,))
+                if file_keep(fname, "html message id: %d" % (msgId,)) is False:
+                    save_record(fname, html_json)
+
+                if 'attachmentsInfo' in html_json and len(html_json['attachmentsInfo']) > 0:
+                    attach_dir = make_folder("%d_attachments" % msgId, email_dir)
+                    await process_single_attachment(self.yga, html_json['attachmentsInfo'], attach_dir)
+                logger.info("%d total messages downloaded.", len(self.retrievedMessageIds))
+            except Exception:
+                logger.exception("HTML grab failed for message %d", msgId)
+                self.unretrievableMessageIds.add(msgId)
+
+        return None
+
+    async def process_indexed_topic(self, topicId):
+        if topicId not in self.retrievedTopicIds and topicId not in self.unretrievableTopicIds:
+            await self.process_single_topic(topicId, refresh=self.incremental)
+
+    async def process_surrounding_topics(self, startingTopicId):
+        topicResults = await self.process_single_topic(startingTopicId, refresh=self.incremental)
+        if topicResults["gotTopic"] is False:
+            return
+
+        await asyncio.gather(self.follow_chain(topicResults["prevTopicId"], "prevTopicId"),
+                             self.follow_chain(topicResults["nextTopicId"], "nextTopicId"))
+
+    async def follow_chain(self, topicId, direction):
+        logger = logging.getLogger(name="process_surrounding_topics")
+        while topicId > 0:
+            if topicId in self.unretrievableTopicIds:
+                logger.info("Reached known unretrievable topic ID %d", topicId)
+                break
+            if self.incremental and direction == "prevTopicId" and record_exists("%s.json" % (topicId,)):
+                logger.info("Reached topic ID %d archived by an earlier run", topicId)
+                break
+            topicResults = await self.process_single_topic(topicId)
+            topicId = topicResults[direction]
+
+    async def process_single_topic(self, topicId, refresh=False):
+        logger = logging.getLogger(name="process_single_topic")
+        topicResults = {
+            "gotTopic": False,
+            "nextTopicId": 0,
+            "prevTopicId": 0
+        }
+
+        fname = "%s.json" % (topicId,)
+        # A topic this crawl has already done, before it was interrupted and resumed, need not be read again.
+        links = self.checkpoint.links.get(topicId)
+        if links is not None and record_exists(fname):
+            logger.info("Topic ID %d was archived before resuming from the checkpoint", topicId)
+            self.retrievedTopicIds.add(topicId)
+            topicResults["gotTopic"] = True
+            topicResults["prevTopicId"], topicResults["nextTopicId"] = links
+            return topicResults
+
+        # A big thread can be too large to hold in memory, so its messages are read one at a time.
+        topic_json = messages = None
+        if not refresh and file_keep(fname, "topic id: %d" % (topicId,)):
+            try:
+                topic_json, messages = load_record_items(fname, 'messages')
+            except Exception:
+                logger.exception("ERROR: couldn't load %s from disk.", fname)
+
+        if topic_json is None:
+            try:
+                logger.info("Fetching topic ID %d", topicId)
+                topic = await self.yga.stream_json('%s.json.raw' % (topicId,), 'topics', topicId, maxResults=999999)
+                with topic:
+                    save_record_items(fname, topic.fields('messages'), 'messages', topic.items('messages'))
+                topic_json, messages = load_record_items(fname, 'messages')
+            except Exception:
+                logger.exception("ERROR downloading topic ID %d", topicId)
+                self.unretrievableTopicIds.add(topicId)
+                return topicResults
+
+        self.retrievedTopicIds.add(topicId)
+        topicResults["gotTopic"] = True
+        topicResults["nextTopicId"] = topic_json.get("nextTopicId")
+        topicResults["prevTopicId"] = topic_json.get("prevTopicId")
+
+        attachments = []
+        topicMessageIds = []
+        for message in messages:
+            msgId = message.get("msgId")
+            topicMessageIds.append(msgId)
+            self.retrievedMessageIds.add(msgId)
+            self.unretrievableMessageIds.discard(msgId)
+
+            if 'attachmentsInfo' in message and len(message['attachmentsInfo']) > 0:
+                attach_dir = make_folder("%d_attachments" % msgId)
+                attachments.append(process_single_attachment(self.yga, message['attachmentsInfo'], attach_dir))
+        await asyncio.gather(*attachments)
+
+        # As in yahoo.process_single_topic, only once the whole topic is done, so that a resumed crawl can find it
+        self.potentialMessageIds.difference_update(topicMessageIds)
+        logger.info("Fetched topic ID %d with message count %d (topic %d of %d). %d total messages downloaded.",
+                    topicId, topic_json.get("totalMsgInTopic"), len(self.retrievedTopicIds), self.expectedTopics,
+                    len(self.retrievedMessageIds))
+        self.checkpoint.done(topicId, topicResults["prevTopicId"], topicResults["nextTopicId"])
+        return topicResults
+
+
+async def fetch_file(yga, url, fname):
+    """Download url as fname, by way of the global blob store if it is in use."""
+    if link_known_url(url, fname):
+        return
+    await yga.download_file(url, fname=fname)
+    store_download(fname, url)
+
+
+async def process_single_attachment(yga, attach, path=''):
+    logger = logging.getLogger(name="process_single_attachment")
+    for frec in attach:
+        fname = os.path.join(path, sanitise_file_name("%s-%s" % (frec['fileId'], frec['filename'])))
+
+        if file_keep(fname, "file: %s" % (fname,)) is False:
+            logger.info("Fetching attachment '%s'", frec['filename'])
+            if 'link' in frec:
+                # (sometimes yahoo doesn't keep them)
+                try:
+                    await fetch_file(yga, frec['link'], fname)
+                    file_done(fname)
+                except DOWNLOAD_ERRORS as err:
+                    logger.error("ERROR downloading attachment '%s': %s", frec['link'], err)
+                    # leave an empty file, so we don't try again on the next run
+                    write_empty_file(fname)
+                    file_done(fname, unavailable=True)
+                continue
+
+            if 'photoInfo' in frec:
+                await process_single_photo(yga, frec['photoInfo'], fname)
+            else:
+                write_empty_file(fname)
+
+            set_file_mtime(fname, frec['modificationDate'])
+            file_done(fname)
+
+
+async def process_single_photo(yga, photoinfo, fname):
+    logger = logging.getLogger(name="process_single_photo")
+    # keep retrying until we find the largest image size we can download
+    # (sometimes yahoo doesn't keep the originals)
+    exclude = []
+    while True:
+        bestPhotoinfo = best_photo_variant(photoinfo, exclude)
+
+        if bestPhotoinfo is None:
+            logger.error("Can't find a viable copy of this photo")
+            write_empty_file(fname)
+            break
+
+        try:
+            await fetch_file(yga, bestPhotoinfo['displayURL'], fname)
+            photo_variant_result(bestPhotoinfo['photoType'], True)
+            break
+        except DOWNLOAD_ERRORS as err:
+            logger.error("ERROR downloading '%s' variant %s: %s", bestPhotoinfo['displayURL'],
+                         bestPhotoinfo['photoType'], err)
+            photo_variant_result(bestPhotoinfo['photoType'], False)
+            exclude.append(bestPhotoinfo['photoType'])
+
+
+async def archive_attachments(yga):
+    logger = logging.getLogger(name="archive_attachments")
+    try:
+        # The index of every attachment can be too large to parse in memory, so read it one attachment at a time
+        attachments_json = await yga.stream_json('allattachmentinfo.json.raw', 'attachments', count=999999)
+    except Exception:
+        raise SectionFailed("Couldn't access Attachments functionality for this group")
+
+    async def fetch(a):
+        folder = make_folder(str(a['attachmentId']))
+        try:
+            a_json = await yga.attachments(a['attachmentId'])
+        except Exception:
+            logger.error("Attachment id %d inaccessible.", a['attachmentId'])
+            return
+        dump_json(os.path.join(folder, 'attachmentinfo.json'), a_json)
+        await process_single_attachment(yga, a_json['files'], folder)
+        set_mtime(folder, a['modificationDate'])
+
+    with attachments_json:
+        with open('allattachmentinfo.json', 'wb') as f:
+            dump_list(codecs.getwriter('utf-8')(f), attachments_json.items('attachments'))
+        await run_bounded(fetch, attachments_json.items('attachments'), yga.max_in_flight)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""Archive many groups, running yahoo.py for several of them at once.
+
+Each group is archived by its own yahoo.py process, at most --jobs at a time, all sharing a request budget of one
+request per --global-delay seconds through a common --rate-limit-file, while each keeps to its own --delay. Groups
+which fail are tried again once every other group has had its turn, up to --retries times. The outcome for each
+group, and for each section within it, is kept in --summary as the batch progresses.
+"""
+from __future__ import unicode_literals
+
+import argparse
+import codecs
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from yahoo import SECTION_STATUS_FILE
+
+YAHOO_PY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'yahoo.py')
+
+
+def read_groups(fname):
+    """Group names from fname, one per line, ignoring blank lines and # comments."""
+    with io.open(fname, 'r', encoding='utf-8') as f:
+        groups = [line.split('#', 1)[0].strip() for line in f]
+    return list(OrderedDict.fromkeys(g for g in groups if g))
+
+
+def archive_group(command, group):
+    """Run command (a yahoo.py command line, without the group) for group in the current directory.
+       Returns the outcome for the summary."""
+    logger = logging.getLogger(name="archive_group")
+    if not os.path.isdir(group):
+        os.mkdir(group)
+    status_file = os.path.join(group, SECTION_STATUS_FILE)
+    if os.path.exists(status_file):
+        os.remove(status_file)
+
+    start = time.time()
+    # yahoo.py logs everything to archive.log itself; keep anything else it has to say there too.
+    with open(os.devnull, 'wb') as devnull, open(os.path.join(group, 'archive.log'), 'ab') as log:
+        returncode = subprocess.call(command + [group], stdout=devnull, stderr=log)
+
+    sections = OrderedDict()
+    if os.path.exists(status_file):
+        with open(status_file, 'rb') as f:
+            sections = json.load(codecs.getreader('utf-8')(f), object_pairs_hook=OrderedDict)
+
+    status = 'ok' if returncode == 0 else 'failed'
+    logger.info("Group %s %s after %.0f seconds", group, status, time.time() - start)
+    return OrderedDict([('status', status), ('returncode', returncode),
+                        ('seconds', round(time.time() - start, 3)), ('sections', sections)])
+
+
+def run_batch(command, groups, jobs=1, retries=0, summary_file=None):
+    """Archive groups with at most jobs concurrent processes, retrying failures up to retries times.
+       Returns the summary of outcomes, which is also saved to summary_file as it changes."""
+    logger = logging.getLogger(name="run_batch")
+    summary = OrderedDict((g, OrderedDict([('status', 'pending'), ('attempts', 0)])) for g in groups)
+    lock = threading.Lock()
+
+    def save_summary():
+        if summary_file:
+            with open(summary_file + '.tmp', 'wb') as f:
+                json.dump(summary, codecs.getwriter('utf-8')(f), ensure_ascii=False, indent=4)
+            os.rename(summary_file + '.tmp', summary_file)
+
+    def attempt(group):
+        try:
+            result = archive_group(command, group)
+        except Exception as e:
+            logger.exception("Could not run archiver for group %s", group)
+            result = OrderedDict([('status', 'failed'), ('error', str(e))])
+        with lock:
+            result['attempts'] = summary[group]['attempts'] + 1
+            summary[group] = result
+            save_summary()
+
+    todo = list(groups)
+    for round_number in range(retries + 1):
+        if not todo:
+            break
+        if round_number:
+            logger.info("Retrying %d failed group(s), attempt %d of %d", len(todo), round_number + 1, retries + 1)
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(attempt, todo))
+        todo = [g for g in todo if summary[g]['status'] != 'ok']
+
+    save_summary()
+    logger.info("%d of %d group(s) archived successfully", len(groups) - len(todo), len(groups))
+    return summary
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description=__doc__,
+                                usage='%(prog)s [options] groups_file [yahoo.py options]')
+    p.add_argument('groups_file', type=str, help='File listing the groups to archive, one per line')
+    p.add_argument('--jobs', type=int, default=4, help='Number of groups to archive at once (default 4)')
+    p.add_argument('--retries', type=int, default=2,
+                   help='Number of times to retry groups which fail, after the rest of the batch (default 2)')
+    p.add_argument('--delay', type=float, default=0.2,
+                   help='Minimum delay between requests for each group (default 0.2s)')
+    p.add_argument('--global-delay', type=float, default=0.05,
+                   help='Minimum delay between requests across all groups (default 0.05s)')
+    p.add_argument('--rate-limit-file', type=str, default='batch_rate_limit.json',
+                   help='File used to share the --global-delay budget between groups (default batch_rate_limit.json)')
+    p.add_argument('--summary', type=str, default='batch_summary.json',
+                   help='File to record the outcome for each group in (default batch_summary.json)')
+    p.add_argument('yahoo_args', nargs=argparse.REMAINDER,
+                   help='Further options passed to yahoo.py for every group, e.g. cookies and what to archive')
+    args = p.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stdout,
+                        format='%(asctime)s %(levelname)s %(name)s %(message)s')
+
+    command = [sys.executable, YAHOO_PY, '--delay', str(args.delay), '--global-delay', str(args.global_delay),
+               '--rate-limit-file', os.path.abspath(args.rate_limit_file)] + args.yahoo_args
+    summary = run_batch(command, read_groups(args.groups_file), args.jobs, args.retries, args.summary)
+
+    if any(s['status'] != 'ok' for s in summary.values()):
+        sys.exit(1)
@@ -1,28 +1,36 @@
-# Warning: This module must be imported before any imports of the requests module.
-
 from __future__ import unicode_literals
+from collections import OrderedDict, deque
 from contextlib import contextmanager
+from email.utils import mktime_tz, parsedate_tz
 import functools
+import hashlib
+import itertools
+import json
 import logging
 import os
 import random
+import socket
+import threading
 import time
 
 try:
-    from warcio.capture_http import capture_http
+    from warcfiles import WARCAdapter
     warcio_failed = False
 except ImportError as e:
     warcio_failed = e
 
-import requests  # Must be imported after capture_http
-from requests.exceptions import Timeout, ConnectionError
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
-VERIFY_HTTPS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'yahoogroups_cert_chain.pem')
+import requests
+from requests.exceptions import ChunkedEncodingError, Timeout, ConnectionError
 
+from jsonstream import StreamedJSON
+from metrics import Metrics
 
-@contextmanager
-def dummy_contextmanager(*kargs, **kwargs):
-    yield
+VERIFY_HTTPS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'yahoogroups_cert_chain.pem')
 
 
 class YGAException(Exception):
@@ -61,6 +69,451 @@ class Recoverable(YGAException):
     pass
 
 
+class Stalled(Recoverable):
+    """A download's body arrived too slowly, and the transfer was aborted."""
+    pass
+
+
+# Raised by YahooGroupsAPI.download_file once a download has failed for good
+DOWNLOAD_ERRORS = (requests.exceptions.RequestException, Stalled)
+
+
+class RateLimiter(object):
+    """Token bucket allowing `rate` requests per second on average, and bursts of up to `burst` requests.
+
+    A single instance may be shared by several YahooGroupsAPI objects and threads. If state_file is given, the
+    bucket is stored in that file under an exclusive lock, so that separate processes on one host using the same
+    file also share a single budget. If parent is given, each request must also be allowed by the parent limiter,
+    e.g. a per-process limit under a limit shared by all processes.
+    """
+    logger = logging.getLogger(name="RateLimiter")
+
+    def __init__(self, rate, burst=1, state_file=None, parent=None):
+        self.rate = rate
+        self.burst = burst
+        self.state_file = state_file
+        self.parent = parent
+        self.lock = threading.Lock()
+        self.state = {'tokens': burst, 'updated': time.time()}
+
+        if state_file and fcntl is None:
+            self.logger.warning("File locking is unavailable on this platform, rate limit will not be shared "
+                                "between processes.")
+            self.state_file = None
+
+    @contextmanager
+    def locked_state(self):
+        if not self.state_file:
+            yield self.state
+            return
+
+        with open(self.state_file, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read())
+                except ValueError:
+                    state = {'tokens': self.burst, 'updated': time.time()}
+                yield state
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def try_acquire(self):
+        """Consume a token if one is available.
+           Returns 0 on success, otherwise the number of seconds to wait before trying again."""
+        if not self.rate:
+            return self.parent.try_acquire() if self.parent else 0
+
+        with self.lock, self.locked_state() as state:
+            now = time.time()
+            tokens = min(self.burst, state['tokens'] + (now - state['updated']) * self.rate)
+            state['updated'] = now
+            if tokens < 1:
+                state['tokens'] = tokens
+                return (1 - tokens) / self.rate
+            # Only spend our token once the parent has also allowed the request
+            wait = self.parent.try_acquire() if self.parent else 0
+            state['tokens'] = tokens if wait else tokens - 1
+            return wait
+
+    def acquire(self):
+        """Block until a request may be made, and consume the token for it."""
+        wait = self.try_acquire()
+        while wait:
+            time.sleep(wait)
+            wait = self.try_acquire()
+
+
+class AdaptiveDelay(object):
+    """Tunes the rate of a RateLimiter to the fastest the server will sustain, within min_delay and max_delay.
+
+    Outcomes of requests are fed to observe(), and the latest `window` are kept. If more than threshold of them are
+    failures suggesting the server is overloaded (307s, 429s, 5xx errors and 60-68 byte bodies), the rate is divided
+    by factor; after each full window below threshold, it is increased by step requests per second. Each change is
+    logged. The rate starts at whatever the limiter was created with.
+    """
+    logger = logging.getLogger(name="AdaptiveDelay")
+
+    def __init__(self, rate_limiter, min_delay, max_delay, window=100, threshold=0.05, step=0.5, factor=2):
+        self.rate_limiter = rate_limiter
+        self.fastest = 1.0 / min_delay
+        self.slowest = 1.0 / max_delay
+        self.window = window
+        self.threshold = threshold
+        self.step = step
+        self.factor = factor
+        self.lock = threading.Lock()
+        self.outcomes = deque(maxlen=window)
+
+        self.rate = min(self.fastest, max(self.slowest, rate_limiter.rate or self.fastest))
+        self.rate_limiter.rate = self.rate
+
+    @staticmethod
+    def congested(failure):
+        return failure in (307, 429, 'bad_size') or (isinstance(failure, int) and failure >= 500)
+
+    def observe(self, failure=None):
+        """Record the outcome of a request: None if it succeeded, otherwise its failure as for RetryPolicy."""
+        congested = self.congested(failure)
+        with self.lock:
+            self.outcomes.append(congested)
+            errors = sum(self.outcomes)
+            if congested and errors > self.threshold * self.window:
+                self.adjust(self.rate / self.factor, errors)
+            elif len(self.outcomes) == self.window and errors <= self.threshold * self.window:
+                self.adjust(self.rate + self.step, errors)
+
+    def adjust(self, rate, errors):
+        # Must be called with self.lock held
+        rate = min(self.fastest, max(self.slowest, rate))
+        if rate != self.rate:
+            self.logger.info("%d of the last %d requests failed, now making one request every %.3f seconds",
+                             errors, len(self.outcomes), 1.0 / rate)
+            self.rate = self.rate_limiter.rate = rate
+        self.outcomes.clear()
+
+
+class RetryPolicy(object):
+    """Decides whether and when failed requests are retried, for any number of YahooGroupsAPI objects and threads.
+
+    Failures are classified by HTTP status, or as 'bad_size' for a 60-68 byte body and 'error' where no response was
+    received. STATUS_ATTEMPTS gives the number of attempts allowed for each, with None meaning `retries`; other 5xx
+    statuses are allowed `retries` attempts, and anything else is not retried. Backoff doubles from min_delay with
+    each attempt, up to max_delay, unless the server sends Retry-After, which is honoured instead and also pauses
+    every other request through this policy for that long.
+
+    If budget is given, no more than that many retries are made in total. If breaker_threshold is given, that many
+    consecutive failures open the circuit breaker: all requests are held for breaker_pause seconds, after which a
+    single request is let through to probe the server. If it fails the breaker opens again for twice as long (up to
+    max_pause), and if it succeeds requests resume as normal.
+
+    If adaptive_delay is given, the outcome of every request is also passed on to it.
+    """
+    STATUS_ATTEMPTS = {
+        307: 3,     # Not logged in; rarely resolved by retrying
+        400: 5,     # Seen on downloads under load
+        429: None,
+        500: None,
+        'bad_size': None,
+        'error': None,
+    }
+
+    logger = logging.getLogger(name="RetryPolicy")
+
+    def __init__(self, retries=15, min_delay=0, max_delay=60, budget=None, breaker_threshold=None,
+                 breaker_pause=60, max_pause=900, status_attempts=None, adaptive_delay=None):
+        self.retries = retries
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.breaker_threshold = breaker_threshold
+        self.breaker_pause = breaker_pause
+        self.max_pause = max_pause
+        self.status_attempts = dict(self.STATUS_ATTEMPTS)
+        self.status_attempts.update(status_attempts or {})
+        self.adaptive_delay = adaptive_delay
+
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.pause = breaker_pause
+        self.open_until = 0
+        self.probing = False
+
+    def attempts(self, failure):
+        """The number of attempts allowed for a request failing with failure."""
+        if failure in self.status_attempts:
+            attempts = self.status_attempts[failure]
+        else:
+            attempts = None if isinstance(failure, int) and failure >= 500 else 1
+        return self.retries if attempts is None else min(attempts, self.retries)
+
+    def retryable(self, failure):
+        return self.attempts(failure) > 1
+
+    def backoff_time(self, attempt):
+        """Calculate backoff time from minimum delay and attempt number.
+           Currently no good reason for choice of backoff, except not to increase too rapidly."""
+        base = 2
+        if attempt > 8:
+            attempt = 8
+        delay = self.min_delay*base**attempt+random.uniform(0, self.min_delay*base**attempt)
+        return min(delay, self.max_delay) if self.max_delay is not None else delay
+
+    @staticmethod
+    def parse_retry_after(value):
+        """Seconds to wait from a Retry-After header, given either as seconds or as an HTTP date."""
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            date = parsedate_tz(value)
+            return max(0.0, mktime_tz(date) - time.time()) if date else None
+
+    def retry_delay(self, failure, attempt, retry_after=None):
+        """Record that attempt number attempt (from 0) of a request failed with failure.
+           Returns the number of seconds to wait before retrying, or None if it should not be retried."""
+        retry_after = self.parse_retry_after(retry_after)
+        if self.adaptive_delay is not None:
+            self.adaptive_delay.observe(failure)
+        with self.lock:
+            now = time.time()
+            self.failures += 1
+            if retry_after is not None:
+                # The server asked for a pause, which applies to every request
+                self.open_until = max(self.open_until, now + retry_after)
+            elif self.probing or (self.breaker_threshold and self.failures == self.breaker_threshold):
+                if self.probing:
+                    self.pause = min(self.pause * 2, self.max_pause)
+                self.logger.warning("%d consecutive failed requests, pausing all requests for %d seconds",
+                                    self.failures, self.pause)
+                self.open_until = now + self.pause
+            self.probing = False
+
+            if attempt + 1 >= self.attempts(failure):
+                return None
+            if self.budget is not None:
+                if self.budget <= 0:
+                    return None
+                self.budget -= 1
+                if self.budget == 0:
+                    self.logger.warning("Retry budget exhausted, failed requests will no longer be retried")
+        return retry_after if retry_after is not None else self.backoff_time(attempt)
+
+    def success(self):
+        """Record a response which needs no retry, closing the circuit breaker."""
+        if self.adaptive_delay is not None:
+            self.adaptive_delay.observe()
+        with self.lock:
+            if self.probing:
+                self.logger.info("Requests succeeding again, resuming")
+            self.failures = 0
+            self.pause = self.breaker_pause
+            self.open_until = 0
+            self.probing = False
+
+    def probe_failed(self):
+        """Record a request that ended without success() or retry_delay() hearing of it, such as one that raised an
+        unexpected exception. If it was the probe, the breaker opens again as it would for any other failed probe."""
+        with self.lock:
+            if not self.probing:
+                return
+            self.pause = min(self.pause * 2, self.max_pause)
+            self.logger.warning("Probe request failed, pausing all requests for %d seconds", self.pause)
+            self.open_until = time.time() + self.pause
+            self.probing = False
+
+    def wait_time(self):
+        """Returns 0 if a request may be made now, otherwise the number of seconds to wait before asking again."""
+        with self.lock:
+            if not self.open_until:
+                return 0
+            now = time.time()
+            if now < self.open_until:
+                return self.open_until - now
+            if self.probing:
+                return 0.5
+            self.probing = True
+            return 0
+
+    def wait(self):
+        """Block while the circuit breaker holds requests."""
+        wait = self.wait_time()
+        while wait:
+            time.sleep(wait)
+            wait = self.wait_time()
+
+
+class StallWatchdog(object):
+    """Aborts the streamed response r if its body arrives at less than min_rate bytes a second, over stall_time seconds
+    spent waiting on it.
+
+    reading() is called before each read of the body, and progress() with the size of the chunk it returned. Only the
+    time in between counts, so a consumer that is slow to ask for more isn't taken for a slow connection. A thread
+    checks the rate as it goes and, on a stall, shuts the response's connection down, so that a read held up by a
+    trickling connection fails rather than continuing indefinitely. stalled is then set. close() stops the thread.
+    """
+    logger = logging.getLogger(name="StallWatchdog")
+
+    def __init__(self, r, min_rate, stall_time):
+        self.r = r
+        self.min_rate = min_rate
+        self.stall_time = stall_time
+        self.lock = threading.Lock()
+        self.received = 0
+        self.read_time = 0
+        self.read_start = None
+        self.stalled = False
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def reading(self):
+        with self.lock:
+            self.read_start = time.time()
+
+    def progress(self, size):
+        with self.lock:
+            self.received += size
+            self.read_time += time.time() - self.read_start
+            self.read_start = None
+
+    def run(self):
+        while not self.done.wait(self.stall_time / 4.0):
+            with self.lock:
+                now = time.time()
+                read_time = self.read_time
+                if self.read_start is not None:
+                    read_time += now - self.read_start
+                    self.read_start = now
+                if read_time < self.stall_time:
+                    self.read_time = read_time
+                    continue
+                received, self.received, self.read_time = self.received, 0, 0
+            if received < self.min_rate * read_time:
+                self.logger.info("Only %d bytes of %s arrived in %.1f seconds, aborting", received, self.r.url,
+                                 read_time)
+                self.stalled = True
+                self.abort()
+                return
+
+    def abort(self):
+        # Closing the response waits for a read in progress to finish, but shutting its socket down ends the read
+        sock = getattr(getattr(self.r.raw, 'connection', None), 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        self.r.close()
+
+    def close(self):
+        self.done.set()
+
+
+class ResponseCache(object):
+    """Cache of API responses, keyed on group, endpoint, path parts and query parameters.
+
+    The most recently used max_entries responses are held in memory. If path is given, responses are also written to
+    that directory, and reused by later runs for up to ttl seconds (or indefinitely if ttl is None). Responses are
+    stored serialised, so every caller gets its own copy of the data. Safe to share between threads; fetch() also
+    makes concurrent requests for the same key wait for a single fetch rather than each making their own.
+    """
+    logger = logging.getLogger(name="ResponseCache")
+
+    def __init__(self, max_entries=256, path=None, ttl=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.in_flight = {}
+
+        if path and not os.path.isdir(path):
+            os.makedirs(path)
+
+    @staticmethod
+    def key(group, target, parts, opts):
+        return json.dumps([group, target, [str(p) for p in parts], sorted((k, str(v)) for k, v in opts.items())])
+
+    def file_name(self, key):
+        return os.path.join(self.path, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, key):
+        """Returns a copy of the cached data for key. Raises KeyError if there is none."""
+        with self.lock:
+            text = self.entries.pop(key, None)
+            if text is not None:
+                self.entries[key] = text
+                return json.loads(text)
+
+        if not self.path:
+            raise KeyError(key)
+        fname = self.file_name(key)
+        try:
+            if self.ttl is not None and time.time() - os.path.getmtime(fname) > self.ttl:
+                raise KeyError(key)
+            with open(fname, 'rb') as f:
+                text = f.read().decode('utf-8')
+        except (IOError, OSError):
+            raise KeyError(key)
+        self.remember(key, text)
+        return json.loads(text)
+
+    def put(self, key, data):
+        text = json.dumps(data, ensure_ascii=False)
+        self.remember(key, text)
+        if self.path:
+            fname = self.file_name(key)
+            with open(fname + '.tmp', 'wb') as f:
+                f.write(text.encode('utf-8'))
+            os.rename(fname + '.tmp', fname)
+
+    def remember(self, key, text):
+        if not self.max_entries:
+            return
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = text
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def fetch(self, key, func):
+        """Return the cached data for key, calling func() to fetch and cache it if needed.
+           If another thread is already fetching key, wait for it instead."""
+        while True:
+            try:
+                return self.get(key)
+            except KeyError:
+                pass
+
+            with self.lock:
+                event = self.in_flight.get(key)
+                leader = event is None
+                if leader:
+                    event = self.in_flight[key] = threading.Event()
+
+            if not leader:
+                # If the fetch fails, go round again and make the request ourselves
+                event.wait()
+                continue
+
+            try:
+                data = func()
+                self.put(key, data)
+                return data
+            finally:
+                with self.lock:
+                    del self.in_flight[key]
+                event.set()
+
+
 class YahooGroupsAPI:
     BASE_URI = "https://groups.yahoo.com/api"
 
@@ -78,17 +531,33 @@ class YahooGroupsAPI:
             'members': 'v1'
             }
 
-    logger = logging.getLogger(name="YahooGroupsAPI")
+    # Never taken from the response cache, as they change while the group is active, along with anything requested
+    # without path parts: the message index and counts, and the other lists of the group's content
+    UNCACHED_TARGETS = ('topics', 'albums')
 
-    s = None
-    ww = None
-    http_context = dummy_contextmanager
+    CHUNK_SIZE = 64 * 1024
 
-    def __init__(self, group, cookie_jar=None, headers={}, min_delay=0, retries=15):
+    logger = logging.getLogger(name="YahooGroupsAPI")
+
+    def __init__(self, group, cookie_jar=None, headers={}, min_delay=0, retries=15, rate_limiter=None, cache=None,
+                 metrics=None, retry_policy=None, download_timeout=(15, 60), min_download_rate=0, stall_time=60):
         self.s = requests.Session()
+        self.ww = None
         self.group = group
         self.min_delay = min_delay
-        self.retries = retries
+        self.cache = cache
+        # (connect, read) timeouts for downloads, and the minimum bytes a second over stall_time before one is aborted
+        self.download_timeout = download_timeout
+        self.min_download_rate = min_download_rate
+        self.stall_time = stall_time
+        self.metrics = metrics if metrics is not None else Metrics()
+
+        if rate_limiter is None:
+            rate_limiter = RateLimiter(1.0 / min_delay if min_delay else 0)
+        self.rate_limiter = rate_limiter
+        if retry_policy is None:
+            retry_policy = RetryPolicy(retries, min_delay)
+        self.retry_policy = retry_policy
 
         if cookie_jar:
             self.s.cookies = cookie_jar
@@ -100,7 +569,10 @@ class YahooGroupsAPI:
             self.logger.fatal("Attempting to log to warc, but warcio failed to import.")
             raise warcio_failed
         self.ww = ww
-        self.http_context = capture_http
+        # Recording happens in this session's transport adapter, so other instances are unaffected
+        adapter = WARCAdapter(ww) if ww is not None else requests.adapters.HTTPAdapter()
+        self.s.mount('https://', adapter)
+        self.s.mount('http://', adapter)
 
     def __getattr__(self, name):
         """ Return an API stub function for the API endpoint called name.
@@ -112,88 +584,275 @@ class YahooGroupsAPI:
         self.API_VERSIONS[name]  # Tests that name is defined, and raises an AttributeError if not
         return functools.partial(self.get_json, name)
 
-    def backoff_time(self, attempt):
-        """Calculate backoff time from minimum delay and attempt number.
-           Currently no good reason for choice of backoff, except not to increase too rapidly."""
-        base = 2
-        if attempt > 8:
-            attempt = 8
-        return self.min_delay*base**attempt+random.uniform(0, self.min_delay*base**attempt)
-
-    def download_file(self, url, f=None, **args):
-        with self.http_context(self.ww):
-            time.sleep(self.min_delay)
-
-            for attempt in range(self.retries):
-                r = self.s.get(url, verify=VERIFY_HTTPS, **args)
-                if r.status_code == 400 or r.status_code == 500:
-                    if r.status_code == 400 and 'malware' in r.text:
-                        self.logger.warning("Got 400 error indicating malware for %s, skipping", url)
-                        break
-                    else:
-                        self.logger.info("Got %d error for %s, will sleep and retry", r.status_code, url)
-                        if attempt < self.retries-1:
-                            delay = self.backoff_time(attempt)
-                            self.logger.info("Attempt %d, delaying for %.2f seconds", attempt+1, delay)
-                            time.sleep(delay)
-                            continue
-                        self.logger.warning("Giving up, too many failed attempts at downloading %s", url)
-                elif r.status_code != 200:
-                    self.logger.error("Unknown %d error for %s, giving up on this download", r.status_code, url)
-                elif len(r.content) in range(60, 69):
-                    self.logger.info("Got potentially invalid size of %d for %s, will sleep and retry", len(r.content), url)
-                    if attempt < self.retries-1:
-                        delay = self.backoff_time(attempt)
-                        self.logger.info("Attempt %d, delaying for %.2f seconds", attempt+1, delay)
-                        time.sleep(delay)
-                        continue
-                    self.logger.warning("Giving up, too many potentially failed attempts at downloading %s", url)
-                r.raise_for_status()
+    def wait_for_turn(self):
+        """Block until the rate limiter allows another request."""
+        start = time.time()
+        self.rate_limiter.acquire()
+        self.metrics.waited(time.time() - start)
+
+    def response_size(self, r, chunks):
+        """Find the full size of a streamed download, for the BadSize check.
+           Uses the response headers where they can be trusted, otherwise reads the start of the body from chunks.
+           Returns the size and any body data that had to be read."""
+        content_range = r.headers.get('Content-Range', '')
+        if r.status_code == 206 and '/' in content_range and not content_range.endswith('*'):
+            return int(content_range.rsplit('/', 1)[1]), b''
+        if 'Content-Length' in r.headers and 'Content-Encoding' not in r.headers:
+            return int(r.headers['Content-Length']), b''
+
+        head = b''
+        for chunk in chunks:
+            head += chunk
+            if len(head) >= 69:
                 break
+        return len(head), head
+
+    def download_file(self, url, f=None, fname=None, **args):
+        """Download url, returning its content or streaming it into the file object f.
+
+           If fname is given the body is streamed into fname.part instead, which is renamed to fname once complete.
+           An existing fname.part from an interrupted download is resumed with a Range request, if the server
+           supports it.
+
+           A connection that fails, times out or stalls (see StallWatchdog) is retried like an error response, a
+           download into fname resuming from where the last attempt got to."""
+        self.wait_for_turn()
+        part_name = fname + '.part' if fname else None
+        f_start = f.tell() if f is not None else None
+
+        for attempt in itertools.count():
+            self.retry_policy.wait()
+            offset = os.path.getsize(part_name) if part_name and os.path.exists(part_name) else 0
+            headers = {'Range': 'bytes=%d-' % offset} if offset else {}
+
+            start = time.time()
+            r = chunks = error = failure = None
+            head = b''
+            try:
+                r = self.s.get(url, verify=VERIFY_HTTPS, stream=True, headers=headers, timeout=self.download_timeout,
+                               **args)
+                self.metrics.request('download', r.status_code, time.time() - start)
+                if r.status_code == 400 and 'malware' in r.text:
+                    self.logger.warning("Got 400 error indicating malware for %s, skipping", url)
+                    self.retry_policy.success()
+                    # Saved like any other body, rather than raised, so one flagged file doesn't stop the section
+                    return self.receive(r, head, chunks, f, fname, part_name, f_start)
+                elif r.status_code == 416 and offset:
+                    self.logger.info("Could not resume download of %s, restarting", url)
+                    r.close()
+                    os.remove(part_name)
+                    self.metrics.retry('download')
+                    # The server answered, so this isn't a failure to hold other requests back for
+                    self.retry_policy.success()
+                    continue
+                elif r.status_code == 200 or r.status_code == 206:
+                    chunks = self.watch_chunks(r)
+                    size, head = self.response_size(r, chunks)
+                    if size in range(60, 69):
+                        self.logger.info("Got potentially invalid size of %d for %s", size, url)
+                        self.metrics.bad_size('download')
+                        failure = 'bad_size'
+                elif self.retry_policy.retryable(r.status_code):
+                    self.logger.info("Got %d error for %s", r.status_code, url)
+                    failure = r.status_code
+                else:
+                    self.logger.error("Unknown %d error for %s, giving up on this download", r.status_code, url)
 
-            if f is None:
-                return r.content
-            else:
-                f.write(r.content)
+                if failure is None:
+                    self.retry_policy.success()
+                    r.raise_for_status()
+                    return self.receive(r, head, chunks, f, fname, part_name, f_start)
+            except (ConnectionError, Timeout, ChunkedEncodingError, Stalled) as e:
+                if r is None:
+                    self.metrics.request('download', 'error', time.time() - start)
+                else:
+                    r.close()
+                self.logger.info("Download of %s failed: %s", url, e)
+                failure = 'error'
+                error = e
+            except BaseException:
+                self.retry_policy.probe_failed()
+                raise
+
+            retry_after = r.headers.get('Retry-After') if r is not None and error is None else None
+            delay = self.retry_policy.retry_delay(failure, attempt, retry_after)
+            if delay is not None:
+                if r is not None:
+                    r.close()
+                self.logger.info("Attempt %d, delaying for %.2f seconds", attempt+1, delay)
+                self.metrics.retry('download', delay)
+                time.sleep(delay)
+                continue
+            self.logger.warning("Giving up, too many failed attempts at downloading %s", url)
+            if error is not None:
+                raise error
+            r.raise_for_status()
+            return self.receive(r, head, chunks, f, fname, part_name, f_start)
+
+    def watch_chunks(self, r):
+        """Iterate over the body of r, raising Stalled if a StallWatchdog aborts it for arriving too slowly."""
+        chunks = r.iter_content(self.CHUNK_SIZE)
+        if not self.min_download_rate:
+            for chunk in chunks:
+                yield chunk
+            return
+
+        watchdog = StallWatchdog(r, self.min_download_rate, self.stall_time)
+        try:
+            while True:
+                watchdog.reading()
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                watchdog.progress(len(chunk))
+                yield chunk
+        except Exception:
+            if watchdog.stalled:
+                raise Stalled(r.url)
+            raise
+        finally:
+            watchdog.close()
+        # An aborted connection can look like the end of the body
+        if watchdog.stalled:
+            raise Stalled(r.url)
+
+    def receive(self, r, head, chunks, f, fname, part_name, f_start):
+        """Save the rest of the body of r, after head and from chunks, as download_file was asked to."""
+        if chunks is None:
+            chunks = self.watch_chunks(r)
+
+        if fname is not None:
+            with open(part_name, 'ab' if r.status_code == 206 else 'wb') as part:
+                self.write_chunks(part, head, chunks)
+            if os.path.exists(fname):
+                os.remove(fname)
+            os.rename(part_name, fname)
+        elif f is None:
+            body = head + b''.join(chunks)
+            self.metrics.received('download', len(body))
+            return body
+        else:
+            # Discard anything written by an earlier attempt
+            f.seek(f_start)
+            f.truncate()
+            self.write_chunks(f, head, chunks)
+
+    def write_chunks(self, f, head, chunks):
+        f.write(head)
+        size = len(head)
+        for chunk in chunks:
+            f.write(chunk)
+            size += len(chunk)
+        self.metrics.received('download', size)
 
     def get_json(self, target, *parts, **opts):
-        """Get an arbitrary endpoint and parse as json"""
-        with self.http_context(self.ww):
-            uri_parts = [self.BASE_URI, self.API_VERSIONS[target], 'groups', self.group, target]
-            uri_parts = uri_parts + list(map(str, parts))
-
-            if target == 'HackGroupInfo':
-                uri_parts[4] = ''
-
-            uri = "/".join(uri_parts)
-            time.sleep(self.min_delay)
-
-            for attempt in range(self.retries):
-                try:
-                    r = self.s.get(uri, params=opts, verify=VERIFY_HTTPS, allow_redirects=False, timeout=15)
-
-                    code = r.status_code
-                    if code == 307:
-                        raise Recoverable() # NotAuthenticated()
-                    elif code == 401 or code == 403:
-                        raise Unauthorized()
-                    elif code == 404:
-                        raise NotFound()
-                    elif len(r.content) in range(60, 69):
-                        raise BadSize()
-                    elif code != 200:
-                        # TODO: Test ygError response?
-                        raise Recoverable()
-
-                    return r.json()['ygData']
-                except (ConnectionError, Timeout, Recoverable, BadSize) as e:
-                    self.logger.info("API query failed for '%s': %s", uri, e)
-                    self.logger.debug("Exception detail:", exc_info=e)
-
-                    if attempt < self.retries - 1:
-                        delay = self.backoff_time(attempt)
-                        self.logger.info("Attempt %d/%d failed, delaying for %.2f seconds", attempt+1, self.retries, delay)
-                        time.sleep(delay)
-                        continue
-                    else:
-                        raise
+        """Get an arbitrary endpoint and parse as json, by way of the response cache if there is one"""
+        if not self.cacheable(target, parts):
+            return self.fetch_json(target, *parts, **opts)
+        return self.cache.fetch(ResponseCache.key(self.group, target, parts, opts),
+                                lambda: self.fetch_json(target, *parts, **opts))
+
+    def cacheable(self, target, parts):
+        return self.cache is not None and bool(parts) and target not in self.UNCACHED_TARGETS
+
+    def fetch_json(self, target, *parts, **opts):
+        """Request an arbitrary endpoint and parse as json"""
+        return self.api_request(target, parts, opts).json()['ygData']
+
+    def stream_json(self, fname, target, *parts, **opts):
+        """Request an arbitrary endpoint, saving the raw body as fname rather than parsing it in memory.
+
+           For responses too large to hold, such as every attachment or a whole topic. Returns a StreamedJSON of
+           ygData, which reads its items from fname one at a time and removes fname on close(). Bypasses the
+           response cache."""
+        self.api_request(target, parts, opts, fname)
+        return StreamedJSON(fname, ('ygData',), temporary=True)
+
+    def api_request(self, target, parts, opts, fname=None):
+        """Request an arbitrary endpoint, retrying as the retry policy allows, and return the response.
+           If fname is given, the body is streamed into fname instead, and a failure part way through it retried."""
+        uri_parts = [self.BASE_URI, self.API_VERSIONS[target], 'groups', self.group, target]
+        uri_parts = uri_parts + list(map(str, parts))
+
+        if target == 'HackGroupInfo':
+            uri_parts[4] = ''
+
+        uri = "/".join(uri_parts)
+        stream = fname is not None
+        self.wait_for_turn()
+
+        for attempt in itertools.count():
+            self.retry_policy.wait()
+            start = time.time()
+            code = retry_after = r = None
+            try:
+                r = self.s.get(uri, params=opts, verify=VERIFY_HTTPS, allow_redirects=False, timeout=15,
+                               stream=stream)
+                if stream:
+                    chunks = r.iter_content(self.CHUNK_SIZE)
+                    size, head = self.response_size(r, chunks)
+                    self.metrics.request(target, r.status_code, time.time() - start)
+                else:
+                    size = len(r.content)
+                    self.metrics.request(target, r.status_code, time.time() - start, size)
+
+                code = r.status_code
+                retry_after = r.headers.get('Retry-After')
+                if code == 307:
+                    raise Recoverable()  # NotAuthenticated()
+                elif code == 401 or code == 403:
+                    raise Unauthorized()
+                elif code == 404:
+                    raise NotFound()
+                elif size in range(60, 69):
+                    self.metrics.bad_size(target)
+                    raise BadSize()
+                elif code != 200:
+                    # TODO: Test ygError response?
+                    raise Recoverable()
+
+                if stream:
+                    self.save_body(target, head, chunks, fname)
+                self.retry_policy.success()
+                return r
+            except Unrecoverable:
+                self.retry_policy.success()
+                raise
+            except (ConnectionError, Timeout, ChunkedEncodingError, Recoverable, BadSize) as e:
+                if isinstance(e, (ConnectionError, Timeout, ChunkedEncodingError)) and r is None:
+                    self.metrics.request(target, 'error', time.time() - start)
+                if stream and r is not None:
+                    r.close()
+                if stream and os.path.exists(fname + '.part'):
+                    os.remove(fname + '.part')
+                self.logger.info("API query failed for '%s': %s", uri, e)
+                self.logger.debug("Exception detail:", exc_info=e)
+
+                if isinstance(e, BadSize):
+                    failure = 'bad_size'
+                elif isinstance(e, Recoverable):
+                    failure = code or 'error'
+                else:
+                    failure = 'error'
+                delay = self.retry_policy.retry_delay(failure, attempt, retry_after)
+                if delay is None:
+                    raise
+                self.logger.info("Attempt %d failed, delaying for %.2f seconds", attempt+1, delay)
+                self.metrics.retry(target, delay)
+                time.sleep(delay)
+            except BaseException:
+                self.retry_policy.probe_failed()
+                raise
+
+    def save_body(self, target, head, chunks, fname):
+        """Save a streamed API response, head and then chunks, as fname by way of fname.part."""
+        size = len(head)
+        with open(fname + '.part', 'wb') as f:
+            f.write(head)
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        self.metrics.received(target, size)
+        if os.path.exists(fname):
+            os.remove(fname)
+        os.rename(fname + '.part', fname)
@@ -0,0 +1,378 @@
+# asyncio flavour of YahooGroupsAPI. Requires Python 3.6+ and the aiohttp package.
+
+import asyncio
+import itertools
+import json
+import os
+import ssl
+import time
+
+try:
+    import aiohttp
+    aiohttp_failed = False
+except ImportError as e:
+    aiohttp_failed = e
+
+from jsonstream import StreamedJSON
+from yahoogroupsapi import (YahooGroupsAPI, VERIFY_HTTPS, ResponseCache, Recoverable, BadSize, NotFound, Stalled,
+                            Unauthorized, Unrecoverable)
+
+
+class HTTPError(Exception):
+    """Raised by AsyncYahooGroupsAPI.download_file for an error response, in place of requests' HTTPError."""
+    def __init__(self, status, url, text=''):
+        super(HTTPError, self).__init__("%d error for url: %s" % (status, url))
+        self.status = status
+        self.text = text
+
+
+# Raised by AsyncYahooGroupsAPI.download_file once a download has failed for good
+DOWNLOAD_ERRORS = (HTTPError, Stalled, asyncio.TimeoutError) + ((aiohttp.ClientError,) if not aiohttp_failed else ())
+
+
+class AsyncYahooGroupsAPI(YahooGroupsAPI):
+    """YahooGroupsAPI built on aiohttp, so that many requests can be in flight from a single thread.
+
+    Endpoint stubs work as in YahooGroupsAPI, but return coroutines:
+        await yga.messages(123, 'raw')
+
+    Requests share the rate limiter and retry/backoff behaviour of YahooGroupsAPI, and at most max_in_flight
+    requests are outstanding at once. The underlying session must be closed with close(), or by using the
+    instance as an async context manager.
+    """
+
+    def __init__(self, group, cookie_jar=None, headers={}, min_delay=0, retries=15, rate_limiter=None,
+                 max_in_flight=100, cache=None, metrics=None, retry_policy=None, download_timeout=(15, 60),
+                 min_download_rate=0, stall_time=60):
+        if aiohttp_failed:
+            self.logger.fatal("Attempting to use the asyncio client, but aiohttp failed to import.")
+            raise aiohttp_failed
+
+        super(AsyncYahooGroupsAPI, self).__init__(group, cookie_jar, headers, min_delay, retries, rate_limiter,
+                                                  cache, metrics, retry_policy, download_timeout, min_download_rate,
+                                                  stall_time)
+        # Requests go through an aiohttp session instead, which session() creates on the event loop
+        self.cookies = {c.name: c.value for c in cookie_jar} if cookie_jar else {}
+        self.headers = dict(self.s.headers)
+        self.s.close()
+        self.s = None
+        self.max_in_flight = max_in_flight
+        self.pending = {}
+        self.in_flight = None
+
+    def session(self):
+        # aiohttp sessions must be created from within the event loop they are used on
+        if self.s is None:
+            ssl_context = ssl.create_default_context(cafile=VERIFY_HTTPS)
+            self.s = aiohttp.ClientSession(headers=self.headers, cookies=self.cookies,
+                                           connector=aiohttp.TCPConnector(ssl=ssl_context, limit=self.max_in_flight))
+            self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        return self.s
+
+    async def close(self):
+        if self.s is not None:
+            await self.s.close()
+            self.s = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def wait_for_turn(self):
+        """Wait until the rate limiter allows another request, without blocking the event loop."""
+        start = time.time()
+        wait = self.rate_limiter.try_acquire()
+        while wait:
+            await asyncio.sleep(wait)
+            wait = self.rate_limiter.try_acquire()
+        self.metrics.waited(time.time() - start)
+
+    async def wait_for_breaker(self):
+        """Wait while the retry policy's circuit breaker holds requests, without blocking the event loop."""
+        wait = self.retry_policy.wait_time()
+        while wait:
+            await asyncio.sleep(wait)
+            wait = self.retry_policy.wait_time()
+
+    async def download_file(self, url, f=None, fname=None, **args):
+        """Download url, returning its content or streaming it into the file object f.
+
+           As YahooGroupsAPI.download_file, fname streams into a resumable fname.part file instead, and connections
+           that fail, time out or stall are retried. Raises HTTPError for error responses."""
+        self.session()
+        part_name = fname + '.part' if fname else None
+        f_start = f.tell() if f is not None else None
+        connect_timeout, read_timeout = self.download_timeout
+        # No limit on the whole download, which may be large, only on connecting and on each wait for more of it
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=connect_timeout, sock_read=read_timeout)
+        await self.wait_for_turn()
+
+        for attempt in itertools.count():
+            await self.wait_for_breaker()
+            offset = os.path.getsize(part_name) if part_name and os.path.exists(part_name) else 0
+            headers = {'Range': 'bytes=%d-' % offset} if offset else {}
+
+            try:
+                async with self.in_flight, await self.request('download', url, headers=headers,
+                                                              timeout=timeout, **args) as r:
+                    status = r.status
+                    if status == 416 and offset:
+                        self.logger.info("Could not resume download of %s, restarting", url)
+                        os.remove(part_name)
+                        self.metrics.retry('download')
+                        # The server answered, so this isn't a failure to hold other requests back for
+                        self.retry_policy.success()
+                        continue
+                    elif status != 200 and status != 206:
+                        text = await r.text(errors='replace')
+                        if status == 400 and 'malware' in text:
+                            self.logger.warning("Got 400 error indicating malware for %s, skipping", url)
+                            self.retry_policy.success()
+                            return await self.write_body(text.encode('utf-8'), None, f, fname, part_name, status)
+                        elif not self.retry_policy.retryable(status):
+                            self.logger.error("Unknown %d error for %s, giving up on this download", status, url)
+                            self.retry_policy.success()
+                            raise HTTPError(status, url, text)
+                        self.logger.info("Got %d error for %s", status, url)
+                        if await self.backoff(status, attempt, r.headers.get('Retry-After')):
+                            continue
+                        self.logger.warning("Giving up, too many failed attempts at downloading %s", url)
+                        raise HTTPError(status, url, text)
+
+                    size = r.content_length if 'Content-Encoding' not in r.headers else None
+                    if status == 206 and '/' in r.headers.get('Content-Range', ''):
+                        size = int(r.headers['Content-Range'].rsplit('/', 1)[1])
+                    head = b''
+                    if size is None:
+                        head = await self.read_head(r)
+                        size = len(head)
+                    if size in range(60, 69):
+                        self.logger.info("Got potentially invalid size of %d for %s", size, url)
+                        self.metrics.bad_size('download')
+                        if await self.backoff('bad_size', attempt):
+                            continue
+                        self.logger.warning("Giving up, too many potentially failed attempts at downloading %s", url)
+                    else:
+                        self.retry_policy.success()
+
+                    return await self.write_body(head, r, f, fname, part_name, status)
+            except (aiohttp.ClientError, asyncio.TimeoutError, Stalled) as e:
+                self.logger.info("Download of %s failed: %s", url, e)
+                if f is not None:
+                    f.seek(f_start)
+                    f.truncate()
+                # A partly written fname.part is kept, and resumed from by the next attempt
+                if await self.backoff('error', attempt):
+                    continue
+                self.logger.warning("Giving up, too many failed attempts at downloading %s", url)
+                raise
+            except BaseException:
+                # Including cancellation, which would otherwise leave a probe outstanding and the breaker stuck
+                self.retry_policy.probe_failed()
+                raise
+
+    async def request(self, endpoint, url, **args):
+        """Make a request through the session, recording it in the metrics under endpoint."""
+        start = time.time()
+        try:
+            r = await self.session().get(url, **args)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.metrics.request(endpoint, 'error', time.time() - start)
+            raise
+        self.metrics.request(endpoint, r.status, time.time() - start)
+        return r
+
+    async def read_head(self, r):
+        head = b''
+        while len(head) < 69:
+            chunk = await r.content.read(69 - len(head))
+            if not chunk:
+                break
+            head += chunk
+        return head
+
+    async def write_body(self, head, r, f, fname, part_name, status):
+        chunks = self.watch_chunks(r) if r is not None else None
+
+        if fname is not None:
+            with open(part_name, 'ab' if status == 206 else 'wb') as part:
+                await self.write_chunks(part, head, chunks)
+            if os.path.exists(fname):
+                os.remove(fname)
+            os.rename(part_name, fname)
+        elif f is None:
+            body = [head]
+            if chunks is not None:
+                async for chunk in chunks:
+                    body.append(chunk)
+            body = b''.join(body)
+            self.metrics.received('download', len(body))
+            return body
+        else:
+            await self.write_chunks(f, head, chunks)
+
+    async def write_chunks(self, f, head, chunks):
+        f.write(head)
+        size = len(head)
+        if chunks is not None:
+            async for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        self.metrics.received('download', size)
+
+    async def watch_chunks(self, r):
+        """Iterate over the body of r, raising Stalled if less than min_download_rate bytes a second of it arrive over
+           stall_time seconds spent waiting on it. A body that stops arriving altogether is caught by the read timeout
+           instead."""
+        chunks = r.content.iter_chunked(self.CHUNK_SIZE).__aiter__()
+        read_time = 0
+        received = 0
+        while True:
+            # Only time spent waiting on the connection counts, not time spent by the consumer with each chunk
+            start = time.time()
+            try:
+                chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                return
+            read_time += time.time() - start
+            yield chunk
+            if not self.min_download_rate:
+                continue
+            received += len(chunk)
+            if read_time >= self.stall_time:
+                if received < self.min_download_rate * read_time:
+                    self.logger.info("Download of %s stalled at %.1f bytes/s", r.url, received / read_time)
+                    raise Stalled(str(r.url))
+                read_time = 0
+                received = 0
+
+    async def backoff(self, failure, attempt, retry_after=None):
+        """Sleep before retrying a failed download, returning False instead if it should not be retried."""
+        delay = self.retry_policy.retry_delay(failure, attempt, retry_after)
+        if delay is None:
+            return False
+        self.logger.info("Attempt %d, delaying for %.2f seconds", attempt+1, delay)
+        self.metrics.retry('download', delay)
+        await asyncio.sleep(delay)
+        return True
+
+    async def get_json(self, target, *parts, **opts):
+        """Get an arbitrary endpoint and parse as json, by way of the response cache if there is one.
+           Concurrent requests for the same response share a single fetch."""
+        if not self.cacheable(target, parts):
+            return await self.fetch_json(target, *parts, **opts)
+
+        key = ResponseCache.key(self.group, target, parts, opts)
+        try:
+            return self.cache.get(key)
+        except KeyError:
+            pass
+
+        task = self.pending.get(key)
+        if task is None:
+            async def fetch():
+                data = await self.fetch_json(target, *parts, **opts)
+                self.cache.put(key, data)
+                return json.dumps(data)
+            task = self.pending[key] = asyncio.ensure_future(fetch())
+            task.add_done_callback(lambda t: self.pending.pop(key, None))
+        # Each caller parses its own copy of the response
+        return json.loads(await asyncio.shield(task))
+
+    async def fetch_json(self, target, *parts, **opts):
+        """Request an arbitrary endpoint and parse as json"""
+        body = await self.api_request(target, parts, opts)
+        return json.loads(body.decode('utf-8'))['ygData']
+
+    async def stream_json(self, fname, target, *parts, **opts):
+        """Request an arbitrary endpoint, saving the raw body as fname rather than parsing it in memory.
+
+           As YahooGroupsAPI.stream_json, returns a StreamedJSON of ygData which removes fname on close()."""
+        await self.api_request(target, parts, opts, fname)
+        return StreamedJSON(fname, ('ygData',), temporary=True)
+
+    async def api_request(self, target, parts, opts, fname=None):
+        """Request an arbitrary endpoint, retrying as the retry policy allows, and return the body.
+           If fname is given, the body is saved as fname instead, and a failure part way through it retried."""
+        s = self.session()
+        uri_parts = [self.BASE_URI, self.API_VERSIONS[target], 'groups', self.group, target]
+        uri_parts = uri_parts + list(map(str, parts))
+
+        if target == 'HackGroupInfo':
+            uri_parts[4] = ''
+
+        uri = "/".join(uri_parts)
+        params = {k: str(v) for k, v in opts.items()}
+        if fname is None:
+            timeout = aiohttp.ClientTimeout(total=15)
+        else:
+            # A large body may take a while to arrive, so only connecting and each wait for more of it are limited
+            timeout = aiohttp.ClientTimeout(total=None, sock_connect=15, sock_read=15)
+        await self.wait_for_turn()
+
+        for attempt in itertools.count():
+            await self.wait_for_breaker()
+            start = time.time()
+            code = retry_after = body = None
+            try:
+                async with self.in_flight, s.get(uri, params=params, allow_redirects=False, timeout=timeout) as r:
+                    code = r.status
+                    retry_after = r.headers.get('Retry-After')
+                    if fname is None:
+                        body = await r.read()
+                        size = len(body)
+                    else:
+                        size = await self.save_chunks(r, fname + '.part')
+                self.metrics.request(target, code, time.time() - start, size)
+
+                if code == 307:
+                    raise Recoverable()  # NotAuthenticated()
+                elif code == 401 or code == 403:
+                    raise Unauthorized()
+                elif code == 404:
+                    raise NotFound()
+                elif size in range(60, 69):
+                    self.metrics.bad_size(target)
+                    raise BadSize()
+                elif code != 200:
+                    raise Recoverable()
+
+                self.retry_policy.success()
+                if fname is not None:
+                    if os.path.exists(fname):
+                        os.remove(fname)
+                    os.rename(fname + '.part', fname)
+                return body
+            except Unrecoverable:
+                self.retry_policy.success()
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError, Recoverable, BadSize) as e:
+                if isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError)):
+                    self.metrics.request(target, 'error', time.time() - start)
+                self.logger.info("API query failed for '%s': %s", uri, e)
+                self.logger.debug("Exception detail:", exc_info=e)
+
+                failure = 'bad_size' if isinstance(e, BadSize) else code or 'error'
+                delay = self.retry_policy.retry_delay(failure, attempt, retry_after)
+                if delay is None:
+                    raise
+                self.logger.info("Attempt %d failed, delaying for %.2f seconds", attempt+1, delay)
+                self.metrics.retry(target, delay)
+                await asyncio.sleep(delay)
+            except BaseException:
+                self.retry_policy.probe_failed()
+                raise
+            finally:
+                if fname is not None and os.path.exists(fname + '.part'):
+                    os.remove(fname + '.part')
+
+    async def save_chunks(self, r, fname):
+        """Save the body of r as fname, returning its size."""
+        size = 0
+        with open(fname, 'wb') as f:
+            async for chunk in r.content.iter_chunked(self.CHUNK_SIZE):
+                f.write(chunk)
+                size += len(chunk)
+        return size